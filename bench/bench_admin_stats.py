@@ -0,0 +1,170 @@
+"""Admin statistikasi ko'rinishlari: indekslarsiz eski so'rovlar va yangi so'rovlar.
+
+Ishga tushirish:
+    python bench/bench_admin_stats.py --users 1000000
+"""
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from common import load_bot, cleanup
+
+
+# ===== ESKI SO'ROVLAR (o'zgarishdan oldingi ko'rinishi) =====
+def legacy_update_daily_stats(conn):
+    today = datetime.utcnow().date().isoformat()
+    cursor = conn.cursor()
+    cursor.execute('INSERT OR IGNORE INTO stats (date) VALUES (?)', (today,))
+    cursor.execute("SELECT COUNT(*) FROM users WHERE last_active > datetime('now', '-1 day')")
+    active_users = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM users WHERE DATE(created_date) = DATE('now')")
+    new_users = cursor.fetchone()[0]
+    cursor.execute("SELECT SUM(total_pdfs), SUM(total_files) FROM users WHERE DATE(last_active) = DATE('now')")
+    daily = cursor.fetchone()
+    cursor.execute(
+        'UPDATE stats SET new_users = ?, active_users = ?, total_pdfs = ?, total_files = ? WHERE date = ?',
+        (new_users, active_users, daily[0] or 0, daily[1] or 0, today)
+    )
+    conn.commit()
+
+
+def legacy_get_bot_stats(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM users')
+    cursor.execute("SELECT COUNT(*) FROM users WHERE last_active > datetime('now', '-1 day')")
+    cursor.execute("SELECT COUNT(*) FROM users WHERE DATE(created_date) = DATE('now')")
+    cursor.execute('SELECT SUM(total_pdfs) FROM users')
+    cursor.execute('SELECT SUM(total_files) FROM users')
+    return cursor.fetchone()
+
+
+def legacy_get_user_stats(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT user_id, username, first_name, last_active, total_pdfs, total_files
+    FROM users ORDER BY last_active DESC LIMIT 10
+    ''').fetchall()
+    cursor.execute('''
+    SELECT user_id, username, first_name, total_pdfs, total_files
+    FROM users ORDER BY total_pdfs DESC LIMIT 10
+    ''').fetchall()
+
+
+def legacy_get_daily_stats(conn):
+    conn.execute('''
+    SELECT date, new_users, active_users, total_pdfs, total_files
+    FROM stats WHERE date >= date('now', '-7 days') ORDER BY date DESC
+    ''').fetchall()
+
+
+LEGACY_VIEWS = {
+    "admin_panel": [legacy_update_daily_stats, legacy_get_bot_stats, legacy_get_daily_stats],
+    "admin_stats": [legacy_update_daily_stats, legacy_get_bot_stats, legacy_get_user_stats],
+    "admin_users": [legacy_get_user_stats],
+    "admin_daily": [legacy_get_daily_stats],
+}
+
+
+def seed(path, users):
+    """Sintetik foydalanuvchilar bazasini yaratish"""
+    rnd = random.Random(42)
+    now = datetime.utcnow()
+    fmt = '%Y-%m-%d %H:%M:%S'
+
+    def rows():
+        for user_id in range(1, users + 1):
+            created = now - timedelta(seconds=rnd.randint(0, 400 * 86400))
+            active = created + (now - created) * rnd.random()
+            yield (
+                user_id, f"user{user_id}", f"User {user_id}",
+                created.strftime(fmt), active.strftime(fmt),
+                rnd.randint(0, 50), rnd.randint(0, 500)
+            )
+
+    conn = sqlite3.connect(path)
+    conn.executemany('''
+    INSERT INTO users (user_id, username, first_name, created_date, last_active, total_pdfs, total_files)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows())
+    conn.commit()
+    conn.close()
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+async def measure_async(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+async def run_new(bot, repeat):
+    views = {
+        "admin_panel": lambda: asyncio.gather(bot.get_bot_stats(), bot.get_daily_stats(7)),
+        "admin_stats": lambda: asyncio.gather(bot.get_bot_stats(), bot.get_user_stats()),
+        "admin_users": lambda: bot.get_user_stats(),
+        "admin_daily": lambda: bot.get_daily_stats(14),
+    }
+    return {name: await measure_async(fn, repeat) for name, fn in views.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pdfuz_bench_")
+    try:
+        bot = load_bot(workdir)
+        path = bot.DB_PATH
+
+        print(f"{args.users} ta foydalanuvchi yaratilmoqda...")
+        seed(path, args.users)
+
+        # "Oldin": migratsiyadan oldingi holat - indekslar yo'q
+        conn = sqlite3.connect(path)
+        for index in ('idx_users_last_active', 'idx_users_created_date', 'idx_users_total_pdfs'):
+            conn.execute(f'DROP INDEX IF EXISTS {index}')
+        conn.execute('PRAGMA user_version = 0')
+        conn.commit()
+
+        before = {
+            name: measure(lambda: [fn(conn) for fn in fns], args.repeat)
+            for name, fns in LEGACY_VIEWS.items()
+        }
+        conn.close()
+
+        # "Keyin": migratsiya va yangi so'rovlar
+        start = time.perf_counter()
+        bot.init_database()
+        print(f"Migratsiya: {time.perf_counter() - start:.1f} s")
+
+        after = asyncio.run(run_new(bot, args.repeat))
+        bot.db.close()
+
+        print(f"\n{'view':<14} {'oldin, ms':>12} {'keyin, ms':>12}")
+        for name in LEGACY_VIEWS:
+            print(f"{name:<14} {before[name]:>12.1f} {after[name]:>12.1f}")
+    finally:
+        cleanup(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Katta XLSX kataklarida clean_text narxini o'lchash (eski, yangi va paketli).
+
+Ishga tushirish:
+    python bench/bench_clean_text.py --rows 100000 --cols 10
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import openpyxl
+
+from common import load_bot, cleanup
+
+
+def legacy_clean_text(text):
+    """Eski usul: har bir almashtirish uchun alohida str.replace"""
+    if not text:
+        return ""
+    try:
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        replacements = {
+            'â€™': "'",
+            'â€"': "-",
+            'â€"': '"',
+            'â€˜': "'",
+            'â€™': "'",
+            'â€"': '"',
+            'â€"': '"',
+            'â€"': '-',
+            'â€"': '--',
+            '\x00': '',
+            '\r\n': '\n',
+            '\r': '\n',
+        }
+        for old, new in replacements.items():
+            text = text.replace(old, new)
+        text = text.strip()
+        if not text or text.isspace():
+            return ""
+        return text
+    except Exception:
+        return ""
+
+
+def make_workbook(path, rows, cols):
+    rnd = random.Random(7)
+    words = ["Toshkent", "Samarqand", "Ўзбекистон", "  bo'sh joy  ", "hisobot", "№ 15"]
+    # Buzilgan (mojibake) va Windows qatorli matnlar kamdan-kam uchraydi
+    rare = ["don’t".encode().decode("cp1252"), "qator\r\nyangi"]
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Data")
+    for r in range(rows):
+        row = []
+        for c in range(cols):
+            kind = rnd.random()
+            if kind < 0.4:
+                row.append(rnd.randint(0, 10 ** 6))
+            elif kind < 0.5:
+                row.append(None)
+            else:
+                text = " ".join(rnd.choice(words) for _ in range(rnd.randint(1, 4)))
+                if rnd.random() < 0.02:
+                    text += " " + rnd.choice(rare)
+                row.append(text)
+        ws.append(row)
+    wb.save(path)
+
+
+def measure(name, cells, fn, repeat=5):
+    # Eng yaxshi natija - boshqa jarayonlar shovqinini kamaytirish uchun
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f"{name:<28} {elapsed:>7.2f} s  {elapsed * 1e9 / cells:>8.0f} ns/katak")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--cols", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pdfuz_bench_")
+    try:
+        bot = load_bot(workdir)
+        path = os.path.join(workdir, "bench.xlsx")
+        make_workbook(path, args.rows, args.cols)
+
+        # Faylni o'qish narxi normalizatsiyaga aralashmasligi uchun qatorlar oldindan o'qiladi
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        rows = [["" if cell is None else str(cell) for cell in row]
+                for row in wb.active.iter_rows(values_only=True)]
+        wb.close()
+        cells = sum(len(row) for row in rows)
+
+        measure("legacy clean_text", cells,
+                lambda: [[legacy_clean_text(cell) for cell in row] for row in rows])
+        measure("clean_text", cells,
+                lambda: [[bot.clean_text(cell) for cell in row] for row in rows])
+        measure("clean_texts (qator)", cells,
+                lambda: [bot.clean_texts(row) for row in rows])
+
+        # To'liq oqim: read_only o'qish + tozalash
+        start = time.perf_counter()
+        count = 0
+        for _, sheet_rows in bot.process_excel_file(path):
+            for _ in sheet_rows:
+                count += 1
+        elapsed = time.perf_counter() - start
+        print(f"{'process_excel_file':<28} {elapsed:>7.2f} s  {count} qator")
+        bot.db.close()
+    finally:
+        cleanup(workdir)
+
+
+if __name__ == "__main__":
+    main()
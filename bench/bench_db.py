@@ -0,0 +1,100 @@
+"""Har chaqiruvda ulanish ochish va doimiy WAL ulanishni solishtirish.
+
+Ishga tushirish:
+    python bench/bench_db.py --users 2000 --ops 20000
+"""
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+
+from common import load_bot, cleanup
+
+
+# Eski usul: har bir yordamchi o'z ulanishini ochib, commit qilib yopadi
+def legacy_update_user_activity(path, user_id):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute('''
+    UPDATE users 
+    SET last_active = datetime('now')
+    WHERE user_id = ?
+    ''', (user_id,))
+    conn.commit()
+    conn.close()
+
+
+def legacy_is_admin(path, user_id):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT 1 FROM admins WHERE user_id = ?', (user_id,))
+    result = cursor.fetchone()
+    conn.close()
+    return result is not None
+
+
+def seed(path, users):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (user_id, username, first_name, last_active) "
+        "VALUES (?, ?, ?, datetime('now'))",
+        [(i, f"user{i}", f"User {i}") for i in range(1, users + 1)]
+    )
+    conn.executemany("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", [(i,) for i in range(1, 11)])
+    conn.commit()
+    conn.close()
+
+
+def report(name, ops, elapsed):
+    print(f"{name:<32} {ops / elapsed:>10.0f} op/s  {elapsed * 1e6 / ops:>8.1f} us/op")
+
+
+async def run_new(bot, ids):
+    # update_user_activity buferga yozadi - bazaga yozish vaqti flush bilan birga o'lchanadi
+    start = time.perf_counter()
+    for user_id in ids:
+        bot.update_user_activity(user_id)
+    await bot.activity_buffer.flush()
+    report("Database: update_user_activity", len(ids), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for user_id in ids:
+        await bot.is_admin(user_id)
+    report("Database: is_admin", len(ids), time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--ops", type=int, default=20000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pdfuz_bench_")
+    try:
+        bot = load_bot(workdir)
+        path = os.path.abspath(bot.DB_PATH)
+        seed(path, args.users)
+        ids = [random.randint(1, args.users) for _ in range(args.ops)]
+
+        # Eski usul journal_mode=DELETE da ishlagan, shuning uchun avval uni o'lchaymiz
+        start = time.perf_counter()
+        for user_id in ids:
+            legacy_update_user_activity(path, user_id)
+        report("connect-per-call: update", len(ids), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for user_id in ids:
+            legacy_is_admin(path, user_id)
+        report("connect-per-call: is_admin", len(ids), time.perf_counter() - start)
+
+        asyncio.run(run_new(bot, ids))
+        bot.db.close()
+    finally:
+        cleanup(workdir)
+
+
+if __name__ == "__main__":
+    main()
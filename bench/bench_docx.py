@@ -0,0 +1,93 @@
+"""DOCX ni multi_cell bilan va TextLayout bilan PDF ga aylantirishni solishtirish.
+
+Ishga tushirish:
+    python bench/bench_docx.py --pages 300
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import docx
+from fpdf import FPDF
+
+from common import load_bot, cleanup
+
+WORDS = ("hujjat", "sahifa", "matn", "jadval", "fayl", "PDF", "Toshkent", "ma'lumot",
+         "Ўзбекистон", "китоб", "natija", "tezlik", "foydalanuvchi", "xabar", "bo'lim")
+
+
+def make_document(path, pages):
+    """Taxminan `pages` sahifalik hujjat: sarlavhalar, paragraflar va jadvallar"""
+    rnd = random.Random(42)
+    doc = docx.Document()
+    # Bir sahifaga taxminan 5 paragraf (~80 so'z) sig'adi
+    for n in range(pages * 5):
+        if n % 20 == 0:
+            doc.add_heading(f"{n // 20 + 1}-bo'lim", level=1)
+        if n % 50 == 25:
+            table = doc.add_table(rows=6, cols=4)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 6)))
+        doc.add_paragraph(" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(40, 120))))
+    doc.save(path)
+
+
+def legacy_render(bot, path):
+    """Eski usul: har paragraf uchun multi_cell (jadvallar tashlab yuboriladi)"""
+    pdf = FPDF()
+    bot.add_unicode_support_to_pdf(pdf)
+    pdf.set_auto_page_break(True, 10)
+    paragraphs = [bot.clean_text(p.text) for p in docx.Document(path).paragraphs]
+    pdf.add_page()
+    pdf.set_font_size(12)
+    for para in paragraphs:
+        if para:
+            pdf.multi_cell(0, 8, para)
+            pdf.ln(4)
+    data = pdf.output()
+    return pdf.pages_count, len(data)
+
+
+def new_render(bot, path):
+    pdf = FPDF()
+    unicode_supported = bot.add_unicode_support_to_pdf(pdf)
+    pdf.set_auto_page_break(True, 10)
+    layout = bot.TextLayout(pdf, unicode_supported)
+    layout.add_blocks(bot.process_docx_file(path))
+    layout.emit()
+    data = pdf.output()
+    return pdf.pages_count, len(data)
+
+
+def measure(name, fn, *args):
+    start = time.perf_counter()
+    pages, size = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {pages:>5} sahifa  {elapsed:>7.2f} s  {pages / elapsed:>8.1f} sahifa/s  {size / 1024:>8.0f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pdfuz_bench_")
+    try:
+        bot = load_bot(workdir)
+        path = os.path.join(workdir, "bench.docx")
+        make_document(path, args.pages)
+
+        measure("multi_cell (eski)", legacy_render, bot, path)
+        measure("TextLayout", new_render, bot, path)
+        # Ikkinchi hujjat - belgi kengliklari keshi allaqachon to'la
+        measure("TextLayout (issiq kesh)", new_render, bot, path)
+        bot.db.close()
+    finally:
+        cleanup(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""Konvertatsiya oqimi benchmarki: Telegramsiz, soxta context.bot bilan.
+
+Deterministik fayllar to'plamida (telefon JPEG lari, shaffof PNG lar, uzun DOCX,
+keng va uzun XLSX) normalize_image, process_docx_file, process_excel_file va
+create_and_send_pdf o'lchanadi. Har bir ssenariy alohida jarayonda ishlaydi -
+eng yuqori RSS boshqa ssenariylar bilan aralashmaydi. Natija JSON: o'tkazuvchanlik,
+p50/p95/p99 kechikish, eng yuqori RSS va chiqish hajmi.
+
+Ishga tushirish:
+    python bench/bench_pipeline.py --output before.json
+    python bench/bench_pipeline.py --output after.json --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+from collections import Counter
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from common import ROOT, load_bot, cleanup, percentile, StubContext
+from corpus import build_corpus
+
+# Natija formati o'zgarsa oshiriladi
+REPORT_SCHEMA = 1
+
+# ssenariy -> (amal, to'plamdagi guruh)
+SCENARIOS = {
+    "ingest_jpeg_phone": ("ingest", "jpeg_phone"),
+    "parse_docx_long": ("parse_docx", "docx_long"),
+    "parse_xlsx_wide": ("parse_xlsx", "xlsx_wide"),
+    "parse_xlsx_tall": ("parse_xlsx", "xlsx_tall"),
+    "pdf_jpeg_phone": ("pdf", "jpeg_phone"),
+    "pdf_png_alpha": ("pdf", "png_alpha"),
+    "pdf_docx_long": ("pdf", "docx_long"),
+    "pdf_xlsx_wide": ("pdf", "xlsx_wide"),
+    "pdf_xlsx_tall": ("pdf", "xlsx_tall"),
+}
+
+# Solishtirishda: ko'rsatkich -> katta qiymat yomonmi
+COMPARED = {
+    "latency_ms.p50": True,
+    "latency_ms.p95": True,
+    "throughput_ops": False,
+    "peak_rss_bytes": True,
+    "peak_render_rss_bytes": True,
+    "output_size": True,
+}
+
+
+# ===== SSENARIY (alohida jarayonda) =====
+def _peak_rss(pid="self"):
+    """Jarayonning eng yuqori RSS i (bayt)
+
+    Linux da /proc dagi VmHWM: ru_maxrss fork/exec da ota jarayonnikini meros oladi
+    (masalan, to'plamni yaratgan jarayonning cho'qqisi), VmHWM esa exec da nollanadi.
+    """
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None or pid != "self":
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux da KB, macOS da bayt
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _render_workers_peak_rss(engine):
+    # Jarayonlar to'xtatilishidan oldin o'qiladi
+    executor = engine._executor
+    if executor is None:
+        return None
+    peaks = [_peak_rss(process.pid) for process in executor._processes.values()]
+    peaks = [peak for peak in peaks if peak is not None]
+    return max(peaks) if peaks else None
+
+
+class Scenario:
+    """Bitta ssenariy: har bir amal uchun to'plam fayllari nusxasi tayyorlanadi (vaqtga kirmaydi)"""
+
+    def __init__(self, bot, kind, sources):
+        self.bot = bot
+        self.kind = kind
+        self.sources = sources
+        self.context = StubContext()
+        self._copies = itertools.count(1)
+
+    def prepare(self):
+        # create_and_send_pdf va normalize_image fayllarni o'zgartiradi/o'chiradi
+        n = next(self._copies)
+        paths = []
+        for source in self.sources:
+            name, ext = os.path.splitext(os.path.basename(source))
+            path = os.path.join("temp", f"{n}_{name}{ext}")
+            shutil.copyfile(source, path)
+            paths.append(path)
+
+        if self.kind == "pdf":
+            entries = []
+            for path in paths:
+                entry = {"path": path}
+                if path.endswith(".jpg"):
+                    # Rasm sifatida kelgan foto qabul qilishda kichraytiriladi
+                    entry["width"], entry["height"] = self.bot.normalize_image(path)
+                entries.append(entry)
+            return n, entries
+        return n, paths
+
+    async def run(self, n, prepared):
+        """Amalni bajarib, chiqish hajmini qaytarish"""
+        bot = self.bot
+        if self.kind == "ingest":
+            size = 0
+            for path in prepared:
+                bot.normalize_image(path)
+                size += os.path.getsize(path)
+                os.remove(path)
+            return size
+
+        if self.kind == "parse_docx":
+            blocks = bot.process_docx_file(prepared[0])
+            os.remove(prepared[0])
+            return len(blocks)
+
+        if self.kind == "parse_xlsx":
+            rows = 0
+            for _, sheet_rows in bot.process_excel_file(prepared[0]):
+                rows += sum(1 for _ in sheet_rows)
+            os.remove(prepared[0])
+            return rows
+
+        # Har bir amal - alohida foydalanuvchi, sessiyalar aralashmaydi
+        calls = self.context.bot.calls
+        start = len(calls)
+        await bot.create_and_send_pdf(n, self.context, prepared, 1)
+        return sum(size for method, chat_id, size in calls[start:]
+                   if method == "send_document" and chat_id == n)
+
+
+OUTPUT_UNITS = {"ingest": "bytes", "parse_docx": "blocks", "parse_xlsx": "rows", "pdf": "bytes"}
+
+
+async def drive(scenario, iterations, warmup, concurrency):
+    # Qizdirish: render jarayonlari, shriftlar va import keshlari
+    for _ in range(warmup):
+        await scenario.run(*scenario.prepare())
+    scenario.context.bot.calls.clear()
+
+    jobs = [scenario.prepare() for _ in range(iterations)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    outputs = []
+
+    async def one(n, prepared):
+        async with semaphore:
+            started = time.perf_counter()
+            outputs.append(await scenario.run(n, prepared))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n, prepared) for n, prepared in jobs))
+    wall = time.perf_counter() - started
+    return wall, sorted(latencies), outputs, _render_workers_peak_rss(scenario.bot.render_engine)
+
+
+def run_scenario(name, corpus_dir, manifest, args):
+    kind, group = SCENARIOS[name]
+    sources = [os.path.join(corpus_dir, file) for file in manifest["groups"][group]]
+    workdir = tempfile.mkdtemp(prefix="pdfuz_bench_")
+    try:
+        bot = load_bot(workdir, config={
+            "RENDER_WORKERS": args.workers,
+            "JOB_CONCURRENCY": args.workers,
+            "SESSION_STORE": "memory",
+            "IMAGE_CACHE_BYTES": 0,
+            "PDF_CACHE_DAYS": 0,
+        })
+        os.makedirs("temp", exist_ok=True)
+        scenario = Scenario(bot, kind, sources)
+        wall, latencies, outputs, render_peak = asyncio.run(
+            drive(scenario, args.iterations, args.warmup, args.concurrency)
+        )
+        bot.render_engine.shutdown()
+        bot.session_store.close()
+        bot.db.close()
+
+        calls = scenario.context.bot.calls
+        errors = sum(1 for method, _, text in calls if method == "send_message" and text.startswith("❌"))
+        return {
+            "files_per_op": len(sources),
+            "input_bytes": manifest["bytes"][group],
+            "iterations": len(latencies),
+            "errors": errors,
+            "throughput_ops": len(latencies) / wall,
+            "throughput_files": len(latencies) * len(sources) / wall,
+            "latency_ms": {
+                "p50": percentile(latencies, 50) * 1000,
+                "p95": percentile(latencies, 95) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "mean": sum(latencies) / len(latencies) * 1000,
+                "max": latencies[-1] * 1000,
+            },
+            "peak_rss_bytes": _peak_rss(),
+            # Render jarayonlarining eng kattasi (faqat pdf ssenariylarida)
+            "peak_render_rss_bytes": render_peak,
+            "output_size": sum(outputs) / len(outputs),
+            "output_unit": OUTPUT_UNITS[kind],
+            "bot_calls": dict(Counter(method for method, _, _ in calls)),
+        }
+    finally:
+        cleanup(workdir)
+
+
+# ===== HISOBOT =====
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return {"commit": commit, "dirty": bool(dirty)}
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metric(result, path):
+    value = result
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(report, baseline, threshold):
+    """Asosiy natija bilan solishtirish; threshold dan ko'p yomonlashganlar ro'yxati"""
+    if baseline.get("corpus", {}).get("id") != report["corpus"]["id"]:
+        print("⚠️ Fayllar to'plami boshqa - natijalar to'g'ridan-to'g'ri solishtirilmaydi", file=sys.stderr)
+    if baseline.get("params") != report["params"]:
+        print(f"⚠️ Parametrlar boshqa: {baseline.get('params')} -> {report['params']}", file=sys.stderr)
+
+    regressions = []
+    print(f"\n{'ssenariy':<20} {'ko`rsatkich':<22} {'oldin':>12} {'keyin':>12} {'farq':>8}", file=sys.stderr)
+    for name, result in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            continue
+        for path, higher_is_worse in COMPARED.items():
+            before, after = _metric(old, path), _metric(result, path)
+            if not before or after is None:
+                continue
+            change = after / before - 1
+            worse = change > threshold if higher_is_worse else change < -threshold
+            mark = "  ❗" if worse else ""
+            print(f"{name:<20} {path:<22} {before:>12.1f} {after:>12.1f} {change:>+7.1%}{mark}", file=sys.stderr)
+            if worse:
+                regressions.append((name, path, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="faqat shu ssenariylar (bir necha marta berish mumkin)")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=1, help="bir vaqtda bajariladigan amallar")
+    parser.add_argument("--workers", type=int, default=None, help="RENDER_WORKERS (standart: --concurrency)")
+    parser.add_argument("--corpus", help="to'plam papkasi (qayta ishlatiladi; standart: vaqtinchalik)")
+    parser.add_argument("--docx-pages", type=int, default=50)
+    parser.add_argument("--xlsx-rows", type=int, default=5000)
+    parser.add_argument("--output", help="JSON fayl (standart: stdout)")
+    parser.add_argument("--compare", help="solishtiriladigan avvalgi JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="yomonlashish chegarasi (standart: 0.10)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.workers = args.workers or args.concurrency
+
+    corpus_dir = args.corpus or tempfile.mkdtemp(prefix="pdfuz_corpus_")
+    corpus_dir = os.path.abspath(corpus_dir)
+    try:
+        manifest = build_corpus(corpus_dir, docx_pages=args.docx_pages, tall_rows=args.xlsx_rows)
+
+        if args.child:
+            result = run_scenario(args.child, corpus_dir, manifest, args)
+            with open(args.result, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            return
+
+        report = {
+            "schema": REPORT_SCHEMA,
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {
+                "iterations": args.iterations, "warmup": args.warmup,
+                "concurrency": args.concurrency, "workers": args.workers,
+            },
+            "corpus": {"id": manifest["id"], "spec": manifest["spec"], "bytes": manifest["bytes"]},
+            "scenarios": {},
+        }
+        for name in args.scenario or SCENARIOS:
+            print(f"▶ {name}", file=sys.stderr)
+            result_path = os.path.join(corpus_dir, f".result_{name}.json")
+            command = [
+                sys.executable, os.path.abspath(__file__), "--child", name, "--result", result_path,
+                "--corpus", corpus_dir, "--docx-pages", str(args.docx_pages),
+                "--xlsx-rows", str(args.xlsx_rows), "--iterations", str(args.iterations),
+                "--warmup", str(args.warmup), "--concurrency", str(args.concurrency),
+                "--workers", str(args.workers),
+            ]
+            # bot.py ning print lari JSON chiqishiga aralashmasligi uchun stderr ga
+            subprocess.run(command, stdout=sys.stderr, check=True)
+            with open(result_path, encoding="utf-8") as f:
+                result = json.load(f)
+            os.remove(result_path)
+            report["scenarios"][name] = result
+            print(f"  p50 {result['latency_ms']['p50']:.1f} ms, p95 {result['latency_ms']['p95']:.1f} ms, "
+                  f"{result['throughput_ops']:.2f} amal/s, xatolar: {result['errors']}", file=sys.stderr)
+
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                baseline = json.load(f)
+            if compare(report, baseline, args.threshold):
+                sys.exit(1)
+    finally:
+        if not args.corpus and not args.child:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
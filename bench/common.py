@@ -0,0 +1,85 @@
+"""Benchmark skriptlari uchun umumiy yordamchilar"""
+import os
+import sys
+import json
+import shutil
+import itertools
+import tempfile
+import importlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_bot(workdir=None, config=None):
+    """bot.py ni vaqtinchalik ish papkasida import qilish.
+
+    bot.py import paytida data/config.json ni o'qiydi va data/bot_stats.db ni
+    yaratadi, shuning uchun benchmark haqiqiy bazaga tegmasligi kerak.
+    config - data/config.json ga qo'shiladigan sozlamalar.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="pdfuz_bench_")
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    config_path = os.path.join(workdir, "data", "config.json")
+    if not os.path.exists(config_path):
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump({"CHANNEL_USERNAME": "@bench_channel", "ADMIN_IDS": [], **(config or {})}, f)
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return importlib.import_module("bot")
+
+
+def cleanup(workdir):
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def percentile(sorted_values, q):
+    """Saralangan qiymatlardan q-persentil (0..100, chiziqli interpolyatsiya)"""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+class StubMessage:
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self.document = None
+
+
+class StubBot:
+    """Telegram so'rovlarini yubormasdan yozib boruvchi context.bot o'rnini bosuvchi
+
+    Har bir chaqiruv calls ga (metod, chat_id, qo'shimcha) ko'rinishida yoziladi;
+    send_document da qo'shimcha - yuborilgan PDF hajmi (bayt).
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._message_ids = itertools.count(1)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        if hasattr(document, "read"):
+            size = len(document.read())
+        else:
+            size = len(document)
+        self.calls.append(("send_document", chat_id, size))
+        return StubMessage(next(self._message_ids))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(("send_message", chat_id, text))
+        return StubMessage(next(self._message_ids))
+
+    def __getattr__(self, name):
+        # edit_message_text, delete_message va h.k. - faqat yoziladi
+        async def method(*args, **kwargs):
+            self.calls.append((name, kwargs.get("chat_id"), None))
+            return StubMessage(next(self._message_ids))
+        return method
+
+
+class StubContext:
+    def __init__(self, bot=None):
+        self.bot = bot or StubBot()
@@ -0,0 +1,124 @@
+"""Benchmark uchun deterministik fayllar to'plami.
+
+Bir xil parametrlar bilan har safar bir xil tarkib yaratiladi (docx/xlsx arxiv
+ichidagi vaqt belgilari bundan mustasno), shuning uchun natijalarni commitlar
+orasida solishtirish mumkin. To'plam identifikatori - parametrlardan olingan hash.
+"""
+import os
+import json
+import random
+import hashlib
+
+import openpyxl
+from PIL import Image
+
+from bench_docx import make_document, WORDS
+
+# Yaratish usuli o'zgarsa oshiriladi - eski natijalar bilan solishtirib bo'lmaydi
+CORPUS_VERSION = 1
+
+PHONE_SIZE = (4032, 3024)   # 12 MP telefon kamerasi
+PNG_SIZE = (1600, 1200)
+
+
+def _photo_like(rnd, size):
+    """Silliq dog'lar va mayda tafsilotli RGB rasm (sof shovqin JPEG da real bo'lmagan hajm beradi)"""
+    w, h = size
+    layers = []
+    for divisor in (64, 8):
+        small = (max(1, w // divisor), max(1, h // divisor))
+        noise = Image.frombytes("RGB", small, rnd.randbytes(small[0] * small[1] * 3))
+        layers.append(noise.resize(size, Image.BICUBIC))
+    return Image.blend(layers[0], layers[1], 0.25)
+
+
+def phone_jpeg(path, rnd, size=PHONE_SIZE):
+    _photo_like(rnd, size).save(path, "JPEG", quality=90)
+
+
+def alpha_png(path, rnd, size=PNG_SIZE):
+    """Shaffof joylari bor PNG (skrinshot/stiker kabi)"""
+    img = _photo_like(rnd, size)
+    small = (size[0] // 32, size[1] // 32)
+    mask = Image.frombytes("L", small, rnd.randbytes(small[0] * small[1]))
+    # Yarmiga yaqin joy to'liq shaffof, qolgani yarim shaffof o'tishlar
+    mask = mask.resize(size, Image.BICUBIC).point(lambda v: 0 if v < 110 else min(255, (v - 110) * 3))
+    img.putalpha(mask)
+    img.save(path, "PNG")
+
+
+def table_xlsx(path, rnd, rows, cols):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Ma'lumotlar"
+    ws.append([f"Ustun {c + 1}" for c in range(cols)])
+    for r in range(rows):
+        row = []
+        for c in range(cols):
+            kind = rnd.random()
+            if kind < 0.35:
+                row.append(rnd.randint(0, 10 ** 6))
+            elif kind < 0.45:
+                row.append(round(rnd.uniform(0, 10 ** 4), 2))
+            elif kind < 0.5:
+                row.append(None)
+            else:
+                row.append(" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 4))))
+        ws.append(row)
+    wb.save(path)
+
+
+def build_corpus(directory, photos=10, docx_pages=50, wide_rows=300, wide_cols=40,
+                 tall_rows=5000, tall_cols=6):
+    """To'plamni yaratish (yoki tayyorini qayta ishlatish) va manifestni qaytarish
+
+    Manifest: {"id", "spec", "groups": {guruh: [fayl nomlari]}, "bytes": {guruh: hajm}}
+    """
+    spec = {
+        "version": CORPUS_VERSION, "photos": photos, "docx_pages": docx_pages,
+        "wide_rows": wide_rows, "wide_cols": wide_cols,
+        "tall_rows": tall_rows, "tall_cols": tall_cols,
+    }
+    corpus_id = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("id") == corpus_id:
+            return manifest
+
+    os.makedirs(directory, exist_ok=True)
+    # Har bir guruh o'z urug'idan - bittasini o'zgartirish qolganlariga ta'sir qilmaydi
+    groups = {"jpeg_phone": [], "png_alpha": [], "docx_long": [], "xlsx_wide": [], "xlsx_tall": []}
+    rnd = random.Random(1)
+    for i in range(photos):
+        name = f"phone_{i:02d}.jpg"
+        phone_jpeg(os.path.join(directory, name), rnd)
+        groups["jpeg_phone"].append(name)
+
+    rnd = random.Random(2)
+    for i in range(photos):
+        name = f"alpha_{i:02d}.png"
+        alpha_png(os.path.join(directory, name), rnd)
+        groups["png_alpha"].append(name)
+
+    make_document(os.path.join(directory, "long.docx"), docx_pages)
+    groups["docx_long"].append("long.docx")
+
+    table_xlsx(os.path.join(directory, "wide.xlsx"), random.Random(3), wide_rows, wide_cols)
+    groups["xlsx_wide"].append("wide.xlsx")
+    table_xlsx(os.path.join(directory, "tall.xlsx"), random.Random(4), tall_rows, tall_cols)
+    groups["xlsx_tall"].append("tall.xlsx")
+
+    manifest = {
+        "id": corpus_id,
+        "spec": spec,
+        "groups": groups,
+        "bytes": {
+            group: sum(os.path.getsize(os.path.join(directory, name)) for name in names)
+            for group, names in groups.items()
+        },
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
@@ -1,24 +1,109 @@
+import io
 import os
+import copy
 import json
+import re
+import time
+import shutil
+import hashlib
+import itertools
 import asyncio
+import bisect
+import signal
 import sqlite3
-from datetime import datetime, date
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import threading
+import multiprocessing
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler,
-    ContextTypes, filters, CallbackQueryHandler
+    ContextTypes, filters, CallbackQueryHandler, ChatMemberHandler, BaseUpdateProcessor
 )
 from PIL import Image
 from fpdf import FPDF
+from fpdf.enums import TextEmphasis
+from fpdf.fonts import SubsetMap
+from fontTools import ttLib
 import docx
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 import openpyxl
-from flask import Flask, request
 
 
 # ===== DATABASE SETUP =====
+DB_PATH = 'data/bot_stats.db'
+
+# Sxema migratsiyalari (PRAGMA user_version bo'yicha ketma-ket qo'llaniladi)
+MIGRATIONS = [
+    # 1: Admin statistikasi uchun indekslar
+    [
+        'CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active)',
+        'CREATE INDEX IF NOT EXISTS idx_users_created_date ON users (created_date)',
+        'CREATE INDEX IF NOT EXISTS idx_users_total_pdfs ON users (total_pdfs)',
+    ],
+    # 2: Broadcast vazifalari va har bir qabul qiluvchining holati
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_date TIMESTAMP,
+            status TEXT DEFAULT 'running',
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER,
+            user_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            error TEXT,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 3: Tayyor PDF lar uchun Telegram file_id keshi
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS pdf_cache (
+            key TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_pdf_cache_last_used ON pdf_cache (last_used)',
+    ],
+    # 4: Broadcastni qaysi jarayon yuborayotgani (shardlar bir-birining ishini takrorlamasligi uchun)
+    [
+        'ALTER TABLE broadcasts ADD COLUMN owner INTEGER',
+    ],
+]
+
+def migrate_database(conn):
+    """Qo'llanilmagan migratsiyalarni bajarish"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    
+    for number, statements in enumerate(MIGRATIONS[version:], version + 1):
+        for sql in statements:
+            conn.execute(sql)
+        conn.execute(f'PRAGMA user_version = {number}')
+        conn.commit()
+
 def init_database():
     """Ma'lumotlar bazasini ishga tushirish"""
-    conn = sqlite3.connect('data/bot_stats.db')
+    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
     # Foydalanuvchilar jadvali
@@ -57,6 +142,10 @@ def init_database():
     ''')
     
     conn.commit()
+    
+    # Indekslar va boshqa sxema o'zgarishlari
+    migrate_database(conn)
+    
     conn.close()
 
 # ===== CONFIG =====
@@ -67,6 +156,30 @@ TOKEN = os.getenv("BOT_TOKEN")
 
 CHANNEL_USERNAME = config.get("CHANNEL_USERNAME", "@test_channel")
 ADMIN_IDS = config.get("ADMIN_IDS", [])  # Admin ID larini config dan olish
+RENDER_WORKERS = config.get("RENDER_WORKERS", os.cpu_count() or 1)  # Parallel PDF render jarayonlari
+JOB_CONCURRENCY = config.get("JOB_CONCURRENCY", RENDER_WORKERS)  # Bir vaqtda bajariladigan PDF ishlari
+BATCH_MIN_DELAY = config.get("BATCH_MIN_DELAY", 1.0)  # Bitta fayldan keyin PDF gacha kutish (soniya)
+BATCH_MAX_DELAY = config.get("BATCH_MAX_DELAY", 5.0)  # Sekin yuboruvchilar uchun eng uzoq kutish (soniya)
+PROGRESS_UPDATE_INTERVAL = config.get("PROGRESS_UPDATE_INTERVAL", 2.0)  # Progress xabari tahrirlari oralig'i (soniya)
+INGEST_WORKERS = config.get("INGEST_WORKERS", 4)  # Rasmlarni kichraytiruvchi threadlar
+IMAGE_CACHE_BYTES = config.get("IMAGE_CACHE_BYTES", 200 * 1024 * 1024)  # Rasmlar keshi hajmi (0 - o'chirilgan)
+PDF_CACHE_DAYS = config.get("PDF_CACHE_DAYS", 30)  # Ishlatilmagan PDF file_id lari shuncha kundan keyin o'chiriladi
+PDF_SPILL_BYTES = config.get("PDF_SPILL_BYTES", 16 * 1024 * 1024)  # Bundan katta PDF xotirada emas, diskda saqlanadi
+ACTIVITY_FLUSH_INTERVAL = config.get("ACTIVITY_FLUSH_INTERVAL", 5)  # Faollik buferini yozish oralig'i (soniya)
+ACTIVITY_FLUSH_SIZE = config.get("ACTIVITY_FLUSH_SIZE", 500)  # Shuncha foydalanuvchi yig'ilsa darhol yozish
+CHANNEL_INFO_TTL = config.get("CHANNEL_INFO_TTL", 3600)  # Kanal ma'lumotlari keshi (soniya)
+CHANNEL_INFO_ERROR_TTL = config.get("CHANNEL_INFO_ERROR_TTL", 60)  # Xatolikdan keyin qayta urinish (soniya)
+SUBSCRIPTION_CACHE_SIZE = config.get("SUBSCRIPTION_CACHE_SIZE", 100000)  # Obuna keshidagi maksimal foydalanuvchilar
+SUBSCRIPTION_TTL = config.get("SUBSCRIPTION_TTL", 3600)  # Obuna bo'lganlar qayta tekshirilishigacha (soniya)
+SUBSCRIPTION_NEGATIVE_TTL = config.get("SUBSCRIPTION_NEGATIVE_TTL", 60)  # Obuna bo'lmaganlar uchun (soniya)
+BROADCAST_RATE = config.get("BROADCAST_RATE", 25)  # Broadcast xabarlari soniyasiga (Telegram chegarasi ~30)
+BROADCAST_CONCURRENCY = config.get("BROADCAST_CONCURRENCY", 10)  # Bir vaqtda yuborilayotgan xabarlar
+BROADCAST_PAGE_SIZE = config.get("BROADCAST_PAGE_SIZE", 200)  # Bazadan bir martada o'qiladigan qabul qiluvchilar
+SHARD_WORKERS = config.get("SHARD_WORKERS", 0)  # Webhook rejimida worker jarayonlari (0/1 - bitta jarayon)
+# Foydalanuvchi sessiyalari: "sqlite" (data/sessions.db) yoki "memory" (bitta jarayonda har fayl uchun tranzaksiya keraksiz)
+SESSION_STORE = config.get("SESSION_STORE", "sqlite" if SHARD_WORKERS > 1 else "memory")
+WEBHOOK_QUEUE_SIZE = config.get("WEBHOOK_QUEUE_SIZE", 1000)  # Navbat to'lsa webhook 503 qaytaradi (Telegram qayta yuboradi)
+WEBHOOK_WORKERS = config.get("WEBHOOK_WORKERS", 16)  # Bir vaqtda qayta ishlanadigan yangilanishlar
 
 os.makedirs("temp", exist_ok=True)
 os.makedirs("data", exist_ok=True)
@@ -74,148 +187,726 @@ os.makedirs("data", exist_ok=True)
 # Ma'lumotlar bazasini ishga tushirish
 init_database()
 
-# ===== USER FILES =====
-user_files = {}
-user_pdf_counter = {}
-user_tasks = {}
-user_subscribed = {}
-user_progress_msg_id = {}
+# ===== DATABASE LAYER =====
+class Database:
+    """Bitta doimiy (WAL) ulanish va alohida thread orqali ishlaydigan async baza qatlami"""
 
-# ===== DATABASE FUNCTIONS =====
-def add_user(user_id, username, first_name, last_name):
-    """Yangi foydalanuvchi qo'shish"""
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, last_active)
-    VALUES (?, ?, ?, ?, datetime('now'))
-    ''', (user_id, username, first_name, last_name))
-    
-    conn.commit()
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        # Bitta thread - barcha so'rovlar ketma-ket va bitta ulanishda bajariladi
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+    def _connect(self):
+        if self._conn is None:
+            # cached_statements - tayyorlangan so'rovlar ulanish ichida qayta ishlatiladi
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._conn = conn
+        return self._conn
+
+    def _call(self, fn, args):
+        conn = self._connect()
+        # with conn - muvaffaqiyatda commit, xatolikda rollback
+        with conn:
+            return fn(conn, *args)
+
+    async def run(self, fn, *args):
+        """fn(conn, *args) ni baza thread ida bitta tranzaksiyada bajarish"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    async def execute(self, sql, params=()):
+        """Bitta so'rovni bajarish va o'zgargan qatorlar sonini qaytarish"""
+        return await self.run(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, seq_of_params):
+        """Bitta so'rovni ko'p parametrlar bilan bitta tranzaksiyada bajarish"""
+        return await self.run(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    def close(self):
+        """Ulanishni yopish va baza thread ini to'xtatish"""
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close).result()
+        self._executor.shutdown(wait=True)
+
+
+# Umumiy baza ulanishi (thread birinchi so'rovda ishga tushadi)
+db = Database(DB_PATH)
+
+# ===== FOYDALANUVCHI SESSIYALARI =====
+SESSIONS_DB_PATH = 'data/sessions.db'
+
+def process_alive(pid):
+    """Shu kompyuterdagi jarayon hali ishlayaptimi (o'zimiz - oldingi ishga tushishdan qolgan)"""
+    if pid == os.getpid():
+        return False
+    if os.name != "posix":
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SessionStore(ABC):
+    """Foydalanuvchi sessiyalari ombori: yig'ilayotgan fayllar, PDF raqami va progress xabarlari
+
+    Fayllar PDF ishiga claim orqali olinadi - bir nechta jarayon bitta omborni
+    ishlatsa ham, bitta fayllar to'plami faqat bitta PDF ga tushadi. Claim qilgan
+    jarayon to'xtab qolsa, fayllar keyingi ishga tushishda qayta navbatga qaytadi.
+    """
+
+    @abstractmethod
+    async def files(self, user_id):
+        """Navbatdagi (hali PDF ga olinmagan) fayllar"""
+
+    @abstractmethod
+    async def pdf_number(self, user_id):
+        """Keyingi PDF raqami"""
+
+    @abstractmethod
+    async def append(self, user_id, entries):
+        """Fayllarni qo'shish; natija - (navbatdagi fayllar soni, keyingi PDF raqami)"""
+
+    @abstractmethod
+    async def claim(self, user_id):
+        """Navbatdagi barcha fayllarni PDF uchun olish; natija - (fayllar, PDF raqami)"""
+
+    @abstractmethod
+    async def complete(self, user_id):
+        """PDF yuborildi - olingan fayllarni o'chirish va PDF raqamini oshirish"""
+
+    @abstractmethod
+    async def release(self, user_id):
+        """PDF yaratilmadi - olingan fayllarni navbat boshiga qaytarish"""
+
+    @abstractmethod
+    async def reset(self, user_id):
+        """Sessiyani tozalash; natija - o'chirilgan fayllar (diskdan ham o'chirish uchun)"""
+
+    @abstractmethod
+    async def pending_users(self):
+        """Navbatda fayllari bor foydalanuvchilar"""
+
+    @abstractmethod
+    async def add_progress_message(self, chat_id, message_id):
+        """Progress xabarini shu jarayonga bog'lab yozish"""
+
+    @abstractmethod
+    async def remove_progress_message(self, chat_id, message_id):
+        """Progress xabari o'chirildi"""
+
+    @abstractmethod
+    async def recover(self):
+        """To'xtagan jarayonlar claimlarini qaytarish; natija - ularning progress xabarlari"""
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """Bitta jarayon uchun xotiradagi ombor (qayta ishga tushganda sessiyalar yo'qoladi)"""
+
+    def __init__(self):
+        self._files = {}     # user_id -> navbatdagi fayllar
+        self._claimed = {}   # user_id -> PDF yaratilayotgan fayllar
+        self._pdf_num = {}   # user_id -> keyingi PDF raqami
+
+    async def files(self, user_id):
+        return list(self._files.get(user_id, ()))
+
+    async def pdf_number(self, user_id):
+        return self._pdf_num.get(user_id, 1)
+
+    async def append(self, user_id, entries):
+        files = self._files.setdefault(user_id, [])
+        files.extend(entries)
+        return len(files), self._pdf_num.get(user_id, 1)
+
+    async def claim(self, user_id):
+        files = self._files.pop(user_id, None)
+        pdf_num = self._pdf_num.get(user_id, 1)
+        if not files:
+            return [], pdf_num
+        self._claimed.setdefault(user_id, []).extend(files)
+        return files, pdf_num
+
+    async def complete(self, user_id):
+        self._claimed.pop(user_id, None)
+        self._pdf_num[user_id] = self._pdf_num.get(user_id, 1) + 1
+
+    async def release(self, user_id):
+        claimed = self._claimed.pop(user_id, None)
+        if claimed:
+            self._files[user_id] = claimed + self._files.get(user_id, [])
+
+    async def reset(self, user_id):
+        removed = self._claimed.pop(user_id, []) + self._files.pop(user_id, [])
+        self._pdf_num.pop(user_id, None)
+        return removed
+
+    async def pending_users(self):
+        return [user_id for user_id, files in self._files.items() if files]
+
+    async def add_progress_message(self, chat_id, message_id):
+        pass
+
+    async def remove_progress_message(self, chat_id, message_id):
+        pass
+
+    async def recover(self):
+        return []
+
+
+def _init_sessions_schema(path):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+    CREATE TABLE IF NOT EXISTS sessions (
+        user_id INTEGER PRIMARY KEY,
+        pdf_num INTEGER NOT NULL DEFAULT 1
+    );
+    CREATE TABLE IF NOT EXISTS session_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        entry TEXT NOT NULL,
+        claimed_by INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_session_files_user ON session_files (user_id, claimed_by, id);
+    CREATE TABLE IF NOT EXISTS progress_messages (
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        owner INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, message_id)
+    ) WITHOUT ROWID;
+    ''')
     conn.close()
 
-def update_user_activity(user_id):
-    """Foydalanuvchi faolligini yangilash"""
-    conn = sqlite3.connect('data/bot_stats.db')
+
+class SqliteSessionStore(SessionStore):
+    """Bir kompyuterdagi bir nechta jarayon uchun umumiy SQLite (WAL) ombori
+
+    Har bir amal bitta tranzaksiya; claimlar jarayon PID si bilan belgilanadi.
+    """
+
+    def __init__(self, path):
+        _init_sessions_schema(path)
+        self.db = Database(path)
+        self.owner = os.getpid()
+
+    async def files(self, user_id):
+        rows = await self.db.fetchall(
+            'SELECT entry FROM session_files WHERE user_id = ? AND claimed_by IS NULL ORDER BY id',
+            (user_id,)
+        )
+        return [json.loads(entry) for entry, in rows]
+
+    async def pdf_number(self, user_id):
+        row = await self.db.fetchone('SELECT pdf_num FROM sessions WHERE user_id = ?', (user_id,))
+        return row[0] if row else 1
+
+    async def append(self, user_id, entries):
+        def _append(conn):
+            conn.executemany(
+                'INSERT INTO session_files (user_id, entry) VALUES (?, ?)',
+                [(user_id, json.dumps(entry)) for entry in entries]
+            )
+            count = conn.execute(
+                'SELECT COUNT(*) FROM session_files WHERE user_id = ? AND claimed_by IS NULL', (user_id,)
+            ).fetchone()[0]
+            row = conn.execute('SELECT pdf_num FROM sessions WHERE user_id = ?', (user_id,)).fetchone()
+            return count, row[0] if row else 1
+        return await self.db.run(_append)
+
+    async def claim(self, user_id):
+        owner = self.owner
+        def _claim(conn):
+            # UPDATE birinchi - yozish qulfi olinadi, boshqa jarayon shu fayllarni ololmaydi
+            claimed = conn.execute(
+                'UPDATE session_files SET claimed_by = ? WHERE user_id = ? AND claimed_by IS NULL',
+                (owner, user_id)
+            ).rowcount
+            row = conn.execute('SELECT pdf_num FROM sessions WHERE user_id = ?', (user_id,)).fetchone()
+            pdf_num = row[0] if row else 1
+            if not claimed:
+                return [], pdf_num
+            rows = conn.execute(
+                'SELECT entry FROM session_files WHERE user_id = ? AND claimed_by = ? ORDER BY id',
+                (user_id, owner)
+            ).fetchall()
+            return [json.loads(entry) for entry, in rows], pdf_num
+        return await self.db.run(_claim)
+
+    async def complete(self, user_id):
+        owner = self.owner
+        def _complete(conn):
+            conn.execute('DELETE FROM session_files WHERE user_id = ? AND claimed_by = ?', (user_id, owner))
+            conn.execute('''
+            INSERT INTO sessions (user_id, pdf_num) VALUES (?, 2)
+            ON CONFLICT(user_id) DO UPDATE SET pdf_num = pdf_num + 1
+            ''', (user_id,))
+        await self.db.run(_complete)
+
+    async def release(self, user_id):
+        # id saqlanadi - qaytgan fayllar keyin kelganlaridan oldin turadi
+        await self.db.execute(
+            'UPDATE session_files SET claimed_by = NULL WHERE user_id = ? AND claimed_by = ?',
+            (user_id, self.owner)
+        )
+
+    async def reset(self, user_id):
+        def _reset(conn):
+            rows = conn.execute(
+                'SELECT entry FROM session_files WHERE user_id = ? ORDER BY id', (user_id,)
+            ).fetchall()
+            conn.execute('DELETE FROM session_files WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+            return [json.loads(entry) for entry, in rows]
+        return await self.db.run(_reset)
+
+    async def pending_users(self):
+        rows = await self.db.fetchall(
+            'SELECT DISTINCT user_id FROM session_files WHERE claimed_by IS NULL'
+        )
+        return [user_id for user_id, in rows]
+
+    async def add_progress_message(self, chat_id, message_id):
+        await self.db.execute(
+            'INSERT OR REPLACE INTO progress_messages (chat_id, message_id, owner) VALUES (?, ?, ?)',
+            (chat_id, message_id, self.owner)
+        )
+
+    async def remove_progress_message(self, chat_id, message_id):
+        await self.db.execute(
+            'DELETE FROM progress_messages WHERE chat_id = ? AND message_id = ?', (chat_id, message_id)
+        )
+
+    async def recover(self):
+        def _recover(conn):
+            owners = [owner for owner, in conn.execute('''
+                SELECT claimed_by FROM session_files WHERE claimed_by IS NOT NULL
+                UNION SELECT owner FROM progress_messages
+            ''')]
+            stale = [owner for owner in owners if not process_alive(owner)]
+            messages = []
+            for owner in stale:
+                conn.execute('UPDATE session_files SET claimed_by = NULL WHERE claimed_by = ?', (owner,))
+                messages += conn.execute(
+                    'SELECT chat_id, message_id FROM progress_messages WHERE owner = ?', (owner,)
+                ).fetchall()
+                conn.execute('DELETE FROM progress_messages WHERE owner = ?', (owner,))
+            return messages
+        return await self.db.run(_recover)
+
+    def close(self):
+        self.db.close()
+
+
+def create_session_store(kind):
+    """Sozlamadagi ombor turini yaratish"""
+    if kind == "memory":
+        return MemorySessionStore()
+    return SqliteSessionStore(SESSIONS_DB_PATH)
+
+
+# Umumiy sessiyalar ombori (bir nechta jarayon "sqlite" turi orqali birga ishlaydi)
+session_store = create_session_store(SESSION_STORE)
+
+# ===== METRIKALAR =====
+# Bosqichlar davomiyligi chegaralari (soniya): rasm normalizatsiyasidan katta jadvallargacha
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metric:
+    """Prometheus metrikasi: yorliqlar qiymatlari bo'yicha alohida qatorlar"""
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # yorliqlar qiymatlari (tuple) -> qiymat
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return tuple(zip(self.labelnames, key))
+
+    def samples(self):
+        """(qator nomi, yorliqlar, qiymat) lar"""
+        for key, value in self._values.items():
+            yield self.name, self._labels(key), value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [har bir chegaradagi soni (kumulyativ emas), yig'indi, jami]
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+
+    def time(self, **labels):
+        """with bloki davomiyligini yozish (ichida await bo'lishi mumkin)"""
+        return _HistogramTimer(self, labels)
+
+    def samples(self):
+        for key, (counts, total, count) in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket", labels + (("le", repr(float(bound))),), cumulative
+            yield self.name + "_bucket", labels + (("le", "+Inf"),), count
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, count
+
+
+class _HistogramTimer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class MetricsRegistry:
+    """Jarayondagi barcha metrikalar"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self):
+        """[(nom, tur, tavsif, [(qator nomi, yorliqlar, qiymat), ...]), ...]"""
+        return [
+            (metric.name, metric.kind, metric.documentation, list(metric.samples()))
+            for metric in self._metrics
+        ]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+def render_metrics(sources):
+    """[(collect() natijasi, qo'shimcha yorliqlar), ...] -> Prometheus matn formati"""
+    families = {}
+    for collected, extra_labels in sources:
+        for name, kind, documentation, samples in collected:
+            lines = families.setdefault(name, (kind, documentation, []))[2]
+            for sample_name, labels, value in samples:
+                labels = tuple(extra_labels) + tuple(tuple(label) for label in labels)
+                lines.append(f"{sample_name}{_format_labels(labels)} {value}")
+
+    output = []
+    for name, (kind, documentation, lines) in families.items():
+        output.append(f"# HELP {name} {documentation}")
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(lines)
+    return "\n".join(output) + "\n"
+
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.register(Histogram(
+    "pdfuz_stage_seconds", "Ish bosqichlari davomiyligi (soniya)", ("stage",)
+))
+files_received = metrics.register(Counter("pdfuz_files_total", "Qabul qilingan fayllar", ("type",)))
+bytes_transferred = metrics.register(Counter(
+    "pdfuz_bytes_total", "Yuklab olingan fayllar (in) va yuborilgan PDF lar (out) hajmi", ("direction",)
+))
+errors_counter = metrics.register(Counter("pdfuz_errors_total", "Xatoliklar (bosqich bo'yicha)", ("stage",)))
+bot_api_requests = metrics.register(Counter("pdfuz_bot_api_requests_total", "Bot API so'rovlari", ("method",)))
+pdfs_sent = metrics.register(Counter(
+    "pdfuz_pdfs_total", "Yuborilgan PDF lar (render - yangi, cache - file_id orqali)", ("source",)
+))
+updates_rejected = metrics.register(Counter(
+    "pdfuz_updates_rejected_total", "Navbat to'lgani uchun 503 bilan qaytarilgan yangilanishlar"
+))
+pending_sessions_gauge = metrics.register(Gauge("pdfuz_pending_sessions", "Navbatda fayllari bor foydalanuvchilar"))
+active_renders_gauge = metrics.register(Gauge("pdfuz_active_renders", "Hozir yaratilayotgan PDF lar"))
+render_queue_gauge = metrics.register(Gauge("pdfuz_render_queue_depth", "Bo'sh render jarayonini kutayotgan PDF lar"))
+job_queue_gauge = metrics.register(Gauge("pdfuz_job_queue_depth", "Navbatdagi PDF ishlari"))
+update_queue_gauge = metrics.register(Gauge("pdfuz_update_queue_depth", "Qayta ishlanishini kutayotgan yangilanishlar"))
+shard_queue_gauge = metrics.register(Gauge("pdfuz_shard_queue_depth", "Shard navbatidagi yangilanishlar", ("shard",)))
+
+
+BOT_API_METHOD_RE = re.compile(r"/bot[^/]+/(\w+)$")
+
+def bot_api_method(url):
+    """So'rov URL idan metrika yorlig'i: /bot<token>/<metod> - metod nomi,
+    /file/bot<token>/... - "download" (fayl yo'li yorliqqa tushmasligi kerak)"""
+    path = url.split("?", 1)[0]
+    if "/file/bot" in path:
+        return "download"
+    match = BOT_API_METHOD_RE.search(path)
+    return match.group(1) if match else "other"
+
+
+class MetricsRequest(HTTPXRequest):
+    """Bot API so'rovlarini metod bo'yicha sanaydigan HTTPXRequest"""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        bot_api_requests.inc(method=bot_api_method(url))
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception:
+            errors_counter.inc(stage="bot_api")
+            raise
+        if code != 200:
+            errors_counter.inc(stage="bot_api")
+        return code, payload
+
+# ===== KUNLIK STATISTIKA =====
+def _bump_daily_stats(conn, day, new_users=0, active_users=0, pdfs=0, files=0):
+    # Kunlik yozuvni to'liq qayta hisoblamasdan, faqat o'zgarishni qo'shish
+    conn.execute('''
+    INSERT INTO stats (date, new_users, active_users, total_pdfs, total_files)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(date) DO UPDATE SET
+        new_users = new_users + excluded.new_users,
+        active_users = active_users + excluded.active_users,
+        total_pdfs = total_pdfs + excluded.total_pdfs,
+        total_files = total_files + excluded.total_files
+    ''', (day, new_users, active_users, pdfs, files))
+
+# ===== FAOLLIK BUFERI =====
+def _flush_activity(conn, touches, counters, daily_counters):
+    # Barcha o'zgarishlar bitta tranzaksiyada yoziladi
     cursor = conn.cursor()
-    
-    cursor.execute('''
+
+    # Shu kuni birinchi marta faol bo'lgan foydalanuvchilarni sanash (PRIMARY KEY bo'yicha)
+    active_by_day = {}
+    for user_id, ts in touches.items():
+        cursor.execute('SELECT last_active FROM users WHERE user_id = ?', (user_id,))
+        row = cursor.fetchone()
+        if row is None:
+            continue
+        day = ts[:10]
+        if not row[0] or row[0] < day:
+            active_by_day[day] = active_by_day.get(day, 0) + 1
+
+    cursor.executemany('''
     UPDATE users 
-    SET last_active = datetime('now')
+    SET last_active = ?
     WHERE user_id = ?
-    ''', (user_id,))
-    
-    conn.commit()
-    conn.close()
-
-def increment_user_stats(user_id, pdfs=0, files=0):
-    """Foydalanuvchi statistikasini oshirish"""
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
+    ''', [(ts, user_id) for user_id, ts in touches.items()])
     
-    cursor.execute('''
+    cursor.executemany('''
     UPDATE users 
     SET total_pdfs = total_pdfs + ?,
         total_files = total_files + ?
     WHERE user_id = ?
-    ''', (pdfs, files, user_id))
-    
-    conn.commit()
-    conn.close()
+    ''', [(pdfs, files, user_id) for user_id, (pdfs, files) in counters.items()])
 
-def update_daily_stats():
-    """Kunlik statistikani yangilash"""
-    today = date.today().isoformat()
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
-    
-    # Bugungi sana uchun yozuv yo'q bo'lsa yaratish
-    cursor.execute('''
-    INSERT OR IGNORE INTO stats (date) VALUES (?)
-    ''', (today,))
-    
-    # Faol foydalanuvchilar sonini hisoblash (oxirgi 24 soatda faol)
-    cursor.execute('''
-    SELECT COUNT(*) FROM users 
-    WHERE last_active > datetime('now', '-1 day')
-    ''')
-    active_users = cursor.fetchone()[0]
-    
-    # Yangi foydalanuvchilar sonini hisoblash (bugun qo'shilgan)
-    cursor.execute('''
-    SELECT COUNT(*) FROM users 
-    WHERE DATE(created_date) = DATE('now')
-    ''')
-    new_users = cursor.fetchone()[0]
-    
-    # Bugungi PDF va fayllar sonini hisoblash
-    cursor.execute('''
-    SELECT SUM(total_pdfs), SUM(total_files) 
-    FROM users 
-    WHERE DATE(last_active) = DATE('now')
-    ''')
-    daily_stats = cursor.fetchone()
-    daily_pdfs = daily_stats[0] or 0
-    daily_files = daily_stats[1] or 0
-    
-    # Statistikani yangilash
-    cursor.execute('''
-    UPDATE stats 
-    SET new_users = ?, 
-        active_users = ?,
-        total_pdfs = ?,
-        total_files = ?
-    WHERE date = ?
-    ''', (new_users, active_users, daily_pdfs, daily_files, today))
-    
-    conn.commit()
-    conn.close()
+    for day in active_by_day.keys() | daily_counters.keys():
+        pdfs, files = daily_counters.get(day, (0, 0))
+        _bump_daily_stats(conn, day, active_users=active_by_day.get(day, 0), pdfs=pdfs, files=files)
 
-def get_bot_stats():
-    """Bot umumiy statistikasini olish"""
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
-    
-    # Umumiy foydalanuvchilar soni
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    # Bugungi faol foydalanuvchilar
-    cursor.execute('''
-    SELECT COUNT(*) FROM users 
-    WHERE last_active > datetime('now', '-1 day')
-    ''')
-    today_active = cursor.fetchone()[0]
-    
-    # Bugungi yangi foydalanuvchilar
-    cursor.execute('''
-    SELECT COUNT(*) FROM users 
-    WHERE DATE(created_date) = DATE('now')
-    ''')
-    today_new = cursor.fetchone()[0]
-    
-    # Umumiy PDF lar soni
-    cursor.execute('SELECT SUM(total_pdfs) FROM users')
-    total_pdfs = cursor.fetchone()[0] or 0
-    
-    # Umumiy fayllar soni
-    cursor.execute('SELECT SUM(total_files) FROM users')
-    total_files = cursor.fetchone()[0] or 0
+class ActivityBuffer:
+    """last_active va hisoblagichlarni xotirada yig'ib, bitta tranzaksiyada yozuvchi bufer"""
+
+    def __init__(self, database, interval, max_pending):
+        self.db = database
+        self.interval = interval
+        self.max_pending = max_pending
+        self._touches = {}    # user_id -> oxirgi faollik vaqti (UTC)
+        self._counters = {}   # user_id -> [pdfs, files]
+        self._daily = {}      # sana -> [pdfs, files] (stats jadvali uchun)
+        self._lock = None
+        self._task = None
+        self._flush_task = None
+
+    @property
+    def pending(self):
+        """Yozilmagan o'zgarishlari bor foydalanuvchilar soni"""
+        return len(self._touches.keys() | self._counters.keys())
+
+    def touch(self, user_id):
+        # SQLite datetime('now') bilan bir xil format (UTC)
+        self._touches[user_id] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        self._schedule()
+
+    def add_stats(self, user_id, pdfs=0, files=0):
+        counters = self._counters.setdefault(user_id, [0, 0])
+        counters[0] += pdfs
+        counters[1] += files
+        daily = self._daily.setdefault(datetime.utcnow().date().isoformat(), [0, 0])
+        daily[0] += pdfs
+        daily[1] += files
+        self._schedule()
+
+    def _schedule(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        # Davriy yozish taski
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+        # Bufer to'lib qolsa, intervalni kutmasdan yozish
+        if self.pending >= self.max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = loop.create_task(self.flush())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """Yig'ilgan o'zgarishlarni bazaga yozish"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if not self._touches and not self._counters:
+                return
+
+            touches, self._touches = self._touches, {}
+            counters, self._counters = self._counters, {}
+            daily, self._daily = self._daily, {}
+
+            try:
+                await self.db.run(_flush_activity, touches, counters, daily)
+            except Exception as e:
+                print(f"Faollik buferini yozish xatosi: {e}")
+                # Yozilmagan o'zgarishlarni keyingi urinish uchun qaytarish
+                for user_id, ts in touches.items():
+                    if ts > self._touches.get(user_id, ""):
+                        self._touches[user_id] = ts
+                for user_id, (pdfs, files) in counters.items():
+                    current = self._counters.setdefault(user_id, [0, 0])
+                    current[0] += pdfs
+                    current[1] += files
+                for day, (pdfs, files) in daily.items():
+                    current = self._daily.setdefault(day, [0, 0])
+                    current[0] += pdfs
+                    current[1] += files
+
+    async def stop(self):
+        """Davriy taskni to'xtatish va qolgan o'zgarishlarni yozish"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# Faollik buferi (30 ta rasmli albom = bitta tranzaksiya)
+activity_buffer = ActivityBuffer(db, ACTIVITY_FLUSH_INTERVAL, ACTIVITY_FLUSH_SIZE)
+
+# ===== DATABASE FUNCTIONS =====
+def _add_user(conn, user_id, username, first_name, last_name):
+    cursor = conn.execute('''
+    INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, last_active)
+    VALUES (?, ?, ?, ?, datetime('now'))
+    ''', (user_id, username, first_name, last_name))
     
-    conn.close()
+    # Yangi foydalanuvchi bugungi statistikaga darhol qo'shiladi (yangi va faol)
+    if cursor.rowcount:
+        today = datetime.utcnow().date().isoformat()
+        _bump_daily_stats(conn, today, new_users=1, active_users=1)
+
+async def add_user(user_id, username, first_name, last_name):
+    """Yangi foydalanuvchi qo'shish"""
+    await db.run(_add_user, user_id, username, first_name, last_name)
+
+def update_user_activity(user_id):
+    """Foydalanuvchi faolligini yangilash (buferga yoziladi)"""
+    activity_buffer.touch(user_id)
+
+def increment_user_stats(user_id, pdfs=0, files=0):
+    """Foydalanuvchi statistikasini oshirish (buferga yoziladi)"""
+    activity_buffer.add_stats(user_id, pdfs=pdfs, files=files)
+
+def _get_bot_stats(conn):
+    # Sana chegaralari Python da hisoblanadi - indekslar bilan diapazon qidiruvi
+    now = datetime.utcnow()
+    day_ago = (now - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    today_start = now.strftime('%Y-%m-%d 00:00:00')
+    
+    # Bitta so'rov: jami qiymatlar bitta o'tishda, kunlik sonlar indeks orqali
+    row = conn.execute('''
+    SELECT COUNT(*),
+           COALESCE(SUM(total_pdfs), 0),
+           COALESCE(SUM(total_files), 0),
+           (SELECT COUNT(*) FROM users WHERE last_active > ?),
+           (SELECT COUNT(*) FROM users WHERE created_date >= ?)
+    FROM users
+    ''', (day_ago, today_start)).fetchone()
     
     return {
-        'total_users': total_users,
-        'today_active': today_active,
-        'today_new': today_new,
-        'total_pdfs': total_pdfs,
-        'total_files': total_files
+        'total_users': row[0],
+        'today_active': row[3],
+        'today_new': row[4],
+        'total_pdfs': row[1],
+        'total_files': row[2]
     }
 
-def get_user_stats(user_id=None):
-    """Foydalanuvchi statistikasini olish"""
-    conn = sqlite3.connect('data/bot_stats.db')
+async def get_bot_stats():
+    """Bot umumiy statistikasini olish"""
+    await activity_buffer.flush()
+    return await db.run(_get_bot_stats)
+
+def _get_user_stats(conn, user_id):
     cursor = conn.cursor()
     
     if user_id:
@@ -225,7 +916,6 @@ def get_user_stats(user_id=None):
         FROM users WHERE user_id = ?
         ''', (user_id,))
         user = cursor.fetchone()
-        conn.close()
         
         if user:
             return {
@@ -241,6 +931,7 @@ def get_user_stats(user_id=None):
         return None
     
     else:
+        # Ikkala ro'yxat ham indeks bo'yicha o'qiladi (jadval saralanmaydi)
         # Eng faol 10 ta foydalanuvchi
         cursor.execute('''
         SELECT user_id, username, first_name, last_active, total_pdfs, total_files
@@ -259,82 +950,108 @@ def get_user_stats(user_id=None):
         ''')
         top_pdf_users = cursor.fetchall()
         
-        conn.close()
-        
         return {
             'active_users': active_users,
             'top_pdf_users': top_pdf_users
         }
 
-def get_daily_stats(days=7):
+async def get_user_stats(user_id=None):
+    """Foydalanuvchi statistikasini olish"""
+    await activity_buffer.flush()
+    return await db.run(_get_user_stats, user_id)
+
+async def get_daily_stats(days=7):
     """Oxirgi n kunlik statistikani olish"""
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    await activity_buffer.flush()
+    return await db.fetchall('''
     SELECT date, new_users, active_users, total_pdfs, total_files
     FROM stats 
     WHERE date >= date('now', ?)
     ORDER BY date DESC
     ''', (f'-{days} days',))
-    
-    stats = cursor.fetchall()
-    conn.close()
-    
-    return stats
 
-def add_admin(user_id, username):
-    """Admin qo'shish"""
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+def _add_admin(conn, user_id, username):
+    conn.execute('''
     INSERT OR IGNORE INTO admins (user_id, username)
     VALUES (?, ?)
     ''', (user_id, username))
     
     # users jadvalida ham admin sifatida belgilash
-    cursor.execute('''
+    conn.execute('''
     UPDATE users SET is_admin = 1 WHERE user_id = ?
     ''', (user_id,))
-    
-    conn.commit()
-    conn.close()
 
-def remove_admin(user_id):
-    """Adminni olib tashlash"""
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM admins WHERE user_id = ?', (user_id,))
+async def add_admin(user_id, username):
+    """Admin qo'shish"""
+    await db.run(_add_admin, user_id, username)
+
+def _remove_admin(conn, user_id):
+    conn.execute('DELETE FROM admins WHERE user_id = ?', (user_id,))
     
     # users jadvalidan admin holatini olib tashlash
-    cursor.execute('UPDATE users SET is_admin = 0 WHERE user_id = ?', (user_id,))
-    
-    conn.commit()
-    conn.close()
+    conn.execute('UPDATE users SET is_admin = 0 WHERE user_id = ?', (user_id,))
+
+async def remove_admin(user_id):
+    """Adminni olib tashlash"""
+    await db.run(_remove_admin, user_id)
 
-def is_admin(user_id):
+async def is_admin(user_id):
     """Foydalanuvchi admin ekanligini tekshirish"""
     # Birinchi config dan tekshirish
     if user_id in ADMIN_IDS:
         return True
     
     # Keyin ma'lumotlar bazasidan tekshirish
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT 1 FROM admins WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    
-    conn.close()
+    result = await db.fetchone('SELECT 1 FROM admins WHERE user_id = ?', (user_id,))
     
     return result is not None
 
 # ===== KANAL MA'LUMOTLARINI OLISH =====
-async def get_channel_info(context: ContextTypes.DEFAULT_TYPE):
-    try:
-        channel_username = CHANNEL_USERNAME.lstrip('@')
+class ChannelInfoCache:
+    """Kanal ma'lumotlarini TTL bilan saqlovchi kesh (bir vaqtdagi so'rovlar bitta API chaqiruvni kutadi)"""
+
+    def __init__(self, ttl, error_ttl):
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self._value = None
+        self._expires = 0
+        self._inflight = None
+
+    async def get(self, fetch):
+        if self._value is not None and time.monotonic() < self._expires:
+            return self._value
+
+        # Yangilash allaqachon ketayotgan bo'lsa, o'sha natijani kutish
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh(fetch))
+        # shield - bitta chaqiruvchi bekor qilinsa ham umumiy so'rov davom etadi
+        return await asyncio.shield(self._inflight)
+
+    async def _refresh(self, fetch):
+        try:
+            value = await fetch()
+            # Xatolik bo'lsa (chat_id yo'q), qisqa muddatdan keyin qayta urinish
+            ttl = self.ttl if value.get("chat_id") else self.error_ttl
+            self._value = value
+            self._expires = time.monotonic() + ttl
+            return value
+        finally:
+            self._inflight = None
+
+    def invalidate(self):
+        self._value = None
+        self._expires = 0
+
+
+channel_info_cache = ChannelInfoCache(CHANNEL_INFO_TTL, CHANNEL_INFO_ERROR_TTL)
+
+async def get_channel_info(context: ContextTypes.DEFAULT_TYPE):
+    """Kanal ma'lumotlarini olish (keshdan)"""
+    return await channel_info_cache.get(lambda: _fetch_channel_info(context))
+
+async def _fetch_channel_info(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        channel_username = CHANNEL_USERNAME.lstrip('@')
         try:
             chat = await context.bot.get_chat(chat_id=f"@{channel_username}")
         except:
@@ -359,8 +1076,56 @@ async def get_channel_info(context: ContextTypes.DEFAULT_TYPE):
             "chat_id": None
         }
 
+# ===== OBUNA KESHI =====
+SUBSCRIBED_STATUSES = ('member', 'administrator', 'creator')
+
+class SubscriptionCache:
+    """Obuna holatlari uchun LRU kesh (obuna va obuna emas natijalar uchun alohida TTL)"""
+
+    def __init__(self, max_size, positive_ttl, negative_ttl):
+        self.max_size = max_size
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._items = OrderedDict()  # user_id -> (obuna, tugash vaqti)
+
+    def get(self, user_id):
+        """Keshdagi holat: True/False, yoki None (yo'q yoki eskirgan)"""
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        subscribed, expires = item
+        if time.monotonic() >= expires:
+            del self._items[user_id]
+            return None
+        self._items.move_to_end(user_id)
+        return subscribed
+
+    def set(self, user_id, subscribed):
+        ttl = self.positive_ttl if subscribed else self.negative_ttl
+        self._items[user_id] = (subscribed, time.monotonic() + ttl)
+        self._items.move_to_end(user_id)
+        # Eng uzoq ishlatilmagan yozuvlarni chiqarib tashlash
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self._items.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+subscription_cache = SubscriptionCache(
+    SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_TTL, SUBSCRIPTION_NEGATIVE_TTL
+)
+
 # ===== KANALGA OBUNA BO'LGANLIGINI TEKSHIRISH =====
-async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE, force=False) -> bool:
+    if not force:
+        cached = subscription_cache.get(user_id)
+        if cached is not None:
+            return cached
+    
     try:
         channel_info = await get_channel_info(context)
         
@@ -373,33 +1138,41 @@ async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -
         )
         
         status = chat_member.status
-        return status in ['member', 'administrator', 'creator']
+        is_subscribed = status in SUBSCRIBED_STATUSES
+        subscription_cache.set(user_id, is_subscribed)
+        return is_subscribed
         
     except Exception as e:
         print(f"Obuna tekshirish xatosi: {e}")
         return True
 
+# ===== KANAL A'ZOLIGI O'ZGARISHI =====
+async def channel_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Kanalga obuna bo'lish / chiqishda keshni yangilash (bot kanal admini bo'lishi kerak)"""
+    member_update = update.chat_member
+    channel_info = await get_channel_info(context)
+    
+    if member_update.chat.id != channel_info.get("chat_id"):
+        return
+    
+    new_member = member_update.new_chat_member
+    subscription_cache.set(new_member.user.id, new_member.status in SUBSCRIBED_STATUSES)
+
 # ===== /start =====
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     user_id = u.id
     
     # Foydalanuvchini ma'lumotlar bazasiga qo'shish
-    add_user(user_id, u.username, u.first_name, u.last_name)
+    await add_user(user_id, u.username, u.first_name, u.last_name)
     update_user_activity(user_id)
     
     # Barcha eski ma'lumotlarni tozalash
-    user_files[user_id] = []
-    user_pdf_counter[user_id] = 1
-    if user_id in user_tasks:
-        try:
-            user_tasks[user_id].cancel()
-        except:
-            pass
-        user_tasks.pop(user_id, None)
+    job_scheduler.cancel(user_id)
+    remove_temp_files(await session_store.reset(user_id))
     
     # Progress xabarni tozalash
-    user_progress_msg_id.pop(user_id, None)
+    await delete_progress_message(user_id, context)
     
     # Kanal ma'lumotlarini olish
     channel_info = await get_channel_info(context)
@@ -426,9 +1199,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Obuna bo'lgan foydalanuvchi uchun
-    user_subscribed[user_id] = True
-    
     welcome_text = f"""
 ✅ **Xush kelibsiz {u.first_name}!**
 
@@ -438,7 +1208,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
 ⚡️ **Tezkor va oddiy:**
 1. Rasm, Word yoki Excel fayllarini yuboring
-2. 3 soniya kuting
+2. Bir-ikki soniya kuting
 3. PDF avtomatik yuboriladi
 
 📊 **Har safar yangi PDF yaratiladi**
@@ -455,18 +1225,15 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Admin ekanligini tekshirish
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await update.message.reply_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
-    # Statistikani yangilash
-    update_daily_stats()
-    
     # Bot statistikasini olish
-    stats = get_bot_stats()
+    stats = await get_bot_stats()
     
     # Kunlik statistikani olish
-    daily_stats = get_daily_stats(7)
+    daily_stats = await get_daily_stats(7)
     
     # Admin panel keyboard
     keyboard = [
@@ -511,18 +1278,15 @@ async def admin_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     
     user_id = query.from_user.id
     
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await query.edit_message_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
-    # Statistikani yangilash
-    update_daily_stats()
-    
     # Bot statistikasini olish
-    stats = get_bot_stats()
+    stats = await get_bot_stats()
     
     # Eng faol foydalanuvchilar
-    user_stats = get_user_stats()
+    user_stats = await get_user_stats()
     
     stats_text = f"""
 📊 **UMUMIY STATISTIKA**
@@ -569,12 +1333,12 @@ async def admin_users_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     
     user_id = query.from_user.id
     
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await query.edit_message_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
     # Foydalanuvchi statistikasini olish
-    user_stats = get_user_stats()
+    user_stats = await get_user_stats()
     
     users_text = "👥 **FOYDALANUVCHILAR RO'YXATI**\n\n"
     users_text += "🕐 **Eng faol foydalanuvchilar:**\n"
@@ -609,12 +1373,12 @@ async def admin_daily_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     
     user_id = query.from_user.id
     
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await query.edit_message_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
     # Kunlik statistikani olish
-    daily_stats = get_daily_stats(14)  # Oxirgi 14 kun
+    daily_stats = await get_daily_stats(14)  # Oxirgi 14 kun
     
     daily_text = "📈 **KUNLIK STATISTIKA (Oxirgi 14 kun)**\n\n"
     daily_text += "📅 Sana | Yangi | Faol | PDF | Fayllar\n"
@@ -641,16 +1405,12 @@ async def admin_manage_callback(update: Update, context: ContextTypes.DEFAULT_TY
     
     user_id = query.from_user.id
     
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await query.edit_message_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
     # Adminlar ro'yxatini olish
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, username FROM admins')
-    admins = cursor.fetchall()
-    conn.close()
+    admins = await db.fetchall('SELECT user_id, username FROM admins')
     
     admin_text = "⚙️ **ADMINLAR RO'YXATI**\n\n"
     
@@ -663,6 +1423,7 @@ async def admin_manage_callback(update: Update, context: ContextTypes.DEFAULT_TY
     admin_text += "\n📊 **Statistika: **\n"
     admin_text += "`/stats` - To'liq statistika\n"  
     admin_text += "`/broadcast [xabar]` - Hamma foydalanuvchilarga xabar yuborish\n"
+    admin_text += "`/bstatus [id]` - Broadcast holati\n"
     
     # Orqaga qaytish tugmasi
     keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="admin_back")]]
@@ -681,7 +1442,7 @@ async def admin_export_callback(update: Update, context: ContextTypes.DEFAULT_TY
     
     user_id = query.from_user.id
     
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await query.edit_message_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
@@ -709,18 +1470,15 @@ async def admin_back_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     user_id = query.from_user.id
     
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await query.edit_message_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
-    # Statistikani yangilash
-    update_daily_stats()
-    
     # Bot statistikasini olish
-    stats = get_bot_stats()
+    stats = await get_bot_stats()
     
     # Kunlik statistikani olish
-    daily_stats = get_daily_stats(7)
+    daily_stats = await get_daily_stats(7)
     
     # Admin panel keyboard
     keyboard = [
@@ -758,12 +1516,275 @@ async def admin_back_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         parse_mode='Markdown'
     )
 
+# ===== BROADCAST DVIGATELI =====
+class TokenBucket:
+    """Telegram yuborish tezligini cheklovchi global token bucket"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                # RetryAfter kelgan bo'lsa, hamma kutadi
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Telegram RetryAfter qaytarganda barcha yuborishlarni to'xtatib turish"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+def _create_broadcast(conn, text, created_by, owner):
+    cursor = conn.execute(
+        'INSERT INTO broadcasts (text, created_by, owner) VALUES (?, ?, ?)',
+        (text, created_by, owner)
+    )
+    broadcast_id = cursor.lastrowid
+    
+    # Qabul qiluvchilar ro'yxati Python ga yuklanmasdan, SQLite ichida nusxalanadi
+    cursor = conn.execute('''
+    INSERT INTO broadcast_deliveries (broadcast_id, user_id)
+    SELECT ?, user_id FROM users
+    ''', (broadcast_id,))
+    conn.execute('UPDATE broadcasts SET total = ? WHERE id = ?', (cursor.rowcount, broadcast_id))
+    return broadcast_id
+
+def _next_pending_page(conn, broadcast_id, after_user_id, limit):
+    # PRIMARY KEY bo'yicha sahifalab o'qish (butun ro'yxat xotiraga olinmaydi)
+    cursor = conn.execute('''
+    SELECT user_id FROM broadcast_deliveries
+    WHERE broadcast_id = ? AND status = 'pending' AND user_id > ?
+    ORDER BY user_id
+    LIMIT ?
+    ''', (broadcast_id, after_user_id, limit))
+    return [row[0] for row in cursor.fetchmany(limit)]
+
+def _save_deliveries(conn, broadcast_id, results):
+    conn.executemany('''
+    UPDATE broadcast_deliveries SET status = ?, error = ?
+    WHERE broadcast_id = ? AND user_id = ?
+    ''', [(status, error, broadcast_id, user_id) for user_id, status, error in results])
+    
+    sent = sum(1 for _, status, _ in results if status == 'sent')
+    conn.execute(
+        'UPDATE broadcasts SET sent = sent + ?, failed = failed + ? WHERE id = ?',
+        (sent, len(results) - sent, broadcast_id)
+    )
+
+def _claim_broadcasts(conn, owner, claim_all):
+    """Egasi ishlamayotgan broadcastlarni o'ziga olish (bir nechta shard bir vaqtda chaqirishi mumkin)"""
+    rows = conn.execute("SELECT id, text, owner FROM broadcasts WHERE status = 'running'").fetchall()
+    claimed = []
+    for broadcast_id, text, previous in rows:
+        if not claim_all and previous is not None and process_alive(previous):
+            continue
+        # Eski egasi hali o'sha bo'lsagina olinadi - boshqa shard ulgurgan bo'lsa, rowcount 0
+        cursor = conn.execute('''
+        UPDATE broadcasts SET owner = ?
+        WHERE id = ? AND status = 'running' AND owner IS ?
+        ''', (owner, broadcast_id, previous))
+        if cursor.rowcount:
+            claimed.append((broadcast_id, text))
+    return claimed
+
+def _finish_broadcast(conn, broadcast_id):
+    conn.execute('''
+    UPDATE broadcasts SET status = 'done', finished_date = datetime('now')
+    WHERE id = ?
+    ''', (broadcast_id,))
+
+def _fail_broadcast(conn, broadcast_id):
+    conn.execute('''
+    UPDATE broadcasts SET status = 'failed', finished_date = datetime('now')
+    WHERE id = ? AND status = 'running'
+    ''', (broadcast_id,))
+
+def _get_broadcast(conn, broadcast_id):
+    if broadcast_id is None:
+        row = conn.execute('SELECT MAX(id) FROM broadcasts').fetchone()
+        broadcast_id = row[0]
+    return conn.execute('''
+    SELECT id, status, total, sent, failed, created_date, finished_date
+    FROM broadcasts WHERE id = ?
+    ''', (broadcast_id,)).fetchone()
+
+class BroadcastManager:
+    """Broadcast vazifalarini fonda, tezlik chegarasi bilan va qayta tiklanadigan qilib yuborish"""
+
+    RETRIES = 3        # Kutilmagan xatolikdan keyin urinishlar soni
+    RETRY_DELAY = 5    # Urinishlar orasidagi kutish (soniya, har safar oshadi)
+
+    def __init__(self, database, limiter, concurrency, page_size):
+        self.db = database
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self._tasks = {}      # broadcast_id -> asyncio.Task
+        self._progress = {}   # broadcast_id -> bazaga hali yozilmagan natijalar soni
+
+    async def create(self, text, created_by):
+        """Yangi broadcast vazifasini bazada yaratish"""
+        return await self.db.run(_create_broadcast, text, created_by, os.getpid())
+
+    def start(self, bot, broadcast_id, text):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(bot, broadcast_id, text))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def resume(self, bot, claim_all=True):
+        """Jarayon qayta ishga tushganda tugallanmagan broadcastlarni davom ettirish
+
+        claim_all=False (shard rejimi) - faqat egasi to'xtagan broadcastlar olinadi,
+        boshqa ishlayotgan shard yuborayotganlari takrorlanmaydi.
+        """
+        jobs = await self.db.run(_claim_broadcasts, os.getpid(), claim_all)
+        for broadcast_id, text in jobs:
+            print(f"Broadcast #{broadcast_id} davom ettirilmoqda")
+            self.start(bot, broadcast_id, text)
+
+    async def progress(self, broadcast_id=None):
+        """Broadcast holati (bazadagi va hali yozilmagan natijalar bilan)"""
+        row = await self.db.run(_get_broadcast, broadcast_id)
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'status': row[1],
+            'total': row[2],
+            'sent': row[3],
+            'failed': row[4],
+            'in_flight': self._progress.get(row[0], 0),
+            'created_date': row[5],
+            'finished_date': row[6],
+            'running': row[0] in self._tasks
+        }
+
+    async def stop(self):
+        """Barcha broadcastlarni to'xtatish (keyingi ishga tushishda davom etadi)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _send(self, bot, user_id, text):
+        attempts = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                await bot.send_message(chat_id=user_id, text=text)
+                return 'sent', None
+            except RetryAfter as e:
+                # Telegram aytgan vaqtgacha barcha yuborishlar to'xtaydi
+                self.limiter.pause(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                # Bot bloklangan yoki chat mavjud emas - qayta urinish foydasiz
+                return 'failed', str(e)[:200]
+            except (TimedOut, NetworkError) as e:
+                attempts += 1
+                if attempts >= 3:
+                    return 'failed', str(e)[:200]
+                await asyncio.sleep(attempts)
+            except Exception as e:
+                return 'failed', str(e)[:200]
+
+    async def _sender(self, bot, broadcast_id, text, queue, results):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            status, error = await self._send(bot, user_id, text)
+            results.append((user_id, status, error))
+            self._progress[broadcast_id] = len(results)
+
+    async def _save(self, broadcast_id, results):
+        if not results:
+            return
+        batch = results[:]
+        del results[:len(batch)]
+        self._progress[broadcast_id] = len(results)
+        await self.db.run(_save_deliveries, broadcast_id, batch)
+
+    async def _run(self, bot, broadcast_id, text):
+        try:
+            for attempt in range(1, self.RETRIES + 1):
+                try:
+                    await self._deliver(bot, broadcast_id, text)
+                    return
+                except Exception as e:
+                    print(f"Broadcast #{broadcast_id} xatosi ({attempt}/{self.RETRIES}): {e}")
+                    if attempt < self.RETRIES:
+                        # Yuborilganlar saqlangan - qayta urinish qolgan joydan davom etadi
+                        await asyncio.sleep(self.RETRY_DELAY * attempt)
+            # 'running' holatida qolib ketmasligi uchun - resume uni qayta olmaydi
+            await self.db.run(_fail_broadcast, broadcast_id)
+        finally:
+            self._progress.pop(broadcast_id, None)
+
+    async def _deliver(self, bot, broadcast_id, text):
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results = []
+        senders = [
+            asyncio.create_task(self._sender(bot, broadcast_id, text, queue, results))
+            for _ in range(self.concurrency)
+        ]
+        try:
+            last_user_id = 0
+            while True:
+                page = await self.db.run(_next_pending_page, broadcast_id, last_user_id, self.page_size)
+                if not page:
+                    break
+                for user_id in page:
+                    await queue.put(user_id)
+                last_user_id = page[-1]
+                # Har sahifadan keyin natijalarni saqlash - qulasa shu joydan davom etadi
+                await self._save(broadcast_id, results)
+
+            for _ in senders:
+                await queue.put(None)
+            await asyncio.gather(*senders)
+            await self._save(broadcast_id, results)
+            await self.db.run(_finish_broadcast, broadcast_id)
+            print(f"Broadcast #{broadcast_id} tugadi")
+        except BaseException:
+            # To'xtatish yoki xatolik: senderlar tugashini kutib, yuborilganlarni saqlash
+            for task in senders:
+                task.cancel()
+            await asyncio.gather(*senders, return_exceptions=True)
+            await self._save(broadcast_id, results)
+            raise
+
+
+# Global yuborish cheklagichi (Telegram: ~30 xabar/soniya)
+send_limiter = TokenBucket(BROADCAST_RATE)
+broadcast_manager = BroadcastManager(db, send_limiter, BROADCAST_CONCURRENCY, BROADCAST_PAGE_SIZE)
+
 # ===== ADMIN COMMANDS =====
 async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin qo'shish buyrug'i"""
     user_id = update.effective_user.id
     
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await update.message.reply_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
@@ -773,7 +1794,7 @@ async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         new_admin_id = int(context.args[0])
-        add_admin(new_admin_id, "Noma'lum")
+        await add_admin(new_admin_id, "Noma'lum")
         await update.message.reply_text(f"✅ {new_admin_id} admin sifatida qo'shildi!")
     except ValueError:
         await update.message.reply_text("❌ Noto'g'ri user_id format!")
@@ -782,7 +1803,7 @@ async def remove_admin_command(update: Update, context: ContextTypes.DEFAULT_TYP
     """Adminni olib tashlash buyrug'i"""
     user_id = update.effective_user.id
     
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await update.message.reply_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
@@ -792,7 +1813,7 @@ async def remove_admin_command(update: Update, context: ContextTypes.DEFAULT_TYP
     
     try:
         admin_id = int(context.args[0])
-        remove_admin(admin_id)
+        await remove_admin(admin_id)
         await update.message.reply_text(f"✅ {admin_id} adminlik huquqidan mahrum qilindi!")
     except ValueError:
         await update.message.reply_text("❌ Noto'g'ri user_id format!")
@@ -801,7 +1822,7 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Barcha foydalanuvchilarga xabar yuborish"""
     user_id = update.effective_user.id
     
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await update.message.reply_text("❌ Bu buyruq faqat adminlar uchun!")
         return
     
@@ -810,53 +1831,171 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     message = " ".join(context.args)
+    text = f"📢 **Bot yangiligi:**\n\n{message}"
     
-    # Foydalanuvchilar ro'yxatini olish
-    conn = sqlite3.connect('data/bot_stats.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id FROM users')
-    users = cursor.fetchall()
-    conn.close()
+    # Vazifa bazada yaratiladi va fonda yuboriladi
+    broadcast_id = await broadcast_manager.create(text, user_id)
+    broadcast_manager.start(context.bot, broadcast_id, text)
+    
+    await update.message.reply_text(
+        f"📢 **Broadcast #{broadcast_id} boshlandi!**\n\n"
+        f"Holatini ko'rish: /bstatus {broadcast_id}"
+    )
+
+async def broadcast_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Broadcast holatini ko'rsatish"""
+    user_id = update.effective_user.id
     
-    sent = 0
-    failed = 0
+    if not await is_admin(user_id):
+        await update.message.reply_text("❌ Bu buyruq faqat adminlar uchun!")
+        return
     
-    # Har bir foydalanuvchiga xabar yuborish
-    for user in users:
+    broadcast_id = None
+    if context.args:
         try:
-            await context.bot.send_message(
-                chat_id=user[0],
-                text=f"📢 **Bot yangiligi:**\n\n{message}"
-            )
-            sent += 1
-        except:
-            failed += 1
+            broadcast_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ Foydalanish: `/bstatus [id]`")
+            return
+    
+    progress = await broadcast_manager.progress(broadcast_id)
+    if progress is None:
+        await update.message.reply_text("❌ Broadcast topilmadi!")
+        return
+    
+    done = progress['sent'] + progress['failed'] + progress['in_flight']
+    percent = done * 100 // progress['total'] if progress['total'] else 100
+    if progress['status'] == 'done':
+        state = "✅ Tugadi"
+    elif progress['status'] == 'failed':
+        state = "❌ Xatolik bilan to'xtadi"
+    else:
+        state = "🔄 Yuborilmoqda" if progress['running'] else "⏸ To'xtatilgan"
     
     await update.message.reply_text(
-        f"📢 **Xabar yuborildi!**\n\n"
-        f"✅ Muvaffaqiyatli: {sent}\n"
-        f"❌ Muvaffaqiyatsiz: {failed}"
+        f"📢 **Broadcast #{progress['id']}** - {state}\n\n"
+        f"📊 Progress: {done}/{progress['total']} ({percent}%)\n"
+        f"✅ Muvaffaqiyatli: {progress['sent']}\n"
+        f"❌ Muvaffaqiyatsiz: {progress['failed']}"
     )
 
-# ===== PROGRESS XABARINI KO'RSATISH =====
-async def show_progress_message(user_id: int, context: ContextTypes.DEFAULT_TYPE):
-    """Progress xabarini ko'rsatish"""
-    try:
-        files = user_files.get(user_id, [])
-        current_pdf_num = user_pdf_counter.get(user_id, 1)
-        
-        if not files:
+# ===== PROGRESS XABARLARI =====
+class ProgressReporter:
+    """Progress xabarlari: har bir kalit uchun bitta xabar, joyida tahrirlanadi
+
+    Yangilanishlar birlashtiriladi - xabar PROGRESS_UPDATE_INTERVAL da ko'pi bilan bir
+    marta tahrirlanadi, matn o'zgarmagan bo'lsa Bot API ga murojaat qilinmaydi.
+    """
+
+    def __init__(self, interval, store=None):
+        self.interval = interval
+        self.store = store  # Xabar ID lari qayta ishga tushgandan keyin o'chirish uchun saqlanadi
+        self._states = {}  # kalit -> xabar holati
+
+    def set(self, key, chat_id, bot, text):
+        """Xabar matnini yangilash (yuborish/tahrirlash fonda, kechiktirib bajariladi)"""
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = {
+                "chat_id": chat_id, "bot": bot, "message_id": None, "shown": None,
+                "pending": None, "last": float("-inf"), "task": None, "busy": False, "closed": False,
+            }
+        state["pending"] = text
+        if state["task"] is None:
+            state["task"] = asyncio.create_task(self._flush(state))
+
+    def move(self, old_key, new_key):
+        """Xabarni boshqa kalitga o'tkazish (masalan, fayllar to'plami -> PDF ishi)"""
+        state = self._states.pop(old_key, None)
+        if state is not None:
+            self._states[new_key] = state
+
+    async def _flush(self, state):
+        try:
+            while state["pending"] is not None:
+                wait = state["last"] + self.interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                text, state["pending"] = state["pending"], None
+                if text is None or text == state["shown"]:
+                    continue
+                
+                state["busy"] = True
+                try:
+                    if state["message_id"] is None:
+                        msg = await state["bot"].send_message(
+                            chat_id=state["chat_id"], text=text, parse_mode='Markdown'
+                        )
+                        state["message_id"] = msg.message_id
+                        if self.store is not None:
+                            await self.store.add_progress_message(state["chat_id"], msg.message_id)
+                    else:
+                        await state["bot"].edit_message_text(
+                            chat_id=state["chat_id"], message_id=state["message_id"],
+                            text=text, parse_mode='Markdown'
+                        )
+                    state["shown"] = text
+                except RetryAfter as e:
+                    # Flood chegarasi - kutib, eng so'nggi matn bilan qayta urinish
+                    if state["pending"] is None and not state["closed"]:
+                        state["pending"] = text
+                    state["last"] = time.monotonic() + e.retry_after - self.interval
+                    continue
+                except BadRequest as e:
+                    # Xabar foydalanuvchi tomonidan o'chirilgan bo'lsa, keyingi safar yangisi yuboriladi
+                    if "not modified" not in str(e):
+                        state["message_id"] = None
+                finally:
+                    state["busy"] = False
+                state["last"] = time.monotonic()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Progress xabari xatosi: {e}")
+        finally:
+            state["task"] = None
+
+    async def close(self, key):
+        """Xabarni o'chirish va kutilayotgan yangilanishlarni bekor qilish"""
+        state = self._states.pop(key, None)
+        if state is None:
             return
-        
-        total_files = len(files)
-        
-        # Progress bar yaratish
-        progress_bar_length = 10
-        filled = min(progress_bar_length, total_files)
-        progress_bar = "🟩" * filled + "⬜" * (progress_bar_length - filled)
-        progress_percentage = min(100, total_files * 10)
-        
-        progress_text = f"""
+        state["pending"] = None
+        state["closed"] = True
+        task = state["task"]
+        if task is not None:
+            if state["busy"]:
+                # Yuborilayotgan xabar ID sini yo'qotmaslik uchun so'rov tugashini kutish
+                await asyncio.shield(task)
+            else:
+                task.cancel()
+        if state["message_id"] is not None:
+            try:
+                await state["bot"].delete_message(chat_id=state["chat_id"], message_id=state["message_id"])
+            except Exception:
+                pass
+            if self.store is not None:
+                await self.store.remove_progress_message(state["chat_id"], state["message_id"])
+
+
+progress_reporter = ProgressReporter(PROGRESS_UPDATE_INTERVAL, session_store)
+
+def batch_progress_key(user_id):
+    """Yig'ilayotgan fayllar progress xabari kaliti"""
+    return ("batch", user_id)
+
+async def show_progress_message(user_id: int, context: ContextTypes.DEFAULT_TYPE, total_files, current_pdf_num):
+    """Progress xabarini ko'rsatish"""
+    if not total_files:
+        return
+    
+    # Progress bar yaratish
+    progress_bar_length = 10
+    filled = min(progress_bar_length, total_files)
+    progress_bar = "🟩" * filled + "⬜" * (progress_bar_length - filled)
+    progress_percentage = min(100, total_files * 10)
+    
+    progress_text = f"""
 ⏳ **Fayllar yuklanmoqda...**
 
 {progress_bar}
@@ -864,465 +2003,1521 @@ async def show_progress_message(user_id: int, context: ContextTypes.DEFAULT_TYPE
 📁 **Fayllar soni:** {total_files} ta
 🔢 **PDF:** #{current_pdf_num}
 
-⏰ **PDF 3 soniyadan so'ng avtomatik yaratiladi...**
+⏰ **Fayllar kelishi to'xtagach PDF avtomatik yaratiladi...**
 """
-        
-        # Agar oldingi progress xabari bo'lsa, uni o'chirish
-        if user_id in user_progress_msg_id:
-            try:
-                await context.bot.delete_message(
-                    chat_id=user_id,
-                    message_id=user_progress_msg_id[user_id]
-                )
-            except:
-                pass
-        
-        # Yangi progress xabarini yuborish
-        msg = await context.bot.send_message(
-            chat_id=user_id,
-            text=progress_text,
-            parse_mode='Markdown'
-        )
-        user_progress_msg_id[user_id] = msg.message_id
-        
-    except Exception as e:
-        print(f"Progress xabarini ko'rsatish xatosi: {e}")
+    
+    # Bitta xabar joyida yangilanadi (har fayl uchun o'chirib qayta yuborilmaydi)
+    progress_reporter.set(batch_progress_key(user_id), user_id, context.bot, progress_text)
 
-# ===== PROGRESS XABARINI O'CHIRISH =====
 async def delete_progress_message(user_id: int, context: ContextTypes.DEFAULT_TYPE):
     """Progress xabarini o'chirish"""
-    try:
-        if user_id in user_progress_msg_id:
-            await context.bot.delete_message(
-                chat_id=user_id,
-                message_id=user_progress_msg_id[user_id]
-            )
-            user_progress_msg_id.pop(user_id, None)
-    except:
-        pass
+    await progress_reporter.close(batch_progress_key(user_id))
 
-# ===== FAYL QABUL QILISH =====
-async def collect(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = update.effective_user
-    user_id = u.id
-    
-    # Foydalanuvchi faolligini yangilash
-    update_user_activity(user_id)
-    
-    # Obunani tekshirish
-    if user_id not in user_subscribed or not user_subscribed[user_id]:
-        is_subscribed = await check_subscription(user_id, context)
-        if not is_subscribed:
-            channel_info = await get_channel_info(context)
-            keyboard = [
-                [InlineKeyboardButton(f"📢 {channel_info['title']}", url=channel_info["link"])],
-                [InlineKeyboardButton("✅ Obunani tekshirish", callback_data="check_subscription")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"❌ Botdan foydalanish uchun kanalga obuna bo'lishingiz kerak!",
-                reply_markup=reply_markup
-            )
-            return
-        user_subscribed[user_id] = True
-    
-    # Agar user birinchi marta fayl yuborsa
-    if user_id not in user_files:
-        user_files[user_id] = []
-        user_pdf_counter[user_id] = 1
-    
-    # Agar PDF allaqachon yaratilgan bo'lsa (fayllar bo'sh), yangi PDF raqamini oshirish
-    if len(user_files.get(user_id, [])) == 0 and user_id in user_pdf_counter:
-        user_pdf_counter[user_id] += 1
-    
+def render_progress_text(done, total):
+    """PDF yaratish bosqichidagi xabar matni"""
+    filled = round(10 * done / total) if total else 0
+    return (
+        f"🔄 **PDF yaratilmoqda...**\n\n"
+        f"{'🟩' * filled}{'⬜' * (10 - filled)}\n"
+        f"📄 {done}/{total} fayl tayyor"
+    )
+
+# ===== FAYLNI YUKLAB OLISH =====
+async def download_message_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Xabardagi hujjat yoki rasmni temp/ ga yuklab olish va yozuvlar ro'yxatini qaytarish"""
+    user_id = update.effective_user.id
     files_added = []
 
     # Document
     if update.message.document:
         d = update.message.document
-        f = await context.bot.get_file(d.file_id)
         safe_filename = d.file_name.replace("/", "_").replace("\\", "_")
         timestamp = datetime.now().strftime('%H%M%S_%f')[:-3]
         path = f"temp/{user_id}_{timestamp}_{safe_filename}"
-        await f.download_to_drive(path)
-        files_added.append(path)
+        with stage_seconds.time(stage="download"):
+            f = await context.bot.get_file(d.file_id)
+            await f.download_to_drive(path)
+        files_received.inc(type=os.path.splitext(safe_filename)[1].lstrip(".").lower() or "other")
+        bytes_transferred.inc(d.file_size or 0, direction="in")
+        files_added.append({"path": path, "unique_id": d.file_unique_id})
 
     # Photo
     elif update.message.photo:
         p = update.message.photo[-1]
-        f = await context.bot.get_file(p.file_id)
         timestamp = datetime.now().strftime('%H%M%S_%f')[:-3]
         path = f"temp/{user_id}_{timestamp}_{p.file_id}.jpg"
-        await f.download_to_drive(path)
 
-        img = Image.open(path).convert("RGB")
-        img.thumbnail((2000, 2000))
-        img.save(path, quality=80)
-        files_added.append(path)
+        # Bu rasm avval yuborilgan bo'lsa - yuklab olish va qayta kodlash shart emas
+        cached = image_cache.get(p.file_unique_id, path)
+        if cached:
+            width, height = cached
+        else:
+            with stage_seconds.time(stage="download"):
+                f = await context.bot.get_file(p.file_id)
+                await f.download_to_drive(path)
+            bytes_transferred.inc(p.file_size or 0, direction="in")
 
-    if not files_added:
-        await update.message.reply_text("❌ Fayl topilmadi!")
-        return
+            # Rasmni thread pool da kichraytirish (event loop bloklanmaydi)
+            loop = asyncio.get_running_loop()
+            with stage_seconds.time(stage="normalize"):
+                width, height = await loop.run_in_executor(ingest_executor, normalize_image, path)
+            image_cache.put(p.file_unique_id, path, width, height)
+        files_received.inc(type="photo")
 
-    user_files[user_id].extend(files_added)
+        files_added.append({"path": path, "width": width, "height": height, "unique_id": p.file_unique_id})
+
+    return files_added
+
+# ===== FAYL QABUL QILISH =====
+async def collect(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    u = update.effective_user
+    user_id = u.id
+    
+    # Foydalanuvchi faolligini yangilash
+    update_user_activity(user_id)
     
-    # Progress xabarini ko'rsatish
-    await show_progress_message(user_id, context)
+    # Obunani tekshirish
+    is_subscribed = await check_subscription(user_id, context)
+    if not is_subscribed:
+        channel_info = await get_channel_info(context)
+        keyboard = [
+            [InlineKeyboardButton(f"📢 {channel_info['title']}", url=channel_info["link"])],
+            [InlineKeyboardButton("✅ Obunani tekshirish", callback_data="check_subscription")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.message.reply_text(
+            f"❌ Botdan foydalanish uchun kanalga obuna bo'lishingiz kerak!",
+            reply_markup=reply_markup
+        )
+        return
     
-    # Avvalgi taskni bekor qilish (agar bo'lsa)
-    if user_id in user_tasks:
+    # Fayl yuklanayotganda PDF boshlanib ketmasligi uchun
+    job_scheduler.file_started(user_id, update.message.media_group_id)
+    files_added = []
+    try:
         try:
-            user_tasks[user_id].cancel()
-        except:
-            pass
+            files_added = await download_message_files(update, context)
+        except Exception:
+            errors_counter.inc(stage="download")
+            raise
+        if files_added:
+            total_files, pdf_num = await session_store.append(user_id, files_added)
+            
+            # Progress xabarini ko'rsatish
+            await show_progress_message(user_id, context, total_files, pdf_num)
+    finally:
+        # Albom to'liq kelsa PDF darhol, aks holda foydalanuvchi tempiga mos kutishdan keyin
+        await job_scheduler.file_done(user_id, context, bool(files_added))
 
-    # Yangi task yaratish (3 soniya)
-    user_tasks[user_id] = asyncio.create_task(delayed_pdf(user_id, context))
+    if not files_added:
+        await update.message.reply_text("❌ Fayl topilmadi!")
 
-# ===== 3 SONIYA KUTIB PDF YARATISH =====
-async def delayed_pdf(user_id, context):
-    try:
-        # 3 soniya kutish
-        await asyncio.sleep(3)
+# ===== PDF ISHLARI NAVBATI =====
+ALBUM_MAX_ITEMS = 10     # Telegram albomidagi maksimal fayllar
+ALBUM_DELAY = 0.5        # Albomning oxirgi faylidan keyin kutish (qismlari deyarli birga keladi)
+ALBUM_FULL_DELAY = 0.2   # To'liq albomdan keyin - ko'p rasm tanlanganda keyingi 10 talik albom uchun
+PACE_SMOOTHING = 0.3  # Fayllar orasidagi vaqt EWMA koeffitsienti
 
-        files = user_files.get(user_id)
-        if not files or len(files) == 0:
-            user_tasks.pop(user_id, None)
-            await delete_progress_message(user_id, context)
-            return
+# Fayl turi bo'yicha 1 MB ning taxminiy narxi (jadvallar sahifaga eng qimmat aylanadi)
+JOB_COST_PER_MB = {".jpg": 1, ".jpeg": 1, ".png": 2, ".docx": 4, ".xlsx": 8, ".xls": 8}
 
-        # Progress xabarini o'chirish
-        await delete_progress_message(user_id, context)
+def estimate_job_cost(files):
+    """PDF ishining taxminiy narxi (nisbiy birlik): fayllar soni, hajmi va turi bo'yicha"""
+    cost = 0.0
+    for entry in files:
+        ext = os.path.splitext(entry["path"])[1].lower()
+        try:
+            size = os.path.getsize(entry["path"])
+        except OSError:
+            size = 0
+        cost += 1 + JOB_COST_PER_MB.get(ext, 1) * size / (1024 * 1024)
+    return cost
 
-        # PDF yaratish xabarini yuborish
-        creating_msg = await context.bot.send_message(
-            chat_id=user_id,
-            text="🔄 **PDF yaratilmoqda...**\n\nIltimos, kuting...",
-            parse_mode='Markdown'
-        )
 
-        await create_and_send_pdf(user_id, context)
+class JobScheduler:
+    """PDF ishlarini global cheklov bilan va foydalanuvchilar orasida adolatli bajaruvchi navbat
+
+    Har bir foydalanuvchida bittadan navbatdagi va bittadan bajarilayotgan ish bo'ladi.
+    Navbat tartibi - virtual tugash vaqti bo'yicha (WFQ/SCFQ kabi): boshlanish + ish narxi,
+    shuning uchun kichik ishlar katta jadvallar ortida qolib ketmaydi, kattalari esa
+    virtual vaqt o'tishi bilan albatta navbatga chiqadi. Narx navbatga qo'yilganda
+    taxmin qilinadi; navbatda kutganda qo'shilgan fayllar shu ish tartibiga ta'sir
+    qilmaydi, lekin ish boshlanganda haqiqiy narx foydalanuvchining keyingi ishiga hisoblanadi.
+    """
+
+    def __init__(self, max_running, min_delay, max_delay):
+        self.max_running = max(1, int(max_running))
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._timers = {}   # user_id -> oxirgi fayldan keyingi kutish taski
+        self._batches = {}  # user_id -> yig'ilayotgan fayllar holati (muddat, yuklanayotganlar, albom)
+        # user_id -> [oxirgi fayl vaqti, fayllar orasidagi o'rtacha vaqt (EWMA)]; eng eskisi boshida
+        self._pace = OrderedDict()
+        self._queue = {}    # user_id -> navbatdagi ish
+        self._running = {}  # user_id -> bajarilayotgan ish taski
+        self._finish = {}   # user_id -> foydalanuvchi oxirgi ishining virtual tugash vaqti
+        self._virtual_time = 0.0
+        self._background = set()  # Xabarni o'chirish tasklari (GC yig'ib olmasligi uchun)
+        self._sequence = itertools.count()  # Teng virtual vaqtda kelish tartibi
+
+    @property
+    def queue_depth(self):
+        """Bo'sh joy kutayotgan ishlar soni"""
+        return len(self._queue)
+
+    @property
+    def running(self):
+        """Hozir bajarilayotgan ishlar soni"""
+        return len(self._running)
+
+    def position(self, user_id):
+        """Foydalanuvchi ishining navbatdagi o'rni (1 dan), navbatda bo'lmasa None"""
+        job = self._queue.get(user_id)
+        if job is None:
+            return None
+        return 1 + sum(1 for other in self._queue.values() if other["order"] < job["order"])
+
+    def file_started(self, user_id, media_group_id=None):
+        """Foydalanuvchidan fayl kela boshladi - u yuklab olinguncha PDF boshlanmaydi"""
+        now = time.monotonic()
+        batch = self._batches.get(user_id)
+        if batch is None:
+            batch = self._batches[user_id] = {"deadline": 0.0, "inflight": 0, "group": None, "count": 0}
+        batch["inflight"] += 1
         
-        # PDF yaratish xabarini o'chirish
-        try:
-            await context.bot.delete_message(
-                chat_id=user_id,
-                message_id=creating_msg.message_id
-            )
-        except:
-            pass
+        # Foydalanuvchi tempi: alohida yuborilgan fayllar orasidagi vaqt (albom ichidagisi emas)
+        pace = self._pace.get(user_id)
+        if pace is None:
+            pace = self._pace[user_id] = [None, None]
+        else:
+            self._pace.move_to_end(user_id)
+        if pace[0] is not None and (media_group_id is None or media_group_id != batch["group"]):
+            gap = now - pace[0]
+            if gap <= self.max_delay * 2:
+                pace[1] = gap if pace[1] is None else pace[1] + PACE_SMOOTHING * (gap - pace[1])
+        pace[0] = now
+        self._prune_pace(now)
         
-    except asyncio.CancelledError:
-        await delete_progress_message(user_id, context)
-        return
-    except Exception as e:
-        print(f"delayed_pdf xatosi: {e}")
-        await delete_progress_message(user_id, context)
-    finally:
-        user_tasks.pop(user_id, None)
+        if media_group_id != batch["group"]:
+            batch["group"] = media_group_id
+            batch["count"] = 0
+        if media_group_id:
+            batch["count"] += 1
 
-# ===== UNICODE MATNLAR UCHUN FONTLAR =====
-def add_unicode_support_to_pdf(pdf):
-    """PDF ga Unicode support qo'shish"""
-    # DejaVu Unicode fontlarini qo'shish (agar mavjud bo'lsa)
-    font_paths = [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/TTF/DejaVuSans.ttf",
-        "C:/Windows/Fonts/arial.ttf",
-        "./fonts/DejaVuSans.ttf"
-    ]
-    
-    for font_path in font_paths:
-        if os.path.exists(font_path):
-            try:
-                pdf.add_font('DejaVu', '', font_path, uni=True)
-                pdf.set_font('DejaVu', '', 12)
-                return True
-            except:
-                continue
-    
-    # Agar Unicode font topilmasa, Arial ni ishlatish
-    try:
-        pdf.add_font('Arial', '', 'arial.ttf', uni=True)
-        pdf.set_font('Arial', '', 12)
-        return True
-    except:
-        # Eng oxirgi chora - standart font
-        pdf.set_font("Arial", size=12)
-        return False
+    def _prune_pace(self, now):
+        # max_delay * 2 dan uzoq tanaffus tempga qo'shilmaydi - bunday foydalanuvchilar
+        # holati endi kerak emas (aks holda lug'at botning barcha foydalanuvchilari bilan o'sadi)
+        while self._pace:
+            user_id, pace = next(iter(self._pace.items()))
+            if now - pace[0] <= self.max_delay * 2:
+                break
+            del self._pace[user_id]
 
-# ===== MATNNI TO'G'RI FORMATLASH =====
-def clean_text(text):
-    """Matnni tozalash va encoding muammolarini hal qilish"""
-    if not text:
-        return ""
-    
-    # Encoding muammolarini hal qilish
-    try:
-        # UTF-8 ga decode qilish
-        if isinstance(text, bytes):
-            text = text.decode('utf-8')
+    async def file_done(self, user_id, context, added):
+        """Fayl qabul qilindi: albom to'liq bo'lsa PDF darhol, aks holda moslashuvchan kutish
+
+        Natija - PDF gacha kutish (soniya).
+        """
+        batch = self._batches.get(user_id)
+        if batch is None:
+            return None
+        batch["inflight"] -= 1
+        if not added:
+            # Yuklab bo'lmadi va kutilayotgan boshqa fayl yo'q - to'plam ham kerak emas
+            if not batch["inflight"] and user_id not in self._timers:
+                del self._batches[user_id]
+                self._forget(user_id)
+            return None
         
-        # Maxsus belgilarni almashtirish
-        replacements = {
-            'â€™': "'",
-            'â€"': "-",
-            'â€"': '"',
-            'â€˜': "'",
-            'â€™': "'",
-            'â€"': '"',
-            'â€"': '"',
-            'â€"': '-',
-            'â€"': '--',
-            '\x00': '',  # Null belgilar
-            '\r\n': '\n',  # Windows newline
-            '\r': '\n',    # Mac newline
-        }
+        if batch["group"] and batch["count"] >= ALBUM_MAX_ITEMS:
+            # Albomning barcha qismlari keldi. Telegram ko'p rasmni 10 talik albomlarga
+            # bo'lib yuboradi - keyingisi darhol kelsa, u ham shu PDF ga qo'shiladi
+            delay = ALBUM_FULL_DELAY
+        elif batch["group"]:
+            delay = ALBUM_DELAY
+        else:
+            # Bitta fayl - qisqa yo'l; fayllarni birma-bir yuboradiganlar uchun kutish tempiga moslashadi
+            gap = self._pace.get(user_id, [None, None])[1]
+            delay = self.min_delay if gap is None else min(self.max_delay, max(self.min_delay, gap * 1.5))
         
-        for old, new in replacements.items():
-            text = text.replace(old, new)
+        # Har fayl uchun task qayta yaratilmaydi - faqat muddat suriladi
+        batch["deadline"] = time.monotonic() + delay
+        if user_id not in self._timers:
+            self._timers[user_id] = asyncio.create_task(self._wait(user_id, context))
+        return delay
+
+    async def _wait(self, user_id, context):
+        while True:
+            batch = self._batches.get(user_id)
+            if batch is None:
+                break
+            remaining = batch["deadline"] - time.monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            elif batch["inflight"]:
+                # Keyingi fayl hali yuklanmoqda - u kelgach muddat yana suriladi
+                await asyncio.sleep(0.1)
+            else:
+                break
+        self._timers.pop(user_id, None)
+        await self.submit(user_id, context)
+
+    def _cancel_timer(self, user_id):
+        timer = self._timers.pop(user_id, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+    async def submit(self, user_id, context):
+        """Foydalanuvchi fayllaridan PDF yaratish ishini navbatga qo'yish"""
+        self._cancel_timer(user_id)
+        self._reset_batch(user_id)
         
-        # Bo'sh joylarni tozalash
-        text = text.strip()
+        files = [] if user_id in self._queue else await session_store.files(user_id)
         
-        # Agar matn bo'sh bo'lsa
-        if not text or text.isspace():
-            return ""
-            
-        return text
+        # Navbatdagi ish fayllarni ishga tushganda oladi - yangi fayllar unga qo'shiladi
+        if not files or user_id in self._queue:
+            await delete_progress_message(user_id, context)
+            return
         
-    except Exception as e:
-        print(f"Matnni tozalash xatosi: {e}")
-        # Agar encoding muammosi bo'lsa, oddiy matn qaytarish
-        try:
-            return str(text).encode('ascii', 'ignore').decode('ascii')
-        except:
-            return ""
+        cost = estimate_job_cost(files)
+        start = max(self._virtual_time, self._finish.get(user_id, 0.0))
+        self._finish[user_id] = start + cost
+        sequence = next(self._sequence)
+        job = {"user_id": user_id, "context": context, "start": start, "cost": cost,
+               "order": (start + cost, sequence), "key": ("job", sequence), "position": None}
+        
+        # Fayllar to'plamining xabari endi shu ishning navbat/yaratish xabari bo'ladi
+        progress_reporter.move(batch_progress_key(user_id), job["key"])
+        self._queue[user_id] = job
+        self._dispatch()
+
+    def _reset_batch(self, user_id):
+        batch = self._batches.get(user_id)
+        if batch is None:
+            return
+        if batch["inflight"]:
+            # Yuklanayotgan fayl keyingi PDF ga qoladi
+            batch.update(deadline=0.0, group=None, count=0)
+        else:
+            del self._batches[user_id]
+
+    def _queue_text(self, position):
+        return f"🕒 **PDF navbatda: {position}-o'rin**\n\nIltimos, kuting..."
+
+    def _dispatch(self):
+        """Bo'sh joylarga eng kichik virtual vaqtli ishlarni chiqarish"""
+        while len(self._running) < self.max_running:
+            ready = [job for job in self._queue.values() if job["user_id"] not in self._running]
+            if not ready:
+                break
+            job = min(ready, key=lambda item: item["order"])
+            del self._queue[job["user_id"]]
+            self._virtual_time = max(self._virtual_time, job["start"])
+            self._running[job["user_id"]] = asyncio.create_task(self._run(job))
+        self._report_positions()
+
+    def _report_positions(self):
+        """O'rni o'zgargan navbatdagi foydalanuvchilarning xabarini yangilash"""
+        ordered = sorted(self._queue.values(), key=lambda item: item["order"])
+        for position, job in enumerate(ordered, 1):
+            if job["position"] == position:
+                continue
+            job["position"] = position
+            progress_reporter.set(job["key"], job["user_id"], job["context"].bot, self._queue_text(position))
+
+    async def _run(self, job):
+        user_id, context = job["user_id"], job["context"]
+        
+        def on_progress(done, total):
+            # Render jarayonidan har bir fayl tayyor bo'lganda keladi
+            progress_reporter.set(job["key"], user_id, context.bot, render_progress_text(done, total))
+        
+        try:
+            # Fayllar ishga tushganda olinadi - navbatda kutganda kelganlari ham kiradi
+            files, pdf_num = await session_store.claim(user_id)
+            if files:
+                # Navbatda kutganda fayllar qo'shilgan bo'lsa - farq keyingi ish tartibiga o'tadi
+                if user_id in self._finish:
+                    self._finish[user_id] += estimate_job_cost(files) - job["cost"]
+                # Navbat xabari "yaratilmoqda" ga aylanadi
+                on_progress(0, len(files))
+                await create_and_send_pdf(user_id, context, files, pdf_num, on_progress)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"PDF ishi xatosi: {e}")
+        finally:
+            if self._running.get(user_id) is asyncio.current_task():
+                del self._running[user_id]
+            self._forget(user_id)
+            await progress_reporter.close(job["key"])
+            self._dispatch()
+
+    def _forget(self, user_id):
+        """Kutish, navbatdagi va bajarilayotgan ishi qolmagan foydalanuvchi holatini o'chirish"""
+        if (user_id in self._timers or user_id in self._batches
+                or user_id in self._queue or user_id in self._running):
+            return
+        # Keyingi ishi virtual vaqtdan boshlanadi - bo'sh turgan foydalanuvchi
+        # boshqalardan orqada ham, oldinda ham qolmaydi
+        self._finish.pop(user_id, None)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def cancel(self, user_id):
+        """Foydalanuvchining kutilayotgan, navbatdagi va bajarilayotgan ishini bekor qilish"""
+        self._cancel_timer(user_id)
+        self._reset_batch(user_id)
+        job = self._queue.pop(user_id, None)
+        if job is not None:
+            self._spawn(progress_reporter.close(job["key"]))
+        task = self._running.get(user_id)
+        if task is not None:
+            task.cancel()
+        self._forget(user_id)
+        self._dispatch()
+
+    async def resume(self, application, owns=None):
+        """Oldingi ishga tushishdan qolgan fayllardan PDF yaratishni davom ettirish
+
+        owns(user_id) - ko'p jarayonli rejimda faqat shu jarayonga tegishli foydalanuvchilar.
+        """
+        for chat_id, message_id in await session_store.recover():
+            try:
+                await application.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except Exception:
+                pass
+        
+        user_ids = await session_store.pending_users()
+        if owns is not None:
+            user_ids = [user_id for user_id in user_ids if owns(user_id)]
+        for user_id in user_ids:
+            context = application.context_types.context(application, chat_id=user_id, user_id=user_id)
+            await self.submit(user_id, context)
+        if user_ids:
+            print(f"{len(user_ids)} ta foydalanuvchining fayllari PDF navbatiga qaytarildi")
+
+    async def stop(self):
+        """Barcha ishlarni to'xtatish (bot to'xtaganda)"""
+        tasks = list(self._timers.values()) + list(self._running.values())
+        self._timers.clear()
+        self._queue.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+job_scheduler = JobScheduler(JOB_CONCURRENCY, BATCH_MIN_DELAY, BATCH_MAX_DELAY)
+
+# ===== UNICODE MATNLAR UCHUN FONTLAR =====
+UNICODE_FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+    "./fonts/DejaVuSans.ttf",
+    "arial.ttf",
+]
+
+class FontCache:
+    """TTF shriftlar keshi: fayl bir marta topiladi, o'qiladi va metrikalari hisoblanadi
+
+    fpdf add_font har safar butun TTF ni tahlil qiladi. Bu yerda tahlil qilingan
+    shrift namuna sifatida saqlanadi va har bir PDF ga uning arzon nusxasi beriladi.
+    """
+
+    def __init__(self, candidates):
+        self.candidates = candidates
+        self._path = None
+        self._resolved = False
+        self._templates = {}  # yo'l -> (TTFFont namunasi, fayl baytlari) yoki None
+
+    def resolve(self):
+        """Birinchi mavjud Unicode shrift yo'li (natija keshlanadi)"""
+        if not self._resolved:
+            self._resolved = True
+            for font_path in self.candidates:
+                if os.path.exists(font_path) and self._template(font_path):
+                    self._path = font_path
+                    break
+        return self._path
+
+    def _template(self, font_path):
+        if font_path not in self._templates:
+            try:
+                with open(font_path, "rb") as font_file:
+                    data = font_file.read()
+                scratch = FPDF()
+                scratch.add_font("template", "", font_path)
+                self._templates[font_path] = (scratch.fonts["template"], data)
+            except Exception as e:
+                print(f"Shriftni yuklash xatosi ({font_path}): {e}")
+                self._templates[font_path] = None
+        return self._templates[font_path]
+
+    def install(self, pdf, family, style="", font_path=None):
+        """Shriftni PDF ga qo'shish; muvaffaqiyatli bo'lsa True"""
+        font_path = font_path or self.resolve()
+        cached = font_path and self._template(font_path)
+        if not cached:
+            return False
+        template, data = cached
+        fontkey = f"{family.lower()}{style}"
+        if fontkey in pdf.fonts:
+            return True
+        
+        # Hujjatga xos holat yangidan: subsetlash ttfont ni joyida o'zgartiradi,
+        # desc esa PDF obyekti sifatida ro'yxatga olinadi
+        font = copy.copy(template)
+        font.i = len(pdf.fonts) + 1
+        font.fontkey = fontkey
+        font.emphasis = TextEmphasis.coerce(style)
+        font.desc = copy.copy(template.desc)
+        font.ttfont = ttLib.TTFont(io.BytesIO(data), recalcTimestamp=False, fontNumber=0, lazy=True)
+        font.missing_glyphs = []
+        reserved = "\x00 \r\n"
+        if pdf.str_alias_nb_pages:
+            reserved += "0123456789" + pdf.str_alias_nb_pages
+        font.subset = SubsetMap(font, [ord(char) for char in reserved])
+        pdf.fonts[fontkey] = font
+        return True
+
+    def preload(self):
+        """Render jarayoni ishga tushganda shriftlarni oldindan yuklash"""
+        font_path = self.resolve()
+        if font_path:
+            bold_path = font_path.replace(".ttf", "-Bold.ttf")
+            if os.path.exists(bold_path):
+                self._template(bold_path)
+
+
+font_cache = FontCache(UNICODE_FONT_PATHS)
+
+def add_unicode_support_to_pdf(pdf):
+    """PDF ga Unicode support qo'shish"""
+    # DejaVu Unicode fonti keshdan olinadi (fayl har PDF uchun qayta tahlil qilinmaydi)
+    if font_cache.install(pdf, 'DejaVu'):
+        pdf.set_font('DejaVu', '', 12)
+        return True
+    
+    # Eng oxirgi chora - standart font
+    pdf.set_font("Arial", size=12)
+    return False
+
+# ===== MATNNI TO'G'RI FORMATLASH =====
+# UTF-8 tinish belgilari cp1252 sifatida o'qilganda paydo bo'ladigan "mojibake"
+TEXT_MOJIBAKE = {
+    '\u00e2\u20ac\u2122': "'",    # ’
+    '\u00e2\u20ac\u02dc': "'",    # ‘
+    '\u00e2\u20ac\u0153': '"',    # “
+    '\u00e2\u20ac\u009d': '"',    # ” (0x9d cp1252 da yo'q, o'zgarmay qoladi)
+    '\u00e2\u20ac\u201c': '-',    # –
+    '\u00e2\u20ac\u201d': '--',   # —
+    '\u00e2\u20ac"': '--',        # — (oxirgi belgisi oddiy " ga aylangan)
+}
+# Bir belgili almashtirishlar - str.translate jadvali
+TEXT_TRANSLATION = str.maketrans({
+    '\x00': None,  # Null belgilar
+    '\r': '\n',    # Mac newline
+})
+# Mojibake - bitta regex, bitta o'tish (umumiy "â€" prefiksi bo'yicha tez qidiriladi)
+TEXT_PATTERN = re.compile("|".join(map(re.escape, TEXT_MOJIBAKE)))
+
+def _replace_mojibake(match):
+    return TEXT_MOJIBAKE[match.group()]
+
+def _normalize_text(text):
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    # Ko'p matnda almashtiriladigan belgi yo'q - "in" tekshiruvi regex va translate dan ancha arzon
+    if "\u00e2" in text:
+        text = TEXT_PATTERN.sub(_replace_mojibake, text)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")  # Windows newline
+    if "\r" in text or "\x00" in text:
+        text = text.translate(TEXT_TRANSLATION)
+    return text
+
+def clean_text(text):
+    """Matnni tozalash va encoding muammolarini hal qilish"""
+    if not text:
+        return ""
+    
+    try:
+        # Bo'sh joylarni tozalash (faqat bo'sh joydan iborat matn "" bo'ladi)
+        return _normalize_text(text).strip()
+        
+    except Exception as e:
+        print(f"Matnni tozalash xatosi: {e}")
+        # Agar encoding muammosi bo'lsa, oddiy matn qaytarish
+        try:
+            return str(text).encode('ascii', 'ignore').decode('ascii')
+        except:
+            return ""
+
+def clean_texts(texts):
+    """Matnlar ro'yxatini (qator kataklari, paragraflar) birga tozalash"""
+    try:
+        joined = "".join(texts)
+    except TypeError:
+        # None yoki baytlar aralashgan - birma-bir tozalash
+        return [clean_text(text) for text in texts]
+    # Butun paketda almashtiriladigan belgi bo'lmasa (odatiy holat), faqat strip
+    if "\u00e2" in joined or "\r" in joined or "\x00" in joined:
+        return [clean_text(text) for text in texts]
+    return [text.strip() for text in texts]
 
 # ===== DOCX FAYLLARINI QAYTA ISHLASH =====
+DOCX_PARAGRAPH_TAG = qn("w:p")
+DOCX_TABLE_TAG = qn("w:tbl")
+DOCX_HEADING_SIZES = {"Title": 20, "Heading 1": 18, "Heading 2": 16, "Heading 3": 14}
+
 def process_docx_file(path):
-    """DOCX faylini o'qish va to'g'ri formatlash"""
+    """DOCX tarkibini hujjatdagi tartibda bloklar ko'rinishida o'qish
+
+    Bloklar: ("heading", o'lcham, matn), ("para", matn), ("table", qatorlar).
+    """
     try:
         doc = docx.Document(path)
-        paragraphs = []
-        
-        for para in doc.paragraphs:
-            text = para.text
-            cleaned_text = clean_text(text)
-            if cleaned_text:  # Faqat bo'sh bo'lmagan paragraphlar
-                paragraphs.append(cleaned_text)
-        
-        return paragraphs
-        
     except Exception as e:
         print(f"DOCX faylini o'qish xatosi: {e}")
         return []
+    
+    items = []
+    # para.style har safar butun uslublar ro'yxatini qidiradi - nomlarni bir marta olamiz
+    style_names = {style.style_id: style.name for style in doc.styles}
+    # doc.paragraphs jadvallarni tashlab yuboradi - body elementlarini tartib bilan aylanamiz
+    for child in doc.element.body.iterchildren():
+        if child.tag == DOCX_PARAGRAPH_TAG:
+            items.append((style_names.get(child.style) or "", Paragraph(child, doc).text))
+        elif child.tag == DOCX_TABLE_TAG:
+            rows = []
+            for row in Table(child, doc).rows:
+                # Birlashtirilgan kataklar python-docx da takrorlanadi - ularni bir marta olamiz
+                cells, seen = [], set()
+                for cell in row.cells:
+                    if id(cell._tc) in seen:
+                        continue
+                    seen.add(id(cell._tc))
+                    cells.append(cell.text)
+                cells = clean_texts(cells)
+                if any(cells):
+                    rows.append(cells)
+            if rows:
+                items.append((None, rows))
+    
+    # Barcha paragraflar bitta paket bilan tozalanadi
+    texts = iter(clean_texts([text for style, text in items if style is not None]))
+    blocks = []
+    for style, content in items:
+        if style is None:
+            blocks.append(("table", content))
+            continue
+        text = next(texts)
+        if not text:
+            continue
+        if style in DOCX_HEADING_SIZES:
+            blocks.append(("heading", DOCX_HEADING_SIZES[style], text))
+        elif style.startswith("Heading"):
+            blocks.append(("heading", 13, text))
+        else:
+            blocks.append(("para", text))
+    return blocks
+
+# ===== MATN TERISH =====
+DOCX_FONT_SIZE = 12
+DOCX_LINE_SPACING = 1.5    # Qator balandligi = shrift o'lchami * shu koeffitsient
+DOCX_PARAGRAPH_GAP = 3     # mm
+DOCX_CELL_PADDING = 1      # mm
+PT = 0.3528                # 1 pt, mm da
+
+class GlyphWidths(dict):
+    """Bitta shrift uchun belgilar kengligi keshi (1 pt o'lchamda, mm)"""
+
+    def __init__(self, pdf, family, style):
+        super().__init__()
+        self.pdf = pdf
+        self.family = family
+        self.style = style
+
+    def __missing__(self, char):
+        # Har bir belgi fpdf orqali faqat bir marta o'lchanadi
+        pdf = self.pdf
+        if (pdf.font_family, pdf.font_style) != (self.family, self.style):
+            pdf.set_font(self.family, self.style)
+        width = pdf.get_string_width(char) / pdf.font_size_pt
+        self[char] = width
+        return width
+
+    def measure(self, text, size):
+        return sum(map(self.__getitem__, text)) * size
+
+
+# Render jarayonida hujjatlar orasida umumiy: (shrift, uslub) -> GlyphWidths
+_glyph_widths = {}
+
+class TextLayout:
+    """DOCX bloklarini sahifalarga terish; fpdf ga sahifa-sahifa bilan chiqariladi
+
+    Qatorlarni bo'lish fpdf dan tashqarida, kesh qilingan belgi kengliklari bilan
+    bajariladi - multi_cell ning har chaqiruvdagi qimmat hisob-kitobi bo'lmaydi.
+    """
+
+    def __init__(self, pdf, unicode_supported=True):
+        self.pdf = pdf
+        self.unicode_supported = unicode_supported
+        self.family = pdf.font_family
+        self.bold = self._bold_style()
+        self.left = pdf.l_margin
+        self.top = pdf.t_margin
+        self.width = pdf.w - pdf.l_margin - pdf.r_margin
+        self.bottom = pdf.h - pdf.b_margin
+        self.pages = []
+        self.ops = None
+        self.y = self.bottom  # Birinchi blok yangi sahifa ochadi
+
+    def _bold_style(self):
+        """Qalin shrift mavjud bo'lsa "B" qaytarish"""
+        pdf = self.pdf
+        if not self.unicode_supported:
+            return "B"  # Standart fontlarda qalin uslub doim bor
+        if self.family + "B" in pdf.fonts:
+            return "B"
+        regular = pdf.fonts.get(self.family)
+        font_path = getattr(regular, "ttffile", None)
+        if font_path:
+            bold_path = str(font_path).replace(".ttf", "-Bold.ttf")
+            if os.path.exists(bold_path) and font_cache.install(pdf, self.family, "B", bold_path):
+                return "B"
+        return ""
+
+    def _widths(self, style):
+        key = (self.family, style)
+        widths = _glyph_widths.get(key)
+        if widths is None or widths.pdf is not self.pdf:
+            # Kenglik shriftga bog'liq, PDF obyektiga emas - avvalgi o'lchovlar saqlanadi
+            fresh = GlyphWidths(self.pdf, self.family, style)
+            if widths:
+                fresh.update(widths)
+            widths = _glyph_widths[key] = fresh
+        return widths
+
+    def prepare(self, text):
+        text = text.replace("\t", "    ")
+        if not self.unicode_supported:
+            text = text.encode('latin-1', 'replace').decode('latin-1')
+        return text
+
+    def wrap(self, text, widths, size, max_width):
+        """Ochko'z (greedy) qator bo'lish; juda uzun so'zlar belgi bo'yicha bo'linadi"""
+        lines = []
+        space = widths[" "] * size
+        for source in text.split("\n"):
+            line, line_width = [], 0.0
+            for word in source.split(" "):
+                if not word:
+                    continue
+                word_width = widths.measure(word, size)
+                if word_width > max_width:
+                    if line:
+                        lines.append(" ".join(line))
+                        line, line_width = [], 0.0
+                    chunk, chunk_width = "", 0.0
+                    for char in word:
+                        char_width = widths[char] * size
+                        if chunk and chunk_width + char_width > max_width:
+                            lines.append(chunk)
+                            chunk, chunk_width = "", 0.0
+                        chunk += char
+                        chunk_width += char_width
+                    line, line_width = [chunk], chunk_width
+                    continue
+                if line and line_width + space + word_width > max_width:
+                    lines.append(" ".join(line))
+                    line, line_width = [word], word_width
+                else:
+                    line_width += space + word_width if line else word_width
+                    line.append(word)
+            lines.append(" ".join(line))
+        return lines
+
+    def new_page(self):
+        self.ops = []
+        self.pages.append(self.ops)
+        self.y = self.top
+
+    def ensure(self, height):
+        if self.ops is None or self.y + height > self.bottom:
+            self.new_page()
+
+    def add_text(self, text, size, style=""):
+        widths = self._widths(style)
+        line_height = size * PT * DOCX_LINE_SPACING
+        ascent = (line_height + size * PT * 0.7) / 2
+        for line in self.wrap(self.prepare(text), widths, size, self.width):
+            self.ensure(line_height)
+            if line:
+                self.ops.append(("text", self.left, self.y + ascent, style, size, line))
+            self.y += line_height
+        self.y += DOCX_PARAGRAPH_GAP
+
+    def add_table(self, rows, size):
+        widths = self._widths("")
+        col_count = max(len(row) for row in rows)
+        col_width = self.width / col_count
+        inner = col_width - 2 * DOCX_CELL_PADDING
+        line_height = size * PT * DOCX_LINE_SPACING
+        ascent = (line_height + size * PT * 0.7) / 2
+        
+        for row in rows:
+            cells = [self.wrap(self.prepare(row[i]) if i < len(row) else "", widths, size, inner)
+                     for i in range(col_count)]
+            # Sahifaga sig'maydigan qator keyingi sahifada davom etadi
+            offset = 0
+            total = max(len(lines) for lines in cells)
+            while offset < total:
+                self.ensure(line_height)
+                fit = min(total - offset, int((self.bottom - self.y) // line_height))
+                height = fit * line_height
+                x = self.left
+                for lines in cells:
+                    self.ops.append(("rect", x, self.y, col_width, height))
+                    for n, line in enumerate(lines[offset:offset + fit]):
+                        if line:
+                            self.ops.append(("text", x + DOCX_CELL_PADDING,
+                                             self.y + n * line_height + ascent, "", size, line))
+                    x += col_width
+                self.y += height
+                offset += fit
+        self.y += DOCX_PARAGRAPH_GAP
+
+    def add_blocks(self, blocks):
+        for block in blocks:
+            kind = block[0]
+            if kind == "heading":
+                # Sarlavha oldidan qo'shimcha bo'shliq (sahifa boshida emas)
+                if self.ops:
+                    self.y += DOCX_PARAGRAPH_GAP
+                self.add_text(block[2], block[1], self.bold)
+            elif kind == "table":
+                self.add_table(block[1], DOCX_FONT_SIZE - 2)
+            else:
+                self.add_text(block[1], DOCX_FONT_SIZE)
+
+    def emit(self):
+        """Terilgan sahifalarni fpdf ga chiqarish - har sahifa matni bitta BT..ET blokida"""
+        pdf = self.pdf
+        pdf.set_auto_page_break(False)
+        fonts = {style: pdf.fonts[self.family + style] for style in {"", self.bold}}
+        # Unicode (TTF) fontlar uchun belgi -> subset kodi jadvali; standart fontlarda pdf.text
+        encoders = {style: GlyphEncoder(font) for style, font in fonts.items()
+                    if hasattr(font, "subset")}
+        try:
+            for ops in self.pages:
+                pdf.add_page()
+                if len(encoders) == len(fonts):
+                    self._emit_page(ops, fonts, encoders)
+                    continue
+                current = None
+                for op in ops:
+                    if op[0] == "text":
+                        _, x, y, style, size, line = op
+                        if current != (style, size):
+                            pdf.set_font(self.family, style, size)
+                            current = (style, size)
+                        pdf.text(x, y, line)
+                    else:
+                        pdf.rect(*op[1:])
+        finally:
+            pdf.set_font(self.family, "", DOCX_FONT_SIZE)
+            pdf.set_auto_page_break(True, 10)
+            # Keshdagi kengliklar qoladi, PDF obyekti esa xotiradan bo'shatiladi
+            for widths in _glyph_widths.values():
+                if widths.pdf is pdf:
+                    widths.pdf = None
+        return len(self.pages)
+
+    def _emit_page(self, ops, fonts, encoders):
+        pdf = self.pdf
+        k, height = pdf.k, pdf.h
+        for op in ops:
+            if op[0] == "rect":
+                pdf.rect(*op[1:])
+        
+        parts = ["BT"]
+        current = None
+        for op in ops:
+            if op[0] != "text":
+                continue
+            _, x, y, style, size, line = op
+            if current != (style, size):
+                parts.append(f"/F{fonts[style].i} {size:.2f} Tf")
+                current = (style, size)
+            parts.append(f"1 0 0 1 {x * k:.2f} {(height - y) * k:.2f} Tm ({encoders[style].encode(line)}) Tj")
+        # fpdf kuzatayotgan joriy shriftni grafik holatda tiklash
+        parts.append(f"/F{pdf.current_font.i} {pdf.font_size_pt:.2f} Tf ET")
+        pdf._out("\n".join(parts))
+
+
+class GlyphEncoder(dict):
+    """TTF shrift subsetidagi belgi kodlari keshi (str.translate jadvali)"""
+
+    def __init__(self, font):
+        super().__init__()
+        self.subset = font.subset
+
+    def __missing__(self, code):
+        # Birinchi uchrashganda belgi subsetga qo'shiladi (fpdf encode_text kabi)
+        mapped = self[code] = chr(self.subset.pick(code))
+        return mapped
+
+    def encode(self, text):
+        data = text.translate(self).encode("utf-16-be").decode("latin-1")
+        return data.replace("\\", "\\\\").replace(")", "\\)").replace("(", "\\(").replace("\r", "\\r")
 
 # ===== EXCEL FAYLLARINI QAYTA ISHLASH =====
+EXCEL_SAMPLE_ROWS = 100   # Ustun kengliklari shuncha qatordan aniqlanadi
+EXCEL_FONT_SIZE = 8
+EXCEL_MIN_FONT_SIZE = 5
+EXCEL_MAX_COL_WIDTH = 60  # mm
+
 def process_excel_file(path):
-    """Excel faylini o'qish va to'g'ri formatlash"""
+    """Excel faylining barcha varaqlarini (nomi, qatorlar generatori) ko'rinishida oqim bilan o'qish"""
+    # read_only - qatorlar fayldan birma-bir o'qiladi, butun varaq xotiraga olinmaydi
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
     try:
-        wb = openpyxl.load_workbook(path, data_only=True)
-        ws = wb.active
-        data = []
+        for ws in wb.worksheets:
+            # read_only varaqdagi <dimension> ga ishonadi - ba'zi dasturlar uni noto'g'ri
+            # yozadi (masalan A1:A1) va qatorlar jimgina tushib qoladi. O'lcham fayl
+            # qatorlarining o'zidan aniqlanadi
+            ws.reset_dimensions()
+            yield ws.title, _iter_excel_rows(ws)
+    finally:
+        wb.close()
+
+def _iter_excel_rows(ws):
+    for row in ws.iter_rows(values_only=True):
+        # Qator kataklari bitta paket bilan tozalanadi
+        row_data = clean_texts(["" if cell is None else str(cell) for cell in row])
+        # Butunlay bo'sh qatorlarni o'tkazib yuborish
+        if any(row_data):
+            yield row_data
+
+def render_excel_sheet(pdf, title, rows, unicode_supported=True):
+    """Excel varag'ini PDF jadvali sifatida chiqarish; varaq bo'sh bo'lsa False"""
+    rows = iter(rows)
+    
+    # Faqat namuna qatorlar xotirada - qolganlari oqim bilan chiziladi
+    sample = list(itertools.islice(rows, EXCEL_SAMPLE_ROWS))
+    if not sample:
+        return False
+    
+    def prepare(text):
+        if not unicode_supported:
+            text = text.encode('latin-1', 'replace').decode('latin-1')
+        return text
+    
+    col_count = max(len(row) for row in sample)
+    font_size = EXCEL_FONT_SIZE
+    pdf.set_font_size(font_size)
+    
+    # Ustun kengligi - namunadagi eng uzun qiymat bo'yicha
+    widths = [4.0] * col_count
+    for row in sample:
+        for i, text in enumerate(row):
+            if text:
+                widths[i] = max(widths[i], pdf.get_string_width(prepare(text)) + 2)
+    widths = [min(width, EXCEL_MAX_COL_WIDTH) for width in widths]
+    
+    # Keng jadvallar uchun albom sahifa, sig'masa - shrift va ustunlarni kichraytirish
+    orientation = "L" if sum(widths) > 190 else "P"
+    pdf.add_page(orientation=orientation)
+    scale = min(1.0, pdf.epw / sum(widths))
+    if scale < 1:
+        font_size = max(EXCEL_MIN_FONT_SIZE, EXCEL_FONT_SIZE * scale)
+        widths = [width * scale for width in widths]
+    row_height = font_size * 0.6
+    
+    # Qisqartirish kerak emasligini tez aniqlash (eng keng belgi bo'yicha)
+    pdf.set_font_size(font_size)
+    wide_char = pdf.get_string_width("W") or 1
+    safe_chars = [int((width - 1) / wide_char) for width in widths]
+    
+    def fit(text, i):
+        text = prepare(text)
+        if len(text) <= safe_chars[i]:
+            return text
+        width = pdf.get_string_width(text)
+        limit = widths[i] - 1
+        if width <= limit:
+            return text
+        # Taxminiy kesish, keyin kerak bo'lsa bir necha belgi qisqartirish
+        text = text[:max(0, int(len(text) * limit / width) - 3)]
+        while text and pdf.get_string_width(text + "...") > limit:
+            text = text[:-2]
+        return text + "..."
+    
+    # Matn tayanch chizig'i katak ichida vertikal markazda
+    baseline = (row_height + font_size * 0.3528 * 0.7) / 2
+    
+    def draw_row(row, header=False):
+        # cell() o'rniga rect() + text() - har bir katak uchun ancha arzon
+        x = pdf.l_margin
+        y = pdf.get_y()
+        for i in range(col_count):
+            pdf.rect(x, y, widths[i], row_height, style="DF" if header else "D")
+            text = row[i] if i < len(row) else ""
+            if text:
+                pdf.text(x + 0.5, y + baseline, fit(text, i))
+            x += widths[i]
+        pdf.set_y(y + row_height)
+    
+    # Varaq nomi
+    pdf.set_font_size(11)
+    pdf.cell(0, 8, prepare(title))
+    pdf.ln(8)
+    pdf.set_font_size(font_size)
+    
+    header = sample[0]
+    pdf.set_fill_color(230, 230, 230)
+    draw_row(header, header=True)
+    
+    for row in itertools.chain(sample[1:], rows):
+        # Yangi sahifada sarlavha qatori takrorlanadi
+        if pdf.get_y() + row_height > pdf.page_break_trigger:
+            pdf.add_page(orientation=orientation)
+            draw_row(header, header=True)
+        draw_row(row)
+    
+    return True
+
+# ===== RASMLARNI QABUL QILISH =====
+IMAGE_MAX_SIZE = (2000, 2000)
+
+def normalize_image(path):
+    """Rasmni RGB JPEG ga o'tkazib, 2000px gacha kichraytirish va (eni, bo'yi) ni qaytarish"""
+    with Image.open(path) as img:
+        w, h = img.size
+        ratio = min(1, IMAGE_MAX_SIZE[0] / w, IMAGE_MAX_SIZE[1] / h)
+        target = (max(1, round(w * ratio)), max(1, round(h * ratio)))
         
-        for row in ws.iter_rows(values_only=True):
-            row_data = []
-            for cell in row:
-                if cell is None:
-                    row_data.append("")
-                else:
-                    # Cell ma'lumotini to'g'ri formatlash
-                    cell_text = str(cell)
-                    cleaned_text = clean_text(cell_text)
-                    row_data.append(cleaned_text)
-            data.append(row_data)
+        # JPEG draft rejimi: rasm DCT dekodlash paytida 1/2, 1/4 yoki 1/8 ga kichraytiriladi
+        # (to'liq o'lchamdagi rasm xotiraga umuman ochilmaydi)
+        img.draft("RGB", target)
+        img = img.convert("RGB")
+    
+    img.thumbnail(IMAGE_MAX_SIZE)
+    img.save(path, "JPEG", quality=80)
+    return img.size
+
+# Rasmlarni qabul qilish uchun thread pool (Pillow dekodlashda GIL ni bo'shatadi)
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+# ===== RASMLAR KESHI =====
+class ImageCache:
+    """file_unique_id bo'yicha kichraytirilgan rasmlarni diskda saqlovchi LRU kesh"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # unique_id -> (hajm, eni, bo'yi)
+        self._total = 0
+        self._loaded = False
+
+    def _path(self, unique_id, width, height):
+        # O'lcham fayl nomida - qayta ishga tushganda rasmni ochish shart emas
+        return os.path.join(self.directory, f"{unique_id}_{width}x{height}.jpg")
+
+    def _load(self):
+        """Diskdagi mavjud keshni tiklash (eng eski birinchi)"""
+        self._loaded = True
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for name in os.listdir(self.directory):
+            try:
+                unique_id, dims = name[:-len(".jpg")].rsplit("_", 1)
+                width, height = (int(v) for v in dims.split("x"))
+                stat = os.stat(os.path.join(self.directory, name))
+            except (ValueError, OSError):
+                continue
+            found.append((stat.st_mtime, unique_id, stat.st_size, width, height))
         
-        return data
+        for _, unique_id, size, width, height in sorted(found):
+            self._entries[unique_id] = (size, width, height)
+            self._total += size
+        self._evict()
+
+    def get(self, unique_id, dest):
+        """Keshdagi rasmni dest ga bog'lash va (eni, bo'yi) ni qaytarish; bo'lmasa None"""
+        if self.max_bytes <= 0:
+            return None
+        if not self._loaded:
+            self._load()
         
-    except Exception as e:
-        print(f"Excel faylini o'qish xatosi: {e}")
-        return []
+        entry = self._entries.get(unique_id)
+        if entry is None:
+            return None
+        
+        _, width, height = entry
+        source = self._path(unique_id, width, height)
+        try:
+            _link_or_copy(source, dest)
+            os.utime(source)
+        except OSError:
+            self._discard(unique_id)
+            return None
+        
+        self._entries.move_to_end(unique_id)
+        return width, height
 
-# ===== PDF YARATISH VA YUBORISH =====
-async def create_and_send_pdf(user_id, context):
-    try:
-        files = user_files.get(user_id)
-        if not files or len(files) == 0:
+    def put(self, unique_id, path, width, height):
+        """Kichraytirilgan rasmni keshga qo'shish"""
+        if self.max_bytes <= 0 or not unique_id:
+            return
+        if not self._loaded:
+            self._load()
+        if unique_id in self._entries:
             return
-
-        pdf = FPDF()
-        
-        # Unicode support qo'shish
-        unicode_supported = add_unicode_support_to_pdf(pdf)
-        if not unicode_supported:
-            pdf.set_font("Arial", size=12)
         
-        pdf.set_auto_page_break(True, 10)
+        target = self._path(unique_id, width, height)
+        try:
+            _link_or_copy(path, target)
+            size = os.path.getsize(target)
+        except OSError as e:
+            print(f"Rasmni keshga yozish xatosi: {e}")
+            return
         
-        current_pdf_num = user_pdf_counter.get(user_id, 1)
-        total_files = len(files)
+        self._entries[unique_id] = (size, width, height)
+        self._total += size
+        self._evict()
 
-        for idx, path in enumerate(files, 1):
-            try:
-                ext = os.path.splitext(path)[1].lower()
-                
-                if ext in [".jpg", ".jpeg", ".png"]:
-                    # RASM uchun
+    def _discard(self, unique_id):
+        size, width, height = self._entries.pop(unique_id)
+        self._total -= size
+        try:
+            os.remove(self._path(unique_id, width, height))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Byte chegarasidan oshsa, eng uzoq ishlatilmaganlarini o'chirish
+        while self._entries and self._total > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+
+
+def _link_or_copy(source, dest):
+    # Hard link - nusxalashsiz; foydalanuvchi fayli o'chirilsa ham kesh fayli qoladi
+    try:
+        os.link(source, dest)
+    except FileExistsError:
+        os.remove(dest)
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+image_cache = ImageCache("temp/cache", IMAGE_CACHE_BYTES)
+
+# ===== PDF SAHIFALARINI YARATISH =====
+# Fayl turi -> metrikalardagi bosqich nomi
+RENDER_STAGES = {
+    ".jpg": "convert_image", ".jpeg": "convert_image", ".png": "convert_image",
+    ".docx": "convert_docx", ".xlsx": "convert_xlsx", ".xls": "convert_xlsx",
+}
+
+def render_pdf(files, spill_path=None, spill_bytes=0, progress_id=None):
+    """Fayllardan PDF yaratish (render jarayonida ishlaydi)
+
+    Natija: {"data": baytlar, "path": None} yoki, PDF spill_bytes dan katta bo'lsa,
+    diskka yozilgan fayl: {"data": None, "path": spill_path}. "timings" va "errors" -
+    bosqichlar davomiyligi va xatoliklari (metrikalar uchun).
+    progress_id berilsa, har bir fayldan keyin asosiy jarayonga progress yuboriladi.
+    """
+    # files - {"path", "width", "height"} yozuvlari (o'lcham faqat qabul qilingan rasmlarda bor)
+    pdf = FPDF()
+    
+    # Unicode support qo'shish
+    unicode_supported = add_unicode_support_to_pdf(pdf)
+    if not unicode_supported:
+        pdf.set_font("Arial", size=12)
+    
+    pdf.set_auto_page_break(True, 10)
+    
+    timings = []  # (bosqich, soniya) - asosiy jarayonda metrikalarga yoziladi
+    errors = []   # xatolik bo'lgan bosqichlar
+
+    for idx, entry in enumerate(files, 1):
+        report_render_progress(progress_id, idx - 1, len(files))
+        path = entry["path"]
+        ext = os.path.splitext(path)[1].lower()
+        stage = RENDER_STAGES.get(ext, "convert_other")
+        started = time.perf_counter()
+        try:
+            if ext in [".jpg", ".jpeg", ".png"]:
+                # RASM uchun
+                pdf.add_page()
+                try:
+                    # O'lcham qabul qilishda yozilgan bo'lsa, rasmni qayta ochmaslik
+                    if entry.get("width") and entry.get("height"):
+                        w, h = entry["width"], entry["height"]
+                    else:
+                        with Image.open(path) as img:
+                            w, h = img.size
+                    
+                    # A4 formatiga moslashtirish
+                    page_width = 190  # mm
+                    page_height = 277  # mm
+                    
+                    ratio = min(page_width / w, page_height / h)
+                    new_width = w * ratio
+                    new_height = h * ratio
+                    
+                    # Markazga joylashtirish
+                    x = (210 - new_width) / 2
+                    y = (297 - new_height) / 2
+                    
+                    pdf.image(path, x=x, y=y, w=new_width, h=new_height)
+                    
+                except Exception as img_e:
+                    print(f"Rasm xatosi: {img_e}")
+                    errors.append(stage)
                     pdf.add_page()
-                    try:
-                        img = Image.open(path)
-                        w, h = img.size
-                        
-                        # A4 formatiga moslashtirish
-                        page_width = 190  # mm
-                        page_height = 277  # mm
-                        
-                        ratio = min(page_width / w, page_height / h)
-                        new_width = w * ratio
-                        new_height = h * ratio
-                        
-                        # Markazga joylashtirish
-                        x = (210 - new_width) / 2
-                        y = (297 - new_height) / 2
-                        
-                        pdf.image(path, x=x, y=y, w=new_width, h=new_height)
-                        
-                    except Exception as img_e:
-                        print(f"Rasm xatosi: {img_e}")
-                        pdf.add_page()
-                        pdf.cell(0, 10, f"Rasmni ochishda xatolik: {path}", 0, 1)
+                    pdf.cell(0, 10, f"Rasmni ochishda xatolik: {path}", 0, 1)
 
-                elif ext == ".docx":
-                    # WORD DOCX uchun
-                    try:
-                        paragraphs = process_docx_file(path)
-                        
-                        if paragraphs:
-                            pdf.add_page()
-                            pdf.set_font_size(12)
-                            
-                            for para in paragraphs:
-                                # Matnni PDF ga qo'shish
-                                try:
-                                    # Ko'p qatorli matn
-                                    pdf.multi_cell(0, 8, para)
-                                    pdf.ln(4)
-                                except Exception as write_e:
-                                    print(f"Matn yozish xatosi: {write_e}")
-                                    # Agar xatolik bo'lsa, encoding ni o'zgartirish
-                                    try:
-                                        safe_text = para.encode('latin-1', 'replace').decode('latin-1')
-                                        pdf.multi_cell(0, 8, safe_text)
-                                        pdf.ln(4)
-                                    except:
-                                        pdf.multi_cell(0, 8, "[Matnni ko'rsatish mumkin emas]")
-                                        pdf.ln(4)
-                        else:
-                            pdf.add_page()
-                            pdf.cell(0, 10, f"DOCX fayl bo'sh yoki o'qish mumkin emas: {path}", 0, 1)
-                            
-                    except Exception as doc_e:
-                        print(f"Word xatosi: {doc_e}")
+            elif ext == ".docx":
+                # WORD DOCX uchun - avval sahifalarga terish, keyin bir yo'la chiqarish
+                try:
+                    blocks = process_docx_file(path)
+                    
+                    if blocks:
+                        layout = TextLayout(pdf, unicode_supported)
+                        layout.add_blocks(blocks)
+                        layout.emit()
+                    else:
                         pdf.add_page()
-                        pdf.cell(0, 10, f"DOCX faylni qayta ishlashda xatolik", 0, 1)
-
-                elif ext in [".xlsx", ".xls"]:
-                    # EXCEL uchun
-                    try:
-                        data = process_excel_file(path)
+                        pdf.cell(0, 10, f"DOCX fayl bo'sh yoki o'qish mumkin emas: {path}", 0, 1)
                         
-                        if data:
-                            pdf.add_page()
-                            pdf.set_font_size(10)
-                            
-                            for row_idx, row in enumerate(data):
-                                # Har bir satrni bitta qatorda chiqarish
-                                row_text = " | ".join([str(cell) for cell in row])
-                                
-                                # Juda uzun satrlarni qisqartirish
-                                if len(row_text) > 150:
-                                    row_text = row_text[:147] + "..."
-                                
-                                try:
-                                    pdf.multi_cell(0, 6, row_text)
-                                except:
-                                    # Encoding muammosi bo'lsa
-                                    try:
-                                        safe_text = row_text.encode('latin-1', 'replace').decode('latin-1')
-                                        pdf.multi_cell(0, 6, safe_text)
-                                    except:
-                                        pdf.multi_cell(0, 6, f"[Satr {row_idx + 1}]")
-                        else:
-                            pdf.add_page()
-                            pdf.cell(0, 10, f"Excel fayl bo'sh yoki o'qish mumkin emas", 0, 1)
-                            
-                    except Exception as excel_e:
-                        print(f"Excel xatosi: {excel_e}")
+                except Exception as doc_e:
+                    print(f"Word xatosi: {doc_e}")
+                    errors.append(stage)
+                    pdf.add_page()
+                    pdf.cell(0, 10, f"DOCX faylni qayta ishlashda xatolik", 0, 1)
+
+            elif ext in [".xlsx", ".xls"]:
+                # EXCEL uchun - barcha varaqlar jadval ko'rinishida
+                try:
+                    rendered = False
+                    for title, rows in process_excel_file(path):
+                        if render_excel_sheet(pdf, title, rows, unicode_supported):
+                            rendered = True
+                    
+                    if not rendered:
                         pdf.add_page()
-                        pdf.cell(0, 10, f"Excel faylni qayta ishlashda xatolik", 0, 1)
+                        pdf.cell(0, 10, f"Excel fayl bo'sh yoki o'qish mumkin emas", 0, 1)
                         
-                else:
-                    # Boshqa fayl turlari uchun
+                except Exception as excel_e:
+                    print(f"Excel xatosi: {excel_e}")
+                    errors.append(stage)
                     pdf.add_page()
-                    pdf.cell(0, 10, f"Noma'lum fayl turi: {ext}", 0, 1)
+                    pdf.cell(0, 10, f"Excel faylni qayta ishlashda xatolik", 0, 1)
                     
-            except Exception as e:
-                print(f"Fayl qayta ishlash xatosi: {e}")
+            else:
+                # Boshqa fayl turlari uchun
                 pdf.add_page()
-                pdf.cell(0, 10, f"Faylni qayta ishlashda xatolik: {path}", 0, 1)
-                continue
+                pdf.cell(0, 10, f"Noma'lum fayl turi: {ext}", 0, 1)
+                
+        except Exception as e:
+            print(f"Fayl qayta ishlash xatosi: {e}")
+            errors.append(stage)
+            pdf.add_page()
+            pdf.cell(0, 10, f"Faylni qayta ishlashda xatolik: {path}", 0, 1)
+        finally:
+            timings.append((stage, time.perf_counter() - started))
+
+    report_render_progress(progress_id, len(files), len(files))
+    started = time.perf_counter()
+    data = pdf.output()
+    timings.append(("pdf_output", time.perf_counter() - started))
+    
+    # Katta PDF lar diskka yoziladi - jarayonlar orasida katta baytlarni uzatmaslik uchun
+    if spill_path and len(data) > spill_bytes:
+        with open(spill_path, "wb") as out_file:
+            out_file.write(data)
+        return {"data": None, "path": spill_path, "size": len(data), "timings": timings, "errors": errors}
+    
+    return {"data": bytes(data), "path": None, "size": len(data), "timings": timings, "errors": errors}
+
+# ===== PDF RENDER DVIGATELI =====
+# Render jarayonida: asosiy jarayonga progress yuboriladigan navbat
+_render_progress_queue = None
+
+def init_render_worker(progress_queue=None):
+    """Render jarayoni boshida shriftlarni yuklab qo'yish (birinchi PDF kutib qolmasligi uchun)"""
+    global _render_progress_queue
+    _render_progress_queue = progress_queue
+    font_cache.preload()
+
+def report_render_progress(progress_id, done, total):
+    """Render jarayonidan tayyor fayllar sonini yuborish (asosiy jarayonda hech narsa qilmaydi)"""
+    if progress_id is not None and _render_progress_queue is not None:
+        try:
+            _render_progress_queue.put_nowait((progress_id, done, total))
+        except Exception:
+            pass
+
+class PdfRenderEngine:
+    """PDF larni alohida jarayonlarda yaratuvchi cheklangan navbat"""
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, int(max_workers))
+        self._executor = None
+        self._semaphore = None
+        self._waiting = 0
+        self._running = 0
+        self._progress_queue = None
+        self._listeners = {}  # progress_id -> callback(tayyor, jami)
+        self._progress_ids = itertools.count(1)
+
+    @property
+    def queue_depth(self):
+        """Bo'sh jarayon kutayotgan PDF lar soni"""
+        return self._waiting
+
+    @property
+    def active_renders(self):
+        """Hozir yaratilayotgan PDF lar soni"""
+        return self._running
+
+    def _get_executor(self):
+        if self._executor is None:
+            # "spawn" - event loop va DB thread lari bor jarayonni fork qilmaslik uchun
+            mp_context = multiprocessing.get_context("spawn")
+            # Progress navbati jarayonlarga initializer orqali meros qilib beriladi
+            self._progress_queue = mp_context.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=mp_context,
+                initializer=init_render_worker,
+                initargs=(self._progress_queue,)
+            )
+            reader = threading.Thread(
+                target=self._read_progress,
+                args=(self._progress_queue, asyncio.get_running_loop()),
+                name="render-progress",
+                daemon=True
+            )
+            reader.start()
+        return self._executor
+
+    def _read_progress(self, progress_queue, loop):
+        """Render jarayonlaridan kelgan progressni event loop ga uzatish (alohida thread)"""
+        while True:
+            item = progress_queue.get()
+            if item is None:
+                break
+            try:
+                loop.call_soon_threadsafe(self._dispatch_progress, *item)
+            except RuntimeError:
+                break  # Event loop yopilgan
+
+    def _dispatch_progress(self, progress_id, done, total):
+        callback = self._listeners.get(progress_id)
+        if callback is not None:
+            try:
+                callback(done, total)
+            except Exception as e:
+                print(f"Render progress xatosi: {e}")
+
+    def _close_executor(self, wait):
+        executor, self._executor = self._executor, None
+        progress_queue, self._progress_queue = self._progress_queue, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        if progress_queue is not None:
+            progress_queue.put(None)  # O'quvchi threadni to'xtatish
+
+    async def render(self, files, spill_path=None, spill_bytes=0, on_progress=None):
+        """PDF ni render jarayonida yaratish (natija - render_pdf ga qarang)
+
+        on_progress(tayyor, jami) - har bir fayl tayyor bo'lganda event loop da chaqiriladi.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
 
-        # PDF ni saqlash
-        out = f"temp/{user_id}_pdf_{current_pdf_num}.pdf"
-        pdf.output(out)
+        # Navbatda kutish (executor ichki navbati cheksiz o'smasligi uchun)
+        self._waiting += 1
+        try:
+            with stage_seconds.time(stage="render_wait"):
+                await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
 
-        # Foydalanuvchiga yuborish
+        self._running += 1
+        progress_id = None
+        if on_progress is not None:
+            progress_id = next(self._progress_ids)
+            self._listeners[progress_id] = on_progress
         try:
-            with open(out, "rb") as pdf_file:
-                await context.bot.send_document(
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._get_executor(), render_pdf, list(files), spill_path, spill_bytes, progress_id
+            )
+        except BrokenProcessPool:
+            # Jarayon qulagan bo'lsa (masalan, xotira yetmadi), keyingi ish uchun yangisini ochish
+            print("Render jarayoni to'xtadi, pool qayta yaratiladi")
+            errors_counter.inc(stage="render_pool")
+            self._close_executor(wait=False)
+            raise
+        finally:
+            self._listeners.pop(progress_id, None)
+            self._running -= 1
+            self._semaphore.release()
+
+    def shutdown(self):
+        """Render jarayonlarini to'xtatish"""
+        self._close_executor(wait=True)
+
+# ===== TAYYOR PDF LAR KESHI =====
+# Render natijasi o'zgarsa oshiriladi - eski file_id lar ishlatilmay qoladi
+PDF_RENDER_VERSION = 1
+
+def pdf_cache_key(files):
+    """Fayllar tartibi (file_unique_id) va render sozlamalaridan kesh kaliti"""
+    unique_ids = [f.get("unique_id") for f in files]
+    if not all(unique_ids):
+        return None
+    
+    digest = hashlib.sha256(f"v{PDF_RENDER_VERSION}|{IMAGE_MAX_SIZE}".encode())
+    for unique_id in unique_ids:
+        digest.update(b"\0" + unique_id.encode())
+    return digest.hexdigest()
+
+async def send_cached_pdf(context, user_id, cache_key, caption):
+    """Keshdagi file_id orqali PDF yuborish; kesh bo'lmasa yoki eskirgan bo'lsa False"""
+    row = await db.fetchone('SELECT file_id FROM pdf_cache WHERE key = ?', (cache_key,))
+    if row is None:
+        return False
+    
+    try:
+        await context.bot.send_document(
+            chat_id=user_id,
+            document=row[0],
+            caption=caption,
+            parse_mode='Markdown'
+        )
+    except BadRequest as e:
+        # file_id endi yaroqsiz - keshdan o'chirib, PDF ni qayta yaratish
+        print(f"Keshdagi PDF yaroqsiz: {e}")
+        await db.execute('DELETE FROM pdf_cache WHERE key = ?', (cache_key,))
+        return False
+    
+    await db.execute("UPDATE pdf_cache SET last_used = datetime('now') WHERE key = ?", (cache_key,))
+    pdfs_sent.inc(source="cache")
+    return True
+
+async def remember_pdf(cache_key, file_id):
+    """Yuborilgan PDF ning file_id sini saqlash"""
+    await db.execute('''
+    INSERT OR REPLACE INTO pdf_cache (key, file_id, last_used)
+    VALUES (?, ?, datetime('now'))
+    ''', (cache_key, file_id))
+
+async def prune_pdf_cache():
+    """Uzoq vaqt ishlatilmagan file_id larni o'chirish"""
+    await db.execute(
+        "DELETE FROM pdf_cache WHERE last_used < datetime('now', ?)",
+        (f'-{PDF_CACHE_DAYS} days',)
+    )
+
+# ===== PDF YARATISH VA YUBORISH =====
+async def create_and_send_pdf(user_id, context, files, current_pdf_num, on_progress=None):
+    """session_store.claim dan olingan fayllardan PDF yaratib yuborish"""
+    try:
+        total_files = len(files)
+
+        caption = (
+            f"✅ **PDF #{current_pdf_num} tayyor!**\n\n"
+            f"📊 {total_files} ta fayl birlashtirildi.\n\n"
+            f"Yangi fayllar yuborishingiz mumkin!"
+        )
+
+        # Xuddi shu fayllardan PDF avval yuborilgan bo'lsa - file_id orqali qayta yuborish
+        cache_key = pdf_cache_key(files)
+        sent = False
+        if cache_key:
+            sent = await send_cached_pdf(context, user_id, cache_key, caption)
+
+        out = None
+        if not sent:
+            # PDF ni alohida jarayonda yaratish (event loop bloklanmaydi).
+            # Odatiy PDF xotirada qoladi, faqat PDF_SPILL_BYTES dan kattasi diskka yoziladi
+            with stage_seconds.time(stage="render"):
+                result = await render_engine.render(
+                    files,
+                    spill_path=f"temp/{user_id}_pdf_{current_pdf_num}.pdf",
+                    spill_bytes=PDF_SPILL_BYTES,
+                    on_progress=on_progress
+                )
+            record_render_metrics(result)
+            out = result["path"]
+            filename = f"PDF_{current_pdf_num}.pdf"
+
+            # Foydalanuvchiga yuborish
+            try:
+                with stage_seconds.time(stage="upload"):
+                    if out:
+                        with open(out, "rb") as pdf_file:
+                            msg = await context.bot.send_document(
+                                chat_id=user_id,
+                                document=pdf_file,
+                                filename=filename,
+                                caption=caption,
+                                parse_mode='Markdown'
+                            )
+                    else:
+                        msg = await context.bot.send_document(
+                            chat_id=user_id,
+                            document=result["data"],
+                            filename=filename,
+                            caption=caption,
+                            parse_mode='Markdown'
+                        )
+                pdfs_sent.inc(source="render")
+                bytes_transferred.inc(result["size"], direction="out")
+                if cache_key and msg.document:
+                    await remember_pdf(cache_key, msg.document.file_id)
+            except Exception as send_e:
+                print(f"Yuborish xatosi: {send_e}")
+                errors_counter.inc(stage="upload")
+                await context.bot.send_message(
                     chat_id=user_id,
-                    document=pdf_file,
-                    filename=f"PDF_{current_pdf_num}.pdf",
-                    caption=f"✅ **PDF #{current_pdf_num} tayyor!**\n\n"
-                           f"📊 {total_files} ta fayl birlashtirildi.\n\n"
-                           f"Yangi fayllar yuborishingiz mumkin!",
-                    parse_mode='Markdown'
+                    text=f"❌ PDF yuborishda xatolik"
                 )
-        except Exception as send_e:
-            print(f"Yuborish xatosi: {send_e}")
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"❌ PDF yuborishda xatolik"
-            )
 
         # Fayllarni tozalash
-        for f in files:
-            try:
-                if os.path.exists(f):
-                    os.remove(f)
-            except:
-                pass
+        remove_temp_files(files)
         
         # Chiqish faylini o'chirish
         try:
-            if os.path.exists(out):
+            if out and os.path.exists(out):
                 os.remove(out)
         except:
             pass
         
-        # Fayllar ro'yxatini tozalash
-        user_files[user_id] = []
-        
-        # PDF raqamini oshirish
-        user_pdf_counter[user_id] = current_pdf_num + 1
+        # Sessiyadan faqat shu PDF ga kirgan fayllar o'chiriladi, PDF raqami oshadi
+        await session_store.complete(user_id)
         
         # Statistikani yangilash
         increment_user_stats(user_id, pdfs=1, files=total_files)
         
     except Exception as e:
         print(f"PDF yaratish xatosi: {e}")
+        errors_counter.inc(stage="pdf")
+        # Fayllar keyingi PDF ga qoladi
+        await session_store.release(user_id)
         try:
             await context.bot.send_message(
                 chat_id=user_id,
@@ -1331,6 +3526,22 @@ async def create_and_send_pdf(user_id, context):
         except:
             pass
 
+def record_render_metrics(result):
+    """Render jarayonidan qaytgan bosqichlar davomiyligi va xatoliklarini metrikalarga yozish"""
+    for stage, seconds in result.get("timings", ()):
+        stage_seconds.observe(seconds, stage=stage)
+    for stage in result.get("errors", ()):
+        errors_counter.inc(stage=stage)
+
+def remove_temp_files(files):
+    """Sessiya fayllarini diskdan o'chirish"""
+    for f in files:
+        try:
+            if os.path.exists(f["path"]):
+                os.remove(f["path"])
+        except:
+            pass
+
 # ===== /newpdf - DARHOL PDF YARATISH =====
 async def new_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
@@ -1340,38 +3551,25 @@ async def new_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
     update_user_activity(user_id)
     
     # Obunani tekshirish
-    if user_id not in user_subscribed or not user_subscribed[user_id]:
-        is_subscribed = await check_subscription(user_id, context)
-        if not is_subscribed:
-            channel_info = await get_channel_info(context)
-            keyboard = [
-                [InlineKeyboardButton(f"📢 {channel_info['title']}", url=channel_info["link"])],
-                [InlineKeyboardButton("✅ Obunani tekshirish", callback_data="check_subscription")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"❌ Botdan foydalanish uchun kanalga obuna bo'lishingiz kerak!",
-                reply_markup=reply_markup
-            )
-            return
-        user_subscribed[user_id] = True
+    is_subscribed = await check_subscription(user_id, context)
+    if not is_subscribed:
+        channel_info = await get_channel_info(context)
+        keyboard = [
+            [InlineKeyboardButton(f"📢 {channel_info['title']}", url=channel_info["link"])],
+            [InlineKeyboardButton("✅ Obunani tekshirish", callback_data="check_subscription")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.message.reply_text(
+            f"❌ Botdan foydalanish uchun kanalga obuna bo'lishingiz kerak!",
+            reply_markup=reply_markup
+        )
+        return
     
     # Agar fayllar bo'lsa, PDF yaratish
-    if user_files.get(user_id) and len(user_files[user_id]) > 0:
-        # Avvalgi taskni bekor qilish
-        if user_id in user_tasks:
-            try:
-                user_tasks[user_id].cancel()
-            except:
-                pass
-            user_tasks.pop(user_id, None)
-        
-        # Progress xabarini o'chirish
-        await delete_progress_message(user_id, context)
-        
-        # Darhol PDF yaratish
-        await create_and_send_pdf(user_id, context)
+    if await session_store.files(user_id):
+        # Kutmasdan darhol navbatga qo'yish
+        await job_scheduler.submit(user_id, context)
     else:
         await update.message.reply_text(
             "📄 **PDF yaratish uchun avval fayllar yuboring!**",
@@ -1387,46 +3585,29 @@ async def clean(update: Update, context: ContextTypes.DEFAULT_TYPE):
     update_user_activity(user_id)
     
     # Obunani tekshirish
-    if user_id not in user_subscribed or not user_subscribed[user_id]:
-        is_subscribed = await check_subscription(user_id, context)
-        if not is_subscribed:
-            channel_info = await get_channel_info(context)
-            keyboard = [
-                [InlineKeyboardButton(f"📢 {channel_info['title']}", url=channel_info["link"])],
-                [InlineKeyboardButton("✅ Obunani tekshirish", callback_data="check_subscription")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"❌ Botdan foydalanish uchun kanalga obuna bo'lishingiz kerak!",
-                reply_markup=reply_markup
-            )
-            return
-        user_subscribed[user_id] = True
+    is_subscribed = await check_subscription(user_id, context)
+    if not is_subscribed:
+        channel_info = await get_channel_info(context)
+        keyboard = [
+            [InlineKeyboardButton(f"📢 {channel_info['title']}", url=channel_info["link"])],
+            [InlineKeyboardButton("✅ Obunani tekshirish", callback_data="check_subscription")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.message.reply_text(
+            f"❌ Botdan foydalanish uchun kanalga obuna bo'lishingiz kerak!",
+            reply_markup=reply_markup
+        )
+        return
     
-    # Taskni bekor qilish
-    if user_id in user_tasks:
-        try:
-            user_tasks[user_id].cancel()
-        except:
-            pass
-        user_tasks.pop(user_id, None)
+    # Kutilayotgan va navbatdagi ishni bekor qilish
+    job_scheduler.cancel(user_id)
     
     # Progress xabarini o'chirish
     await delete_progress_message(user_id, context)
     
-    # Fayllarni tozalash
-    if user_id in user_files:
-        for f in user_files[user_id]:
-            try:
-                if os.path.exists(f):
-                    os.remove(f)
-            except:
-                pass
-        user_files[user_id] = []
-    
-    # PDF counter ni reset qilish
-    user_pdf_counter[user_id] = 1
+    # Fayllarni tozalash va PDF raqamini qaytadan boshlash
+    remove_temp_files(await session_store.reset(user_id))
     
     await update.message.reply_text(
         "✅ **Barcha fayllar tozalandi!**",
@@ -1441,15 +3622,13 @@ async def check_subscription_callback(update: Update, context: ContextTypes.DEFA
     user_id = query.from_user.id
     channel_info = await get_channel_info(context)
     
-    is_subscribed = await check_subscription(user_id, context)
+    # Foydalanuvchi o'zi tekshirishni so'radi - keshni chetlab o'tish
+    is_subscribed = await check_subscription(user_id, context, force=True)
     
     if is_subscribed:
-        user_subscribed[user_id] = True
-        
         # Reset everything
-        user_files[user_id] = []
-        user_pdf_counter[user_id] = 1
-        user_progress_msg_id.pop(user_id, None)
+        remove_temp_files(await session_store.reset(user_id))
+        await delete_progress_message(user_id, context)
         
         await query.edit_message_text(
             f"✅ **Obuna tasdiqlandi!**\n\n"
@@ -1479,124 +3658,748 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     update_user_activity(user_id)
     
     # Obunani tekshirish
-    if user_id not in user_subscribed or not user_subscribed[user_id]:
-        is_subscribed = await check_subscription(user_id, context)
-        if not is_subscribed:
-            channel_info = await get_channel_info(context)
-            keyboard = [
-                [InlineKeyboardButton(f"📢 {channel_info['title']}", url=channel_info["link"])],
-                [InlineKeyboardButton("✅ Obunani tekshirish", callback_data="check_subscription")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"❌ Botdan foydalanish uchun kanalga obuna bo'lishingiz kerak!",
-                reply_markup=reply_markup
-            )
-            return
-        user_subscribed[user_id] = True
-    
-    if user_id in user_files:
-        files_count = len(user_files[user_id])
-        current_pdf = user_pdf_counter.get(user_id, 1)
+    is_subscribed = await check_subscription(user_id, context)
+    if not is_subscribed:
+        channel_info = await get_channel_info(context)
+        keyboard = [
+            [InlineKeyboardButton(f"📢 {channel_info['title']}", url=channel_info["link"])],
+            [InlineKeyboardButton("✅ Obunani tekshirish", callback_data="check_subscription")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
         
-        if files_count > 0:
-            await update.message.reply_text(
-                f"📊 **Holat:**\n"
-                f"• Keyingi PDF raqami: **#{current_pdf}**\n"
-                f"• Fayllar soni: **{files_count}**\n"
-                f"• PDF 3 soniyadan so'ng yaratiladi\n\n"
-                f"📎 **/newpdf** - Darhol PDF yaratish",
-                parse_mode='Markdown'
-            )
-        else:
-            await update.message.reply_text(
-                f"📊 **Holat:**\n"
-                f"• Keyingi PDF raqami: **#{current_pdf}**\n"
-                f"• Fayllar soni: **0**\n\n"
-                f"✅ Fayl yuborish uchun tayyor!",
-                parse_mode='Markdown'
-            )
+        await update.message.reply_text(
+            f"❌ Botdan foydalanish uchun kanalga obuna bo'lishingiz kerak!",
+            reply_markup=reply_markup
+        )
+        return
+    
+    files_count = len(await session_store.files(user_id))
+    current_pdf = await session_store.pdf_number(user_id)
+    
+    position = job_scheduler.position(user_id)
+    if files_count > 0:
+        when = f"PDF navbatda: **{position}-o'rin**" if position else "PDF fayllar kelishi to'xtagach yaratiladi"
+        await update.message.reply_text(
+            f"📊 **Holat:**\n"
+            f"• Keyingi PDF raqami: **#{current_pdf}**\n"
+            f"• Fayllar soni: **{files_count}**\n"
+            f"• {when}\n\n"
+            f"📎 **/newpdf** - Darhol PDF yaratish",
+            parse_mode='Markdown'
+        )
     else:
         await update.message.reply_text(
-            "📄 **Fayl yuborish uchun tayyor!**",
+            f"📊 **Holat:**\n"
+            f"• Keyingi PDF raqami: **#{current_pdf}**\n"
+            f"• Fayllar soni: **0**\n\n"
+            f"✅ Fayl yuborish uchun tayyor!",
             parse_mode='Markdown'
         )
 
-# ===== MAIN =====
-def main():
-    app = ApplicationBuilder().token(TOKEN).build()
-    
-    # Command handlers
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("newpdf", new_pdf))
-    app.add_handler(CommandHandler("clean", clean))
-    app.add_handler(CommandHandler("status", status))
-    app.add_handler(CommandHandler("admin", admin_panel))
-    app.add_handler(CommandHandler("addadmin", add_admin_command))
-    app.add_handler(CommandHandler("removeadmin", remove_admin_command))
-    app.add_handler(CommandHandler("broadcast", broadcast_command))
-    
-    # Callback handlers
-    app.add_handler(CallbackQueryHandler(check_subscription_callback, pattern="check_subscription"))
-    app.add_handler(CallbackQueryHandler(admin_stats_callback, pattern="admin_stats"))
-    app.add_handler(CallbackQueryHandler(admin_users_callback, pattern="admin_users"))
-    app.add_handler(CallbackQueryHandler(admin_daily_callback, pattern="admin_daily"))
-    app.add_handler(CallbackQueryHandler(admin_manage_callback, pattern="admin_manage"))
-    app.add_handler(CallbackQueryHandler(admin_export_callback, pattern="admin_export"))
-    app.add_handler(CallbackQueryHandler(admin_back_callback, pattern="admin_back"))
-    
-    # Message handlers
-    app.add_handler(MessageHandler(filters.Document.ALL | filters.PHOTO, collect))
-    
-    print("🤖 Bot ishga tushdi")
+# PDF render dvigateli (jarayonlar birinchi PDF da ishga tushadi)
+render_engine = PdfRenderEngine(RENDER_WORKERS)
+
+# ===== YANGILANISHLARNI TARQATISH =====
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Turli foydalanuvchilar yangilanishlari parallel, bitta foydalanuvchiniki kelish tartibida"""
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # user_id -> navbatdagi (yangilanish, coroutine, future) lar; har biriga bitta drain taski
+        self._users = {}
+        self._drains = set()
+
+    @staticmethod
+    def update_key(update):
+        """Yangilanish kimga tegishli (foydalanuvchi, bo'lmasa chat)"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        key = self.update_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        
+        # Yangilanish foydalanuvchi navbatiga qo'yiladi va shu yerda hech narsa band
+        # qilinmaydi: navbatni foydalanuvchining yagona drain taski kelish tartibida
+        # bajaradi, umumiy semafor esa faqat bajarilayotgan yangilanishga olinadi
+        future = asyncio.get_running_loop().create_future()
+        pending = self._users.get(key)
+        if pending is None:
+            pending = self._users[key] = deque()
+            task = asyncio.create_task(self._drain(key, pending))
+            self._drains.add(task)
+            task.add_done_callback(self._drains.discard)
+        pending.append((update, coroutine, future))
+        await future
+
+    async def _drain(self, key, pending):
+        """Bitta foydalanuvchi navbatini tartib bilan bajarish; navbat bo'shasa task tugaydi"""
+        try:
+            while pending:
+                update, coroutine, future = pending.popleft()
+                try:
+                    await super().process_update(update, coroutine)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(None)
+        finally:
+            del self._users[key]
+            # Task bekor qilinsa navbatda qolganlar kutib qolmasligi uchun
+            while pending:
+                _, coroutine, future = pending.popleft()
+                coroutine.close()
+                future.cancel()
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        for task in list(self._drains):
+            task.cancel()
+        await asyncio.gather(*self._drains, return_exceptions=True)
+
+
+# ===== WEBHOOK SERVERI =====
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_MAX_BODY = 1024 * 1024        # Telegram yangilanishlari bundan ancha kichik
+WEBHOOK_IDLE_TIMEOUT = 75             # Keep-alive ulanish shuncha soniya jim tursa yopiladi
+WEBHOOK_DRAIN_TIMEOUT = 10            # To'xtashda navbatdagi yangilanishlarni kutish (soniya)
+
+HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable",
+}
 
-    app = Flask(__name__)
+def webhook_secret_token():
+    """Telegram har so'rovda yuboradigan maxfiy sarlavha - begona POST larni rad etish uchun"""
+    return hashlib.sha256(f"webhook:{TOKEN}".encode()).hexdigest()
 
-    application = ApplicationBuilder().token(TOKEN).build()
 
-    # ===== HANDLERLARNI QO‘SHISH =====
+class UpdateDispatcher:
+    """Cheklangan navbat: qabul qilingan yangilanishlarni Application ga tarqatadi
+
+    queue_size - qabul qilingan, lekin hali qayta ishlanmagan yangilanishlar chegarasi.
+    Parallellik va foydalanuvchi ichidagi tartib application.update_processor da.
+    """
+
+    def __init__(self, application, queue_size, on_done=None):
+        self.application = application
+        self.queue_size = queue_size
+        self.queue = asyncio.Queue()
+        self.on_done = on_done  # Har bir yangilanish qayta ishlangandan keyin chaqiriladi
+        self.dropped = 0
+        self.pending = 0  # Navbatdagi va qayta ishlanayotgan yangilanishlar
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._pump = None
+        self._tasks = set()
+
+    def offer(self, data):
+        """Yangilanishni navbatga qo'yish (navbat to'la bo'lsa False)"""
+        if self.pending >= self.queue_size:
+            self.dropped += 1
+            updates_rejected.inc()
+            return False
+        self.pending += 1
+        self._idle.clear()
+        self.queue.put_nowait(data)
+        return True
+
+    async def start(self):
+        self._pump = asyncio.create_task(self._run(), name="update-dispatcher")
+
+    async def stop(self):
+        """Navbatni qayta ishlab bo'lish va tasklarni yopish"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Navbatda {self.pending} ta yangilanish qoldi")
+        tasks = [self._pump] + list(self._tasks) if self._pump else list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pump = None
+
+    async def _run(self):
+        # Yangilanish darhol update_processor ga topshiriladi - band foydalanuvchi
+        # navbati boshqalarni ushlab turmaydi
+        while True:
+            data = await self.queue.get()
+            task = asyncio.create_task(self._process(data))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, data):
+        application = self.application
+        try:
+            update = Update.de_json(data, application.bot)
+            # update_processor bir vaqtdagi yangilanishlar chegarasini qo'llaydi
+            await application.update_processor.process_update(
+                update, application.process_update(update)
+            )
+        except Exception as e:
+            print(f"Yangilanishni qayta ishlash xatosi: {e}")
+        finally:
+            self.pending -= 1
+            if not self.pending:
+                self._idle.set()
+            if self.on_done is not None:
+                self.on_done()
+
+
+class WebhookServer:
+    """asyncio ustidagi minimal HTTP server: yangilanishni darhol tasdiqlab, sink.offer() ga beradi
+
+    sink navbati to'la bo'lsa 503 qaytariladi - Telegram yangilanishni keyinroq qayta yuboradi.
+    """
+
+    def __init__(self, sink, host, port, secret_token=None, pages=None):
+        self.sink = sink
+        self.host = host
+        self.port = port
+        self.secret_token = secret_token
+        self.pages = pages or {}  # GET yo'li -> async () -> (matn, content-type)
+        self._server = None
+        self._connections = set()
+
+    async def start(self):
+        """Portni tinglashni boshlash"""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f"🌐 Webhook {self.host}:{self.port}{WEBHOOK_PATH} da tinglanmoqda")
+
+    async def stop(self):
+        """Yangi so'rovlarni qabul qilishni to'xtatish"""
+        if self._server is not None:
+            self._server.close()
+            # Keep-alive ulanishlar server.close() bilan yopilmaydi
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            # Telegram ulanishni qayta ishlatadi (HTTP/1.1 keep-alive)
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), WEBHOOK_IDLE_TIMEOUT)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, text, content_type = await self._route(method, path, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._respond(writer, status, text, keep_alive, content_type)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError:
+            # Buzilgan so'rov yoki juda uzun sarlavha
+            self._respond(writer, 400, "", False)
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader):
+        """So'rov qatori, sarlavhalar va tanani o'qish (ulanish yopilgan bo'lsa None)"""
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > WEBHOOK_MAX_BODY:
+            raise ValueError("body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?", 1)[0], headers, body
+
+    async def _route(self, method, path, headers, body):
+        if method in ("GET", "HEAD"):
+            if path == "/":
+                return 200, "Telegram bot Web Service ishlayapti ✅", "text/plain; charset=utf-8"
+            if path in self.pages:
+                return (200,) + await self.pages[path]()
+        if path != WEBHOOK_PATH:
+            return 404, "", None
+        if method != "POST":
+            return 405, "", None
+        if self.secret_token and headers.get("x-telegram-bot-api-secret-token") != self.secret_token:
+            return 403, "", None
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, "", None
+        if not self.sink.offer(data):
+            return 503, "", None
+        return 200, "", None
+
+    @staticmethod
+    def _respond(writer, status, text, keep_alive, content_type=None):
+        body = text.encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            f"Content-Type: {content_type or 'text/plain; charset=utf-8'}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+async def collect_metrics(dispatcher=None):
+    """Gauge larni joriy holat bilan yangilab, shu jarayon metrikalarini yig'ish"""
+    pending_sessions_gauge.set(len(await session_store.pending_users()))
+    active_renders_gauge.set(render_engine.active_renders)
+    render_queue_gauge.set(render_engine.queue_depth)
+    job_queue_gauge.set(job_scheduler.queue_depth)
+    if dispatcher is not None:
+        update_queue_gauge.set(dispatcher.pending)
+    return metrics.collect()
+
+async def metrics_page(dispatcher=None):
+    """/metrics - Prometheus matn formati"""
+    return render_metrics([(await collect_metrics(dispatcher), ())]), PROMETHEUS_CONTENT_TYPE
+
+
+# ===== SHARDLAR (KO'P JARAYONLI REJIM) =====
+SHARD_CHECK_INTERVAL = 1.0   # Worker jarayonlari holatini tekshirish oralig'i (soniya)
+SHARD_RESTART_DELAY = 2.0    # To'xtagan worker qayta ishga tushirilgunga qadar (soniya)
+SHARD_STOP_TIMEOUT = 30      # To'xtashda workerlar ishini tugatishini kutish (soniya)
+SHARD_METRICS_DIR = "temp/metrics"  # Workerlar metrikalari shu yerga yoziladi, ingress o'qiydi
+SHARD_METRICS_INTERVAL = 5   # Worker metrikalarini yozish oralig'i (soniya)
+
+def shard_metrics_path(index):
+    return os.path.join(SHARD_METRICS_DIR, f"shard-{index}.json")
+
+
+class MetricsSnapshotWriter:
+    """Shard worker metrikalarini vaqti-vaqti bilan faylga yozadi (ingress /metrics da birlashtiradi)
+
+    Jarayonlar orasida navbat emas, fayl ishlatiladi: yozayotganda o'lgan worker
+    hech qanday qulfni ushlab qolmaydi, os.replace tufayli chala fayl o'qilmaydi.
+    """
+
+    def __init__(self, path, dispatcher, interval=SHARD_METRICS_INTERVAL):
+        self.path = path
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.write()
+            except Exception as e:
+                print(f"Metrikalarni yozish xatosi: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def write(self):
+        data = json.dumps(await collect_metrics(self.dispatcher))
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def update_user_id(data):
+    """Xom yangilanishdan foydalanuvchi (bo'lmasa chat) ID si - de_json qilmasdan"""
+    for value in data.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user") or value.get("chat")
+            if sender:
+                return sender.get("id")
+    return None
+
+def shard_for(key, shards):
+    """Rendezvous hashing: shard yo'qolsa faqat uning foydalanuvchilari boshqasiga o'tadi"""
+    return max(shards, key=lambda shard: hashlib.blake2b(f"{key}:{shard}".encode(), digest_size=8).digest())
+
+
+class ShardRouter:
+    """Ingress: yangilanishlarni user_id bo'yicha worker jarayonlariga yo'naltiradi
+
+    Har bir foydalanuvchi doim bitta workerga tushadi (PerUserUpdateProcessor tartibi saqlanadi).
+    Worker to'xtasa, uning foydalanuvchilari qolgan workerlarga o'tadi va worker qayta
+    ishga tushgach o'ziga qaytadi. Sessiyalar umumiy SQLite omborida bo'lgani uchun
+    foydalanuvchi o'tganda fayllari yo'qolmaydi; faqat o'lgan worker navbatidagi
+    (Telegram ga tasdiqlangan) yangilanishlar yo'qoladi.
+    """
+
+    def __init__(self, count, queue_size):
+        self._ctx = multiprocessing.get_context("spawn")
+        self.count = count
+        self.queue_size = queue_size
+        self.queues = [self._ctx.Queue() for _ in range(count)]
+        self.ready = [self._ctx.Event() for _ in range(count)]
+        self.taken = self._ctx.Array("q", count)  # Worker navbatdan olgan yangilanishlar
+        self.done = self._ctx.Array("q", count)   # Worker qayta ishlab bo'lganlari
+        self.sent = [0] * count
+        self.restarts = [0] * count
+        self.processes = [None] * count
+        self.dropped = 0
+        self._live = []
+        self._monitor = None
+
+    def depth(self, index):
+        """Shard navbatidagi va qayta ishlanayotgan yangilanishlar"""
+        return self.sent[index] - self.done[index]
+
+    def offer(self, data):
+        """Yangilanishni foydalanuvchining shardiga yuborish (shard navbati to'la bo'lsa False)"""
+        if not self._live:
+            self.dropped += 1
+            updates_rejected.inc()
+            return False
+        key = update_user_id(data)
+        index = shard_for(data.get("update_id") if key is None else key, self._live)
+        if self.depth(index) >= self.queue_size:
+            self.dropped += 1
+            updates_rejected.inc()
+            return False
+        self.queues[index].put(data)
+        self.sent[index] += 1
+        return True
+
+    def _spawn(self, index):
+        self.ready[index].clear()
+        # daemon emas - worker o'zining render jarayonlarini yaratadi
+        process = self._ctx.Process(
+            target=run_shard_worker,
+            args=(index, self.count, self.queues[index], self.taken, self.done, self.ready[index]),
+            name=f"shard-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def start(self):
+        os.makedirs(SHARD_METRICS_DIR, exist_ok=True)
+        for index in range(self.count):
+            self._spawn(index)
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        restart_at = {}
+        while True:
+            now = time.monotonic()
+            live = []
+            for index, process in enumerate(self.processes):
+                if process.is_alive():
+                    if self.ready[index].is_set():
+                        live.append(index)
+                elif index not in restart_at:
+                    print(f"Shard #{index} to'xtadi (kod {process.exitcode}), foydalanuvchilari boshqa shardlarga o'tdi")
+                    self._reset_shard(index)
+                    restart_at[index] = now + SHARD_RESTART_DELAY
+                elif now >= restart_at[index]:
+                    del restart_at[index]
+                    self.restarts[index] += 1
+                    self._spawn(index)
+            self._live = live
+            await asyncio.sleep(SHARD_CHECK_INTERVAL)
+
+    def _reset_shard(self, index):
+        # O'lgan worker get() ichida navbat qulfini ushlab qolgan bo'lishi mumkin - navbat
+        # yangisiga almashtiriladi. Unda qolgan yangilanishlar worker bilan birga yo'qoladi
+        old = self.queues[index]
+        self.queues[index] = self._ctx.Queue()
+        old.cancel_join_thread()
+        old.close()
+        self.sent[index] = self.taken[index] = self.done[index] = 0
+        # Eski worker metrikalari endi yangilanmaydi
+        try:
+            os.remove(shard_metrics_path(index))
+        except OSError:
+            pass
+
+    async def metrics_page(self):
+        """/metrics - ingress metrikalari va har bir shard metrikalari (shard yorlig'i bilan)"""
+        for index in range(self.count):
+            shard_queue_gauge.set(self.depth(index), shard=index)
+        sources = [(metrics.collect(), ())]
+        for index in range(self.count):
+            try:
+                with open(shard_metrics_path(index), encoding="utf-8") as f:
+                    sources.append((json.load(f), (("shard", str(index)),)))
+            except (OSError, ValueError):
+                pass
+        return render_metrics(sources), PROMETHEUS_CONTENT_TYPE
+
+    async def status_page(self):
+        """Har bir shard holati (/shards)"""
+        shards = [
+            {
+                "shard": index,
+                "pid": process.pid if process else None,
+                "alive": index in self._live,
+                "queue_depth": self.depth(index),
+                # Navbatda (worker hali olmagan) va worker ichida qayta ishlanayotganlar:
+                # birinchisi o'sib borsa - worker navbatni o'qimayapti
+                "queued": self.sent[index] - self.taken[index],
+                "processing": self.taken[index] - self.done[index],
+                "restarts": self.restarts[index],
+            }
+            for index, process in enumerate(self.processes)
+        ]
+        return json.dumps({"shards": shards, "dropped": self.dropped}), "application/json"
+
+    async def stop(self):
+        """Workerlarga to'xtash signalini yuborish va ular tugashini kutish"""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, SHARD_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+
+
+def run_shard_worker(index, count, queue, taken, done, ready):
+    """Shard worker jarayoni: o'z foydalanuvchilarining yangilanishlarini qayta ishlaydi"""
+    # Ctrl+C ni ingress boshqaradi - worker navbatdagi None orqali to'xtaydi
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # CPU shardlar orasida bo'linadi
+    render_engine.max_workers = max(1, RENDER_WORKERS // count)
+    job_scheduler.max_running = max(1, JOB_CONCURRENCY // count)
+    # Telegram chegarasi bot uchun umumiy - har bir shard o'z ulushi bilan yuboradi
+    send_limiter.rate = send_limiter.capacity = BROADCAST_RATE / count
+    asyncio.run(_serve_shard(index, count, queue, taken, done, ready))
+
+async def _serve_shard(index, count, queue, taken, done, ready):
+    application = build_application()
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop_event.set)
+    
+    def processed():
+        done[index] += 1
+    
+    dispatcher = UpdateDispatcher(application, WEBHOOK_QUEUE_SIZE, processed)
+    
+    def deliver(data):
+        # Ingress shard navbatini cheklaydi, shuning uchun bu yerda navbat to'lmaydi
+        if not dispatcher.offer(data):
+            print(f"Shard #{index}: yangilanish tashlab yuborildi")
+            processed()
+    
+    def read_queue():
+        # mp.Queue.get bloklaydi - alohida thread da o'qib, event loop ga uzatish
+        while True:
+            data = queue.get()
+            if data is None:
+                loop.call_soon_threadsafe(stop_event.set)
+                return
+            taken[index] += 1
+            loop.call_soon_threadsafe(deliver, data)
+    
+    async def on_ready():
+        threading.Thread(target=read_queue, name=f"shard-{index}-reader", daemon=True).start()
+        ready.set()
+        print(f"🤖 Shard #{index} ishga tushdi (PID {os.getpid()})")
+    
+    writer = MetricsSnapshotWriter(shard_metrics_path(index), dispatcher)
+    await run_application(application, stop_event, [dispatcher, writer], on_ready, shard=(index, count))
+
+
+# ===== ISHGA TUSHIRISH VA TO'XTATISH =====
+async def on_startup(application, shard=None):
+    """Bot ishga tushganda tugallanmagan broadcast va PDF larni davom ettirish, eski keshni tozalash
+
+    shard = (raqam, jami) - ko'p jarayonli rejimda har bir worker faqat o'z foydalanuvchilarini
+    va egasi to'xtagan broadcastlarni davom ettiradi, keshni esa faqat 0-shard tozalaydi.
+    """
+    if shard is None or shard[0] == 0:
+        await prune_pdf_cache()
+    await broadcast_manager.resume(application.bot, claim_all=shard is None)
+    
+    owns = None
+    if shard is not None:
+        index, count = shard
+        owns = lambda user_id: shard_for(user_id, range(count)) == index
+    await job_scheduler.resume(application, owns)
+
+async def on_shutdown(application):
+    """Bot to'xtaganda fon vazifalarini to'xtatish, buferni bazaga yozish va resurslarni yopish"""
+    await job_scheduler.stop()
+    await broadcast_manager.stop()
+    await activity_buffer.stop()
+    render_engine.shutdown()
+    session_store.close()
+    db.close()
+
+async def run_application(application, stop_event, services, on_ready=None, shard=None):
+    """Application hayot sikli: initialize -> start -> xizmatlar ... stop_event ... -> stop -> shutdown"""
+    started = []
+    await application.initialize()
+    try:
+        await on_startup(application, shard)
+        await application.start()
+        for service in services:
+            await service.start()
+            started.append(service)
+        if on_ready is not None:
+            await on_ready()
+        await stop_event.wait()
+    finally:
+        print("🛑 Bot to'xtatilmoqda...")
+        for service in reversed(started):
+            await service.stop()
+        if application.running:
+            await application.stop()
+        await on_shutdown(application)
+        await application.shutdown()
+
+def stop_on_signals(stop_event):
+    """SIGINT/SIGTERM kelganda stop_event ni o'rnatish"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+async def set_webhook(bot, webhook_url, secret_token):
+    # chat_member yangilanishlari standart holatda yuborilmaydi
+    await bot.set_webhook(
+        f"{webhook_url}{WEBHOOK_PATH}",
+        allowed_updates=Update.ALL_TYPES,
+        secret_token=secret_token,
+        max_connections=40,
+    )
+
+# ===== MAIN =====
+def build_application():
+    """Barcha handlerlar bilan bitta umumiy Application"""
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .request(MetricsRequest(connection_pool_size=256))
+        .get_updates_request(MetricsRequest())
+        .concurrent_updates(PerUserUpdateProcessor(WEBHOOK_WORKERS))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    
+    # Command handlers
     application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("admin", admin_panel))
     application.add_handler(CommandHandler("newpdf", new_pdf))
     application.add_handler(CommandHandler("clean", clean))
+    application.add_handler(CommandHandler("status", status))
+    application.add_handler(CommandHandler("admin", admin_panel))
     application.add_handler(CommandHandler("addadmin", add_admin_command))
     application.add_handler(CommandHandler("removeadmin", remove_admin_command))
     application.add_handler(CommandHandler("broadcast", broadcast_command))
-
-    application.add_handler(
-        MessageHandler(
-            filters.Document.ALL | filters.PHOTO,
-            collect
-        )
-    )
-
+    application.add_handler(CommandHandler("bstatus", broadcast_status_command))
+    
+    # Callback handlers
+    application.add_handler(CallbackQueryHandler(check_subscription_callback, pattern="check_subscription"))
     application.add_handler(CallbackQueryHandler(admin_stats_callback, pattern="admin_stats"))
     application.add_handler(CallbackQueryHandler(admin_users_callback, pattern="admin_users"))
     application.add_handler(CallbackQueryHandler(admin_daily_callback, pattern="admin_daily"))
     application.add_handler(CallbackQueryHandler(admin_manage_callback, pattern="admin_manage"))
     application.add_handler(CallbackQueryHandler(admin_export_callback, pattern="admin_export"))
     application.add_handler(CallbackQueryHandler(admin_back_callback, pattern="admin_back"))
-    application.add_handler(CallbackQueryHandler(lambda u, c: start(u, c), pattern="check_subscription"))
-
-
-    @app.route("/", methods=["GET"])
-    def home():
-        return "Telegram bot Web Service ishlayapti ✅"
-
+    
+    # Message handlers
+    application.add_handler(MessageHandler(filters.Document.ALL | filters.PHOTO, collect))
+    
+    # Kanal a'zoligi o'zgarishlari (obuna keshi uchun)
+    application.add_handler(ChatMemberHandler(channel_member_update, ChatMemberHandler.CHAT_MEMBER))
+    
+    return application
 
-    @app.route("/webhook", methods=["POST"])
-    async def webhook():
-        update = Update.de_json(request.get_json(force=True), application.bot)
-        await application.process_update(update)
-        return "ok"
+async def run_webhook(webhook_url, port):
+    """Webhook rejimi: bitta jarayon, yangilanishlar cheklangan navbat orqali"""
+    application = build_application()
+    secret_token = webhook_secret_token()
+    dispatcher = UpdateDispatcher(application, WEBHOOK_QUEUE_SIZE)
+    server = WebhookServer(
+        dispatcher, "0.0.0.0", port, secret_token,
+        pages={"/metrics": lambda: metrics_page(dispatcher)},
+    )
+    
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
+    
+    async def on_ready():
+        await set_webhook(application.bot, webhook_url, secret_token)
+        print("🤖 Bot ishga tushdi (webhook)")
+    
+    # Server oxirgi ishga tushadi va birinchi yopiladi - avval yangi so'rovlar to'xtaydi, keyin navbat tugaydi
+    await run_application(application, stop_event, [dispatcher, server], on_ready)
 
+async def run_sharded_webhook(webhook_url, port, shards):
+    """Ko'p jarayonli rejim: bu jarayon faqat qabul qiladi, ishni shard workerlar bajaradi"""
+    if SESSION_STORE == "memory":
+        print("⚠️ SESSION_STORE=memory: shard to'xtasa foydalanuvchilar fayllari yo'qoladi")
+    secret_token = webhook_secret_token()
+    router = ShardRouter(shards, WEBHOOK_QUEUE_SIZE)
+    server = WebhookServer(
+        router, "0.0.0.0", port, secret_token,
+        pages={"/shards": router.status_page, "/metrics": router.metrics_page},
+    )
+    
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
+    
+    await router.start()
+    try:
+        await server.start()
+        async with Bot(TOKEN) as bot:
+            await set_webhook(bot, webhook_url, secret_token)
+        print(f"🤖 Bot ishga tushdi (webhook, {shards} ta shard)")
+        await stop_event.wait()
+    finally:
+        print("🛑 Bot to'xtatilmoqda...")
+        await server.stop()
+        await router.stop()
 
-    if __name__ == "__main__":
-        WEBHOOK_URL = os.environ.get("RENDER_EXTERNAL_URL")
-        application.bot.set_webhook(f"{WEBHOOK_URL}/webhook")
-        app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 10000)))
+def main():
+    webhook_url = os.environ.get("RENDER_EXTERNAL_URL")
+    port = int(os.environ.get("PORT", 10000))
+    if webhook_url and SHARD_WORKERS > 1:
+        asyncio.run(run_sharded_webhook(webhook_url, port, SHARD_WORKERS))
+    elif webhook_url:
+        asyncio.run(run_webhook(webhook_url, port))
+    else:
+        # Lokal ishga tushirish - webhook manzili yo'q
+        print("🤖 Bot ishga tushdi (polling)")
+        build_application().run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import json
+import importlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Testlar uchun sozlamalar: bitta render jarayoni, sessiyalar xotirada, keshlar o'chirilgan
+TEST_CONFIG = {
+    "CHANNEL_USERNAME": "@test_channel",
+    "ADMIN_IDS": [],
+    "RENDER_WORKERS": 1,
+    "SESSION_STORE": "memory",
+    "IMAGE_CACHE_BYTES": 0,
+    "PDF_CACHE_DAYS": 0,
+}
+
+
+@pytest.fixture(scope="session")
+def bot(tmp_path_factory):
+    """bot.py ni vaqtinchalik ish papkasida import qilish (haqiqiy data/ ga tegmaydi)"""
+    workdir = tmp_path_factory.mktemp("bot")
+    os.makedirs(workdir / "data")
+    os.makedirs(workdir / "temp")
+    with open(workdir / "data" / "config.json", "w", encoding="utf-8") as f:
+        json.dump(TEST_CONFIG, f)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    module = importlib.import_module("bot")
+    try:
+        yield module
+    finally:
+        module.render_engine.shutdown()
+        module.session_store.close()
+        module.db.close()
+        os.chdir(cwd)
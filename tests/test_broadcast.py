@@ -0,0 +1,68 @@
+import asyncio
+
+
+class StubBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+
+
+def add_users(bot, user_ids):
+    async def run():
+        await bot.db.executemany(
+            "INSERT OR IGNORE INTO users (user_id, first_name) VALUES (?, 'u')",
+            [(user_id,) for user_id in user_ids],
+        )
+    asyncio.run(run())
+
+
+def run_broadcast(bot, manager, stub, text):
+    async def run():
+        broadcast_id = await manager.create(text, 1)
+        manager.start(stub, broadcast_id, text)
+        await asyncio.gather(*manager._tasks.values())
+        return await manager.progress(broadcast_id)
+    return asyncio.run(run())
+
+
+def test_broadcast_retries_after_error(bot, monkeypatch):
+    add_users(bot, range(1000, 1010))
+    manager = bot.BroadcastManager(bot.db, bot.TokenBucket(1000), 4, 3)
+    monkeypatch.setattr(manager, "RETRY_DELAY", 0)
+
+    # Ikkinchi sahifani o'qishda bir marta xatolik - qayta urinish qolgan joydan davom etadi
+    original = bot._next_pending_page
+    calls = []
+
+    def flaky(conn, broadcast_id, after_user_id, limit):
+        calls.append(after_user_id)
+        if len(calls) == 2:
+            raise RuntimeError("database is locked")
+        return original(conn, broadcast_id, after_user_id, limit)
+    monkeypatch.setattr(bot, "_next_pending_page", flaky)
+
+    stub = StubBot()
+    progress = run_broadcast(bot, manager, stub, "salom")
+
+    users = asyncio.run(bot.db.fetchone("SELECT COUNT(*) FROM users"))[0]
+    assert progress["status"] == "done"
+    assert progress["sent"] == users
+    assert sorted(stub.sent) == sorted(set(stub.sent))
+
+
+def test_broadcast_marked_failed_after_retries(bot, monkeypatch):
+    add_users(bot, range(1000, 1010))
+    manager = bot.BroadcastManager(bot.db, bot.TokenBucket(1000), 4, 3)
+    monkeypatch.setattr(manager, "RETRY_DELAY", 0)
+
+    def broken(conn, broadcast_id, after_user_id, limit):
+        raise RuntimeError("disk I/O error")
+    monkeypatch.setattr(bot, "_next_pending_page", broken)
+
+    progress = run_broadcast(bot, manager, StubBot(), "salom")
+
+    # 'running' da qolmaydi - keyingi ishga tushishda resume uni olmaydi
+    assert progress["status"] == "failed"
+    assert not progress["running"]
@@ -0,0 +1,28 @@
+# Asl clean_text dagi almashtirishlar (lug'atda takrorlangan kalitning oxirgi qiymati qoladi)
+BASELINE_REPLACEMENTS = {
+    "â€™": "'",
+    'â€"': "--",
+    "â€˜": "'",
+    "\x00": "",
+    "\r\n": "\n",
+    "\r": "\n",
+}
+
+
+def baseline_clean_text(text):
+    for old, new in BASELINE_REPLACEMENTS.items():
+        text = text.replace(old, new)
+    return text.strip()
+
+
+def test_clean_text_matches_baseline(bot):
+    samples = [
+        "Itâ€™s fine",
+        'a â€" b',
+        "â€˜quotedâ€™",
+        "line\r\nnext\rlast\x00",
+        "  oddiy matn  ",
+        "o‘zbek â harfi",
+    ]
+    for text in samples:
+        assert bot.clean_text(text) == baseline_clean_text(text), repr(text)
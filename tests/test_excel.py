@@ -0,0 +1,27 @@
+import re
+import zipfile
+
+import openpyxl
+
+
+def test_wrong_dimension_tag_keeps_all_rows(bot, tmp_path):
+    source = tmp_path / "source.xlsx"
+    wb = openpyxl.Workbook()
+    for n in range(50):
+        wb.active.append([f"qator {n}", n])
+    wb.save(source)
+
+    # Ba'zi eksport dasturlari kabi noto'g'ri <dimension ref="A1:A1"> yozish
+    broken = tmp_path / "broken.xlsx"
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(broken, "w") as dst:
+        for item in src.infolist():
+            data = src.read(item.filename)
+            if item.filename == "xl/worksheets/sheet1.xml":
+                data = re.sub(rb'<dimension ref="[^"]*"/>', b'<dimension ref="A1:A1"/>', data)
+            dst.writestr(item, data)
+
+    sheets = [(title, list(rows)) for title, rows in bot.process_excel_file(str(broken))]
+    assert len(sheets) == 1
+    rows = sheets[0][1]
+    assert len(rows) == 50
+    assert rows[-1] == ["qator 49", "49"]
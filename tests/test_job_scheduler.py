@@ -0,0 +1,101 @@
+import asyncio
+
+
+def make_scheduler(bot, monkeypatch):
+    scheduler = bot.JobScheduler(1, 0.2, 1)
+    submitted = []
+
+    async def submit(user_id, context):
+        submitted.append(user_id)
+    monkeypatch.setattr(scheduler, "submit", submit)
+    return scheduler, submitted
+
+
+def test_twenty_photo_selection_becomes_one_pdf(bot, monkeypatch):
+    scheduler, submitted = make_scheduler(bot, monkeypatch)
+
+    async def run():
+        # Telegram 20 ta rasmni ikkita 10 talik albom qilib, ketma-ket yuboradi
+        for group in ("album-1", "album-2"):
+            for _ in range(bot.ALBUM_MAX_ITEMS):
+                scheduler.file_started(1, group)
+                await scheduler.file_done(1, None, True)
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(bot.ALBUM_FULL_DELAY + 0.3)
+
+    asyncio.run(run())
+    assert submitted == [1]
+
+
+def test_single_full_album_starts_quickly(bot, monkeypatch):
+    scheduler, submitted = make_scheduler(bot, monkeypatch)
+
+    async def run():
+        for _ in range(bot.ALBUM_MAX_ITEMS):
+            scheduler.file_started(1, "album")
+            await scheduler.file_done(1, None, True)
+        # ALBUM_DELAY dan oldin boshlanadi
+        await asyncio.sleep(bot.ALBUM_FULL_DELAY + 0.15)
+        return list(submitted)
+
+    assert asyncio.run(run()) == [1]
+
+
+def test_finished_users_are_forgotten(bot, monkeypatch):
+    scheduler = bot.JobScheduler(2, 0.05, 0.2)
+
+    class Context:
+        bot = None
+
+    async def files(user_id):
+        return [{"path": "x.jpg"}]
+
+    async def claim(user_id):
+        return [], 1
+
+    async def nothing(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(bot.session_store, "files", files)
+    monkeypatch.setattr(bot.session_store, "claim", claim)
+    monkeypatch.setattr(bot.progress_reporter, "close", nothing)
+    monkeypatch.setattr(bot.progress_reporter, "move", lambda *args: None)
+    monkeypatch.setattr(bot.progress_reporter, "set", lambda *args: None)
+
+    async def run():
+        for user_id in range(1, 51):
+            await scheduler.submit(user_id, Context())
+        while scheduler.running or scheduler.queue_depth:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert scheduler._finish == {}
+
+
+def test_stale_pace_entries_are_pruned(bot):
+    scheduler = bot.JobScheduler(1, 0.01, 0.02)
+
+    async def run():
+        for user_id in range(100):
+            scheduler.file_started(user_id)
+        await asyncio.sleep(scheduler.max_delay * 2 + 0.02)
+        scheduler.file_started(1000)
+
+    asyncio.run(run())
+    assert list(scheduler._pace) == [1000]
+
+
+def test_failed_download_drops_batch(bot, monkeypatch):
+    scheduler, submitted = make_scheduler(bot, monkeypatch)
+
+    async def run():
+        # Ikkita fayl yuklanmoqda: biri muvaffaqiyatsiz, keyin ikkinchisi ham
+        scheduler.file_started(1)
+        scheduler.file_started(1)
+        await scheduler.file_done(1, None, False)
+        assert 1 in scheduler._batches
+        await scheduler.file_done(1, None, False)
+
+    asyncio.run(run())
+    assert scheduler._batches == {}
+    assert submitted == []
@@ -0,0 +1,16 @@
+def test_bot_api_method_labels(bot):
+    assert bot.bot_api_method("https://api.telegram.org/bot123:ABC/sendDocument") == "sendDocument"
+    assert bot.bot_api_method("https://api.telegram.org/file/bot123:ABC/photos/file_42.jpg") == "download"
+    assert bot.bot_api_method("https://api.telegram.org/file/bot123:ABC/documents/file_7.docx") == "download"
+    assert bot.bot_api_method("https://example.com/unexpected") == "other"
+
+
+def test_render_metrics_merges_sources(bot):
+    registry = bot.MetricsRegistry()
+    counter = registry.register(bot.Counter("t_total", "test", ("method",)))
+    counter.inc(method="getFile")
+    counter.inc(2, method="getFile")
+    text = bot.render_metrics([(registry.collect(), ()), (registry.collect(), (("shard", "1"),))])
+    assert "# TYPE t_total counter" in text
+    assert 't_total{method="getFile"} 3' in text
+    assert 't_total{shard="1",method="getFile"} 3' in text
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+
+def test_backends_implement_interface(bot, tmp_path):
+    bot.MemorySessionStore()
+    bot.SqliteSessionStore(str(tmp_path / "sessions.db")).close()
+
+
+def test_incomplete_backend_fails_on_creation(bot):
+    class PartialStore(bot.SessionStore):
+        async def files(self, user_id):
+            return []
+
+    with pytest.raises(TypeError):
+        PartialStore()
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_claim_complete_and_release(bot, tmp_path, backend):
+    if backend == "memory":
+        store = bot.MemorySessionStore()
+    else:
+        store = bot.SqliteSessionStore(str(tmp_path / "sessions.db"))
+
+    async def run():
+        assert await store.append(1, [{"path": "a"}, {"path": "b"}]) == (2, 1)
+        files, pdf_num = await store.claim(1)
+        assert [f["path"] for f in files] == ["a", "b"] and pdf_num == 1
+        # PDF yaratilayotganda kelgan fayl keyingi PDF ga qoladi
+        await store.append(1, [{"path": "c"}])
+        await store.complete(1)
+        assert [f["path"] for f in await store.files(1)] == ["c"]
+        assert await store.pdf_number(1) == 2
+
+        await store.claim(1)
+        await store.release(1)
+        assert [f["path"] for f in await store.files(1)] == ["c"]
+        assert await store.pdf_number(1) == 2
+
+    try:
+        asyncio.run(run())
+    finally:
+        store.close()
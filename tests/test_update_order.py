@@ -0,0 +1,184 @@
+import re
+import zlib
+import random
+import asyncio
+import itertools
+
+from PIL import Image
+
+USERS = (101, 102, 103)
+ALBUM_SIZE = 10
+
+
+def image_width(index):
+    # Har bir albom elementi o'z eni bilan - PDF sahifasidan qaysi rasm ekanini bilish uchun
+    return 300 + index * 20
+
+
+def album_update(user_id, index):
+    message_id = user_id * 100 + index
+    return {
+        "update_id": message_id,
+        "message": {
+            "message_id": message_id, "date": 0, "media_group_id": f"album-{user_id}",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "photo": [{"file_id": f"{user_id}:{index}", "file_unique_id": f"u{message_id}",
+                       "width": image_width(index), "height": 200}],
+        },
+    }
+
+
+class StubFile:
+    def __init__(self, file_id, delay):
+        self.index = int(file_id.split(":")[1])
+        self.delay = delay
+
+    async def download_to_drive(self, path):
+        # Tasodifiy kechikish - ketma-ketlik buzilsa keyingi rasm oldinroq yuklanadi
+        await asyncio.sleep(self.delay)
+        Image.new("RGB", (image_width(self.index), 200), (self.index * 20, 80, 160)).save(path, "JPEG")
+
+
+class StubMessage:
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self.document = None
+
+
+class StubBot:
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.documents = {}  # user_id -> [PDF baytlari]
+        self._ids = itertools.count(1)
+
+    async def get_file(self, file_id):
+        return StubFile(file_id, self.random.uniform(0, 0.05))
+
+    async def send_document(self, chat_id, document, **kwargs):
+        data = document.read() if hasattr(document, "read") else bytes(document)
+        self.documents.setdefault(chat_id, []).append(data)
+        return StubMessage(next(self._ids))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return StubMessage(next(self._ids))
+
+    async def edit_message_text(self, *args, **kwargs):
+        pass
+
+    async def delete_message(self, *args, **kwargs):
+        pass
+
+
+class StubContext:
+    def __init__(self, bot):
+        self.bot = bot
+
+
+class CollectApplication:
+    """Faqat collect handleri bor Application o'rnini bosuvchi"""
+
+    bot = None
+
+    def __init__(self, bot, update_processor, context):
+        self.module = bot
+        self.update_processor = update_processor
+        self.context = context
+
+    async def process_update(self, update):
+        await self.module.collect(update, self.context)
+
+
+def page_widths(data):
+    """Har bir sahifada chizilgan rasmning eni, sahifalar tartibida
+
+    fpdf2 barcha sahifalarga umumiy resurslar beradi, shuning uchun rasm sahifa
+    mazmunidagi "/In Do" buyrug'idan topiladi (qo'shimcha PDF kutubxonasisiz).
+    """
+    objects = {int(num): body for num, body in re.findall(rb"(\d+) 0 obj(.*?)endobj", data, re.S)}
+
+    def ref(body, key):
+        return int(re.search(rb"/" + key + rb" (\d+) 0 R", body).group(1))
+
+    def stream(body):
+        raw = body[body.index(b"stream") + len(b"stream"):].lstrip(b"\r\n")
+        return zlib.decompressobj().decompress(raw) if b"/FlateDecode" in body else raw
+
+    pages_body = next(body for body in objects.values() if re.search(rb"/Type /Pages\b", body))
+    kids = [int(num) for num in re.findall(rb"(\d+) 0 R", re.search(rb"/Kids \[(.*?)\]", pages_body, re.S).group(1))]
+
+    widths = []
+    for page in kids:
+        content = stream(objects[ref(objects[page], b"Contents")])
+        name = re.search(rb"/(I\d+) Do", content).group(1)
+        image = objects[ref(objects[ref(objects[page], b"Resources")], name)]
+        widths.append(int(re.search(rb"/Width (\d+)", image).group(1)))
+    return widths
+
+
+def test_concurrent_albums_keep_page_order(bot, monkeypatch):
+    async def subscribed(user_id, context):
+        return True
+    monkeypatch.setattr(bot, "check_subscription", subscribed)
+
+    stub = StubBot(seed=1)
+    application = CollectApplication(bot, bot.PerUserUpdateProcessor(16), StubContext(stub))
+
+    async def run():
+        dispatcher = bot.UpdateDispatcher(application, 1000)
+        await dispatcher.start()
+        # Albomlar bir vaqtda keladi: qismlari foydalanuvchilar orasida aralashgan
+        for index in range(ALBUM_SIZE):
+            for user_id in USERS:
+                assert dispatcher.offer(album_update(user_id, index))
+        await dispatcher.stop()
+
+        scheduler = bot.job_scheduler
+        for _ in range(600):
+            if len(stub.documents) == len(USERS) and not (scheduler.running or scheduler.queue_depth):
+                break
+            await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+
+    expected = [image_width(index) for index in range(ALBUM_SIZE)]
+    for user_id in USERS:
+        documents = stub.documents.get(user_id, [])
+        assert len(documents) == 1, f"{user_id}: {len(documents)} ta PDF"
+        assert page_widths(documents[0]) == expected
+
+
+def test_busy_user_does_not_delay_others(bot):
+    busy_user, other_user = 201, 202
+    finished = {}
+
+    class SlowApplication:
+        bot = None
+
+        def __init__(self, update_processor):
+            self.update_processor = update_processor
+
+        async def process_update(self, update):
+            await asyncio.sleep(0.1)
+            finished.setdefault(update.effective_user.id, []).append(asyncio.get_running_loop().time())
+
+    def update(user_id, index):
+        data = album_update(user_id, index)
+        data["update_id"] += 10000
+        return data
+
+    async def run():
+        dispatcher = bot.UpdateDispatcher(SlowApplication(bot.PerUserUpdateProcessor(16)), 1000)
+        await dispatcher.start()
+        started = asyncio.get_running_loop().time()
+        for index in range(40):
+            dispatcher.offer(update(busy_user, index))
+        dispatcher.offer(update(other_user, 0))
+        await dispatcher.stop()
+        return started
+
+    started = asyncio.run(run())
+
+    # Band foydalanuvchi yangilanishlari ketma-ket (40 x 0.1 s), boshqasi ularni kutmaydi
+    assert finished[busy_user][-1] - started >= 4
+    assert finished[other_user][0] - started < 0.5